@@ -0,0 +1,234 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""End-to-end benchmark
+
+Generates a synthetic dump with datagen (or reads the files in --data), and
+times each stage of a load and of queries:
+
+- parse: image_iterator and label_iterator over the files
+- stem: a cold Stemmer stemming every distinct label word
+- load_images, load_terms and query: for each backend, in a directory of
+  its own. load_terms uses the stemmer warmed by the stem stage, so it
+  times the stores rather than stemming again. A load stage ends with
+  closing its store, which is when the index store writes its file, and
+  stores are opened again before querying, except in memory. Queries are
+  one to three words of random labels.
+
+The results are written as JSON, with the commit they were measured at,
+so runs can be compared across commits. The cloud backend is skipped
+unless it is named with --backends.
+
+To run:
+$ python benchmark.py --categories 100000 --output benchmark.json
+"""
+from __future__ import print_function
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+import datagen
+import loader
+import querier
+
+
+def parse_args(prog='benchmark', description='End-to-end benchmark.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--data', help="benchmark the images_en.nt and labels_en.nt in DATA "
+                       "instead of generating them")
+    parser.add_argument(
+        '--categories', type=int, default=100000,
+        help="categories of the generated dump")
+    parser.add_argument(
+        '--vocabulary', type=int, default=50000,
+        help="distinct label words of the generated dump")
+    parser.add_argument(
+        '--image-ratio', type=float, default=0.3,
+        help="fraction of the generated categories with images")
+    parser.add_argument(
+        '--queries', type=int, default=1000, help="number of queries")
+    parser.add_argument(
+        '--parser', choices=loader.PARSER_MODES, default='bytes',
+        help="parse the data files in PARSER mode")
+    parser.add_argument(
+        '--backends', nargs='+', choices=loader.STORAGE_CHOICES.keys(),
+        default=sorted(
+            name for name in loader.STORAGE_CHOICES if name != 'cloud'),
+        help="backends to load and query")
+    parser.add_argument(
+        '--output', default='benchmark.json',
+        help="write the results as JSON to OUTPUT")
+    return parser.parse_args()
+
+
+def revision():
+    """Return the git commit of this file's tree, or None."""
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def timed(function, count=len):
+    """Call function; return (result, stats of count items).
+
+    Args:
+        function: callable, the stage to time.
+        count: int, or callable that counts the items of the result.
+    Returns:
+        tuple of result and a dict of seconds, items and items per second.
+    """
+    start = time.time()
+    result = function()
+    seconds = time.time() - start
+    if callable(count):
+        count = count(result)
+    return result, {
+        'seconds': seconds, 'items': count,
+        'rate': count / seconds if seconds else None}
+
+
+def queries(labels, count):
+    """Return count queries of one to three words of random labels."""
+    rand = random.Random(0)
+    keywords = []
+    for _ in range(count):
+        words = rand.choice(labels)[1].split(' ')
+        size = min(len(words), rand.randint(1, 3))
+        keywords.append(rand.sample(words, size))
+    return keywords
+
+
+def finish(name, kvs):
+    """Close kvs, a store of backend name, or only flush it in memory."""
+    if name == 'mem':
+        kvs.flush()
+    else:
+        kvs.close()
+
+
+def run_backend(name, images, labels, keywords, stemmer):
+    """Load and query backend name in the current directory."""
+    backend = loader.STORAGE_CHOICES[name]
+    results = {}
+    images_kvs = backend(loader.IMAGES_KVS_NAME)
+    terms_kvs = backend(loader.TERMS_KVS_NAME)
+
+    def load_images():
+        loader.load_images(images_kvs, iter(images))
+        finish(name, images_kvs)
+
+    def load_terms():
+        loader.load_terms(
+            terms_kvs, images_kvs, iter(labels), stemmer=stemmer)
+        finish(name, terms_kvs)
+
+    _, results['load_images'] = timed(load_images, len(images))
+    _, results['load_terms'] = timed(load_terms, len(labels))
+    if name != 'mem':
+        images_kvs = backend(loader.IMAGES_KVS_NAME)
+        terms_kvs = backend(loader.TERMS_KVS_NAME)
+    matches, results['query'] = timed(
+        lambda: [
+            len(querier.query(words, images_kvs, terms_kvs, stemmer=stemmer))
+            for words in keywords],
+        len(keywords))
+    results['query']['matches'] = sum(matches)
+    images_kvs.close()
+    terms_kvs.close()
+    return results
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output)
+    try:
+        data = args.data
+        if not data:
+            data = os.path.join(workdir, 'data')
+            datagen.generate(
+                data, categories=args.categories,
+                vocabulary_size=args.vocabulary, image_ratio=args.image_ratio)
+        images_path = os.path.join(data, datagen.IMAGES_FILE_NAME)
+        labels_path = os.path.join(data, datagen.LABELS_FILE_NAME)
+
+        stages = {}
+        images, stages['parse_images'] = timed(lambda: list(
+            loader.image_iterator(open(images_path, 'rb'), mode=args.parser)))
+        labels, stages['parse_labels'] = timed(lambda: list(
+            loader.label_iterator(open(labels_path, 'rb'), mode=args.parser)))
+        words = list(set(
+            word for _, label in labels for word in label.split(' ')))
+        stemmer = loader.Stemmer()
+        _, stages['stem'] = timed(
+            lambda: stemmer.stem_many(words), len(words))
+        keywords = queries(labels, args.queries)
+
+        backends = {}
+        for name in args.backends:
+            directory = os.path.join(workdir, name)
+            os.mkdir(directory)
+            os.chdir(directory)
+            try:
+                backends[name] = run_backend(
+                    name, images, labels, keywords, stemmer)
+            finally:
+                os.chdir(cwd)
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        'revision': revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'images': len(images),
+        'labels': len(labels),
+        'stages': stages,
+        'backends': backends,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for stage in ('parse_images', 'parse_labels', 'stem'):
+        print('{:<14}{:>9.3f}s'.format(stage, stages[stage]['seconds']))
+    print('{:<8}{:>14}{:>14}{:>14}'.format(
+        'backend', 'load_images', 'load_terms', 'queries/sec'))
+    for name in args.backends:
+        results = backends[name]
+        print('{:<8}{:>13.3f}s{:>13.3f}s{:>14,.0f}'.format(
+            name, results['load_images']['seconds'],
+            results['load_terms']['seconds'],
+            results['query']['rate'] or 0))
+    print('results written to {}'.format(output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Bloom filter
+
+A compact set of keys that answers membership with no false negatives and
+a bounded rate of false positives, in about 10 bits per key at 1%. Keys are
+hashed once with MD5, and the bit positions derived from the two halves of
+the digest (double hashing). A filter is saved to a file as a header, the
+epoch marker of the store it was built from, and its bit array.
+"""
+import math
+import os
+import struct
+
+from hashlib import md5
+
+# False-positive rate of a filter holding its capacity of keys.
+ERROR_RATE = 0.01
+
+_DIGEST = struct.Struct('<QQ')
+# File layout: BLOOM_MAGIC, then BLOOM_HEADER (capacity, bits, hashes,
+# error rate and epoch size), then the UTF-8 epoch, then the bit array.
+BLOOM_MAGIC = b'BLOOMF01'
+BLOOM_HEADER = struct.Struct('<3QdI')
+
+
+def _bytes(key):
+    """Return key as bytes, encoded like the stores encode keys."""
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return str(key)
+
+
+class BloomFilter(object):
+    """Bloom filter sized for capacity keys at error_rate false positives.
+
+    Adding more keys than capacity keeps every key, but raises the rate of
+    false positives. The epoch, saved with the filter, is the epoch marker
+    of the store whose keys it holds, if any.
+
+    Args:
+        capacity: int, expected number of keys
+        error_rate: float, false-positive rate at capacity
+    """
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.epoch = None
+        self.bits = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(
+            float(self.bits) / max(capacity, 1) * math.log(2))))
+        self._bits = bytearray((self.bits + 7) // 8)
+
+    @property
+    def nbytes(self):
+        """Bytes of memory taken by the bit array."""
+        return len(self._bits)
+
+    def _positions(self, key):
+        """Return the bit positions (h1 + i * h2) % bits of key, computed
+        on reduced ints rather than 64-bit longs."""
+        h1, h2 = _DIGEST.unpack(md5(_bytes(key)).digest())
+        n = self.bits
+        pos, step = int(h1 % n), int(h2 % n)
+        positions = []
+        for _ in xrange(self.hashes):
+            positions.append(pos)
+            pos += step
+            if pos >= n:
+                pos -= n
+        return positions
+
+    def add(self, key):
+        """Add key to the filter."""
+        bits = self._bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def update(self, keys):
+        """Add an iterable of keys to the filter."""
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        bits = self._bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def save(self, path):
+        """Write the filter to path, atomically."""
+        tmp_path = path + '.tmp'
+        epoch = (self.epoch or '').encode('utf-8')
+        with open(tmp_path, 'wb') as f:
+            f.write(BLOOM_MAGIC)
+            f.write(BLOOM_HEADER.pack(
+                self.capacity, self.bits, self.hashes, self.error_rate,
+                len(epoch)))
+            f.write(epoch)
+            f.write(self._bits)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return the filter saved to path."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(BLOOM_MAGIC)] != BLOOM_MAGIC:
+            raise IOError('{}: not a Bloom filter file'.format(path))
+        pos = len(BLOOM_MAGIC)
+        capacity, bits, hashes, error_rate, size = BLOOM_HEADER.unpack_from(
+            data, pos)
+        pos += BLOOM_HEADER.size
+        epoch = data[pos:pos + size].decode('utf-8') if size else None
+        pos += size
+        bloom_filter = cls(capacity, error_rate)
+        bloom_filter.bits, bloom_filter.hashes = bits, hashes
+        bloom_filter.epoch = epoch
+        bloom_filter._bits = bytearray(data[pos:])
+        return bloom_filter
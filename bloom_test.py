@@ -0,0 +1,44 @@
+import os
+import tempfile
+import test
+import bloom
+
+
+class BloomFilterTestCase(test.TestCase):
+    def test_no_false_negatives(self):
+        keys = ['key{}'.format(i) for i in range(1000)] + range(1000)
+        bloom_filter = bloom.BloomFilter(len(keys))
+        bloom_filter.update(keys)
+        for key in keys:
+            self.assertIn(key, bloom_filter)
+
+    def test_error_rate(self):
+        bloom_filter = bloom.BloomFilter(1000, error_rate=0.01)
+        bloom_filter.update(range(1000))
+        false_positives = sum(
+            1 for key in range(1000, 11000) if key in bloom_filter)
+        self.assertLess(false_positives, 300)
+
+    def test_unicode_keys(self):
+        bloom_filter = bloom.BloomFilter(10)
+        bloom_filter.add(u'caf\xe9')
+        self.assertIn(u'caf\xe9', bloom_filter)
+        self.assertIn(u'caf\xe9'.encode('utf-8'), bloom_filter)
+
+    def test_save_load(self):
+        bloom_filter = bloom.BloomFilter(100, error_rate=0.05)
+        bloom_filter.update(range(100))
+        bloom_filter.epoch = u'00001-ab'
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            bloom_filter.save(path)
+            loaded = bloom.BloomFilter.load(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(
+            (loaded.capacity, loaded.error_rate, loaded.bits, loaded.hashes,
+             loaded.epoch),
+            (100, 0.05, bloom_filter.bits, bloom_filter.hashes, u'00001-ab'))
+        for key in range(100):
+            self.assertIn(key, loaded)
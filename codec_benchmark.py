@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Storage benchmark for prefix-coded values
+
+Loads (category, url) pairs into the images store and (word, category)
+pairs into the terms store, with values as they are and prefix-coded, and
+reports the value bytes, the DynamoDB item size (attribute names, key and
+values, as DynamoDB counts them) and the size of the disk store files.
+
+The pairs are DBpedia-shaped: resource URIs and Commons or Wikipedia
+FilePath URLs of random titles. Use --images and --labels to read a sample
+of real data files instead.
+
+To run:
+$ python codec_benchmark.py --categories 100000
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import tempfile
+
+from argparse import ArgumentParser, FileType
+from itertools import islice
+
+import kvs
+import loader
+
+RESOURCE = 'http://dbpedia.org/resource/{}'
+FILE_PATHS = [
+    'http://commons.wikimedia.org/wiki/Special:FilePath/{}',
+    'http://en.wikipedia.org/wiki/Special:FilePath/{}',
+]
+EXTENSIONS = ['.jpg', '.JPG', '.png', '.svg', '.gif']
+# Bytes DynamoDB counts for the names of the two attributes of an item.
+ATTRIBUTE_NAMES = len('kvs_key') + len('kvs_values')
+MEASURES = ('values', 'dynamodb items', 'disk files')
+
+
+def parse_args(prog='codec_benchmark', description='Prefix coding benchmark.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--categories', type=int, default=100000,
+        help="categories in the synthetic sample, or read from the files")
+    parser.add_argument(
+        '--images', type=FileType('r'), help="sample IMAGES data file")
+    parser.add_argument(
+        '--labels', type=FileType('r'), help="sample LABELS data file")
+    return parser.parse_args()
+
+
+def synthetic(categories):
+    """Return DBpedia-shaped (category, url) and (category, label) pairs."""
+    rand = random.Random(0)
+    words = [
+        ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz')
+                for _ in range(rand.randint(3, 10))).capitalize()
+        for _ in range(20000)]
+    images, labels = [], []
+    for _ in range(categories):
+        title = [rand.choice(words) for _ in range(rand.randint(1, 4))]
+        category = RESOURCE.format('_'.join(title))
+        labels.append((category, ' '.join(title)))
+        for _ in range(rand.randint(1, 2)):
+            name = '_'.join(rand.choice(words) for _ in range(3))
+            url = FILE_PATHS[rand.random() < 0.1].format(
+                name + rand.choice(EXTENSIONS))
+            images.append((category, url))
+    return images, labels
+
+
+def measure(name, pairs, coded):
+    """Load pairs into a disk store; return (value, item, file) bytes."""
+    cwd = tempfile.mkdtemp()
+    try:
+        store = kvs.Shelf(os.path.join(cwd, name))
+        if coded:
+            store = kvs.PrefixCoded(store)
+        store.put_many(pairs)
+        store.flush()
+        raw = store.kvs if coded else store
+        value_bytes = item_bytes = 0
+        for key in raw.keys():
+            size = sum(kvs._utf8_size(value) for value in raw.get(key))
+            value_bytes += size
+            item_bytes += ATTRIBUTE_NAMES + len(key) + size
+        store.close()
+        file_bytes = sum(
+            os.path.getsize(os.path.join(cwd, f)) for f in os.listdir(cwd))
+        return value_bytes, item_bytes, file_bytes
+    finally:
+        shutil.rmtree(cwd)
+
+
+def main():
+    args = parse_args()
+    if args.images and args.labels:
+        images = list(islice(
+            loader.image_iterator(args.images, mode='bytes'),
+            args.categories))
+        labels = list(islice(
+            loader.label_iterator(args.labels, mode='bytes'),
+            args.categories))
+    else:
+        images, labels = synthetic(args.categories)
+    terms = [
+        (word.lower(), category)
+        for category, label in labels for word in label.split(' ')]
+    print('{:<8}{:<16}{:>10}{:>10}{:>8}'.format(
+        'store', 'bytes', 'plain', 'coded', 'saved'))
+    for name, pairs in (('images', images), ('terms', terms)):
+        plain = measure(name, pairs, coded=False)
+        coded = measure(name, pairs, coded=True)
+        for what, before, after in zip(MEASURES, plain, coded):
+            print('{:<8}{:<16}{:>6.1f} MiB{:>6.1f} MiB{:>8.1%}'.format(
+                name, what, before / 1048576.0, after / 1048576.0,
+                1 - float(after) / before))
+
+if __name__ == '__main__':
+    main()
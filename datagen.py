@@ -0,0 +1,191 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Synthetic DBpedia data generator
+
+Writes images_en.nt and labels_en.nt files shaped like the DBpedia dumps,
+at any scale. Every category has a label of one to six words drawn from a
+Zipfian vocabulary, and a fraction of the categories have images. Each
+image comes with the triples that surround it in the real images file:
+the ontology and FOAF thumbnails and the rights of both files. The files
+start and end with the dump's comment lines.
+
+To run:
+$ python datagen.py --categories 100000 --output data
+"""
+from __future__ import print_function, unicode_literals
+
+import io
+import os
+import random
+
+from argparse import ArgumentParser
+from bisect import bisect
+from parser import IMAGE_ASSOCIATION, LABEL_ASSOCIATION
+
+IMAGES_FILE_NAME = 'images_en.nt'
+LABELS_FILE_NAME = 'labels_en.nt'
+RESOURCE = 'http://dbpedia.org/resource/{}'
+# Commons holds most images; the rest are Wikipedia uploads.
+FILE_PATHS = [
+    'http://commons.wikimedia.org/wiki/Special:FilePath/{}',
+    'http://en.wikipedia.org/wiki/Special:FilePath/{}',
+]
+COMMONS_RATIO = 0.9
+RIGHTS_PAGE = 'http://en.wikipedia.org/wiki/File:{}'
+THUMBNAIL = '{}?width=300'
+EXTENSIONS = ['.jpg', '.jpg', '.jpg', '.JPG', '.png', '.svg', '.gif']
+ONTOLOGY_THUMBNAIL = '<http://dbpedia.org/ontology/thumbnail>'
+FOAF_THUMBNAIL = '<http://xmlns.com/foaf/0.1/thumbnail>'
+RIGHTS = '<http://purl.org/dc/elements/1.1/rights>'
+HEADER = '# started 2014-07-25T21:33:17Z\n'
+FOOTER = '# completed 2014-07-25T21:49:26Z\n'
+SYLLABLES = [
+    'al', 'an', 'ar', 'ba', 'be', 'ca', 'co', 'da', 'de', 'di', 'el', 'en',
+    'er', 'fa', 'ga', 'ha', 'in', 'is', 'ka', 'la', 'le', 'li', 'lo', 'ma',
+    'me', 'mi', 'mo', 'na', 'ne', 'no', 'on', 'or', 'pa', 'ra', 're', 'ri',
+    'ro', 'sa', 'se', 'si', 'ta', 'te', 'ti', 'to', 'un', 'va', 'ya', 'za',
+]
+
+
+def parse_args(prog='datagen', description='DBpedia data generator.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--output', default='data', help="write the data files to OUTPUT")
+    parser.add_argument(
+        '--categories', type=int, default=100000,
+        help="number of labelled categories")
+    parser.add_argument(
+        '--vocabulary', type=int, default=50000,
+        help="number of distinct label words")
+    parser.add_argument(
+        '--image-ratio', type=float, default=0.3,
+        help="fraction of the categories with images")
+    parser.add_argument(
+        '--exponent', type=float, default=1.0,
+        help="exponent of the Zipf distribution of label words")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    return parser.parse_args()
+
+
+def vocabulary(size, rand):
+    """Return size distinct words of one to four syllables."""
+    words, seen = [], set()
+    while len(words) < size:
+        word = ''.join(
+            rand.choice(SYLLABLES) for _ in range(rand.randint(1, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class Zipf(object):
+    """Draws items with probabilities proportional to 1 / rank ** exponent.
+
+    Args:
+        items: list, items by rank
+        exponent: float, exponent of the distribution
+        rand: object, random.Random to draw with
+    """
+    def __init__(self, items, exponent, rand):
+        self.items = items
+        self.rand = rand
+        self._cumulative = []
+        total = 0.0
+        for rank in range(1, len(items) + 1):
+            total += 1.0 / rank ** exponent
+            self._cumulative.append(total)
+
+    def draw(self):
+        point = self.rand.random() * self._cumulative[-1]
+        return self.items[
+            min(bisect(self._cumulative, point), len(self.items) - 1)]
+
+
+def _image_triples(category, name, rand):
+    """Return the triples of an image of category named name."""
+    url = FILE_PATHS[rand.random() >= COMMONS_RATIO].format(name)
+    thumbnail = THUMBNAIL.format(url)
+    rights = RIGHTS_PAGE.format(name)
+    return [
+        '<{}> {} <{}> .\n'.format(category, IMAGE_ASSOCIATION, url),
+        '<{}> {} <{}> .\n'.format(category, ONTOLOGY_THUMBNAIL, thumbnail),
+        '<{}> {} <{}> .\n'.format(url, FOAF_THUMBNAIL, thumbnail),
+        '<{}> {} <{}> .\n'.format(url, RIGHTS, rights),
+        '<{}> {} <{}> .\n'.format(thumbnail, RIGHTS, rights),
+    ]
+
+
+def generate(output, categories=100000, vocabulary_size=50000,
+             image_ratio=0.3, exponent=1.0, seed=0):
+    """Write synthetic images and labels files to the directory output.
+
+    Args:
+        output: string, directory to write the files to
+        categories: int, number of labelled categories
+        vocabulary_size: int, number of distinct label words
+        image_ratio: float, fraction of the categories with images
+        exponent: float, exponent of the Zipf distribution of label words
+        seed: int, random seed; the same arguments write the same files
+    Returns:
+        (images path, labels path) pair.
+    """
+    rand = random.Random(seed)
+    words = Zipf(
+        [word.capitalize() for word in vocabulary(vocabulary_size, rand)],
+        exponent, rand)
+    if not os.path.exists(output):
+        os.makedirs(output)
+    images_path = os.path.join(output, IMAGES_FILE_NAME)
+    labels_path = os.path.join(output, LABELS_FILE_NAME)
+    titles = set()
+    with io.open(images_path, 'w', encoding='utf-8') as images, \
+            io.open(labels_path, 'w', encoding='utf-8') as labels:
+        images.write(HEADER)
+        labels.write(HEADER)
+        for i in range(categories):
+            label = ' '.join(
+                words.draw() for _ in range(rand.randint(1, 6)))
+            title = label.replace(' ', '_')
+            if title in titles:
+                title = '{}_({})'.format(title, i)
+            titles.add(title)
+            category = RESOURCE.format(title)
+            labels.write('<{}> {} "{}"@en .\n'.format(
+                category, LABEL_ASSOCIATION, label))
+            if rand.random() < image_ratio:
+                for n in range(1 if rand.random() < 0.9 else 2):
+                    name = '{}{}{}'.format(
+                        title, '_{}'.format(n) if n else '',
+                        rand.choice(EXTENSIONS))
+                    images.writelines(_image_triples(category, name, rand))
+        images.write(FOOTER)
+        labels.write(FOOTER)
+    return images_path, labels_path
+
+
+def main():
+    args = parse_args()
+    images_path, labels_path = generate(
+        args.output, categories=args.categories,
+        vocabulary_size=args.vocabulary, image_ratio=args.image_ratio,
+        exponent=args.exponent, seed=args.seed)
+    print('wrote {} and {}'.format(images_path, labels_path))
+
+if __name__ == '__main__':
+    main()
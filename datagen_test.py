@@ -0,0 +1,47 @@
+import shutil
+import tempfile
+import test
+import datagen
+import parser
+
+from collections import Counter
+
+
+class GenerateTestCase(test.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def _parse(self, images_path, labels_path):
+        images = list(parser.image_iterator(open(images_path), mode='bytes'))
+        labels = list(parser.label_iterator(open(labels_path), mode='bytes'))
+        return images, labels
+
+    def test_generate(self):
+        images, labels = self._parse(*datagen.generate(
+            self.output, categories=1000, vocabulary_size=200,
+            image_ratio=0.5))
+        self.assertEqual(len(labels), 1000)
+        self.assertEqual(len(set(category for category, _ in labels)), 1000)
+        categories = set(category for category, _ in images)
+        self.assertTrue(400 < len(categories) < 600)
+        self.assertTrue(categories <= set(category for category, _ in labels))
+        for category, label in labels[:10]:
+            self.assertTrue(category.startswith(
+                'http://dbpedia.org/resource/' + label.replace(' ', '_')))
+
+    def test_zipf_words(self):
+        _, labels = self._parse(*datagen.generate(
+            self.output, categories=1000, vocabulary_size=200))
+        counts = Counter(
+            word for _, label in labels for word in label.split(' '))
+        frequencies = sorted(counts.values(), reverse=True)
+        self.assertGreater(frequencies[0], 10 * frequencies[len(counts) // 2])
+
+    def test_seed(self):
+        paths = datagen.generate(self.output, categories=100, seed=1)
+        first = [open(path).read() for path in paths]
+        datagen.generate(self.output, categories=100, seed=1)
+        self.assertEqual([open(path).read() for path in paths], first)
@@ -0,0 +1,205 @@
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Incremental loading between DBpedia dump versions
+
+Finds the (category, url) and (term, category) associations added and
+removed between two versions of the data files, or reads them from a diff,
+and applies only those changes to existing stores. Progress is saved in a
+checkpoint after every batch of changes, so an interrupted load resumes
+where it stopped. Changes come in a deterministic order, and applying one
+twice is harmless.
+"""
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+
+from collections import defaultdict
+from itertools import chain, islice
+from parser import ADDED, REMOVED
+
+# Changes applied, and checkpointed, together.
+DELTA_BATCH_SIZE = 100000
+
+
+def diff_pairs(old_pairs, new_pairs):
+    """Iterate on the changes between two versions of (key, value) pairs.
+
+    Only the old pairs are held in memory.
+
+    Args:
+        old_pairs: iterable of (key, value) pairs of the previous version
+        new_pairs: iterable of (key, value) pairs of the new version
+    Yields:
+        (ADDED, pair) in the order of new_pairs, then (REMOVED, pair) in
+        sorted order.
+    """
+    old = set(old_pairs)
+    for pair in new_pairs:
+        if pair in old:
+            old.discard(pair)
+        else:
+            yield (ADDED, pair)
+    for pair in sorted(old):
+        yield (REMOVED, pair)
+
+
+def image_changes(changes, categories=None):
+    """Iterate on image changes, keyed by category ID with categories."""
+    if categories is None:
+        return iter(changes)
+    return (
+        (sign, (categories.intern(category), url))
+        for sign, (category, url) in changes)
+
+
+def term_changes(label_changes, stemmer, categories=None, labels=None):
+    """Return the (term, category) changes of a list of label changes.
+
+    The labels of each changed category are stemmed like load_terms does.
+    A term is added if it is in the category's added labels but not its
+    removed ones, and removed if it is in its removed labels but in none of
+    the labels the category has after the changes, read from labels. The
+    other labels of the changed categories are held in memory.
+
+    Args:
+        label_changes: iterable of (sign, (category, label)) pairs
+        stemmer: object, Stemmer to use
+        categories: object, Categories to store category IDs instead of URIs
+        labels: iterable of the (category, label) pairs of the new version;
+            without it, the added labels are taken to be all the labels of
+            their category
+    Returns:
+        list of (sign, (term, category)) pairs, by category.
+    """
+    changed = {ADDED: defaultdict(set), REMOVED: defaultdict(set)}
+    for sign, (category, label) in label_changes:
+        changed[sign][category].add(label)
+    if labels is None:
+        current = changed[ADDED]
+    else:
+        current = defaultdict(set)
+        for category, label in labels:
+            if category in changed[ADDED] or category in changed[REMOVED]:
+                current[category].add(label)
+    words = list(set(
+        word for label in chain(*(
+            values for by_category in (
+                changed[ADDED], changed[REMOVED], current)
+            for values in by_category.itervalues()))
+        for word in label.split(" ")))
+    stems = dict(zip(words, stemmer.stem_many(words)))
+
+    def terms(by_category, category):
+        return set(
+            stems[word] for label in by_category.get(category, ())
+            for word in label.split(" "))
+
+    changes = []
+    for category in sorted(set(changed[ADDED]) | set(changed[REMOVED])):
+        old = terms(changed[REMOVED], category)
+        new = terms(changed[ADDED], category)
+        kept = terms(current, category)
+        if categories is not None:
+            category = categories.intern(category)
+        changes.extend(
+            (REMOVED, (term, category)) for term in sorted(old - kept))
+        changes.extend(
+            (ADDED, (term, category)) for term in sorted(new - old))
+    return changes
+
+
+def apply_changes(kvs, changes, checkpoint=None, phase='',
+                  batch_size=DELTA_BATCH_SIZE):
+    """Apply changes to kvs, batch_size at a time.
+
+    The additions of a batch are stored before its removals, so a key
+    whose values are replaced is rewritten rather than deleted and put
+    again, and a pair both added and removed in a batch is kept (as for a
+    line moved within a diff). With a checkpoint, the changes it records as
+    done for phase are skipped (but still iterated), and progress is
+    recorded after each batch is flushed.
+
+    Args:
+        kvs: object, key-value store
+        changes: iterable of (sign, (key, value)) pairs
+        checkpoint: object, Checkpoint to resume from and record progress in
+        phase: string, name of the changes in the checkpoint
+        batch_size: int, number of changes applied together
+    Returns:
+        number of changes applied, including the skipped ones.
+    """
+    changes = iter(changes)
+    done = checkpoint.get(phase) if checkpoint is not None else 0
+    for _ in islice(changes, done):
+        pass
+    while True:
+        batch = list(islice(changes, batch_size))
+        if not batch:
+            break
+        added = set(pair for sign, pair in batch if sign == ADDED)
+        kvs.put_many(added)
+        kvs.remove_many(
+            pair for sign, pair in batch
+            if sign == REMOVED and pair not in added)
+        kvs.flush()
+        done += len(batch)
+        if checkpoint is not None:
+            checkpoint.save(phase, done)
+    return done
+
+
+def fingerprint(paths):
+    """Return the path, size and modification time of each of paths."""
+    return [
+        [os.path.abspath(path), os.path.getsize(path),
+         int(os.path.getmtime(path))]
+        for path in paths]
+
+
+class Checkpoint(object):
+    """Progress of an incremental load, saved as JSON to path.
+
+    The number of changes done is kept per phase, for one set of inputs
+    (see fingerprint): a checkpoint saved for other inputs is ignored.
+    """
+    def __init__(self, path, inputs):
+        self.path = path
+        self.inputs = inputs
+        self._done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('inputs') == inputs:
+                self._done = state.get('done', {})
+
+    def get(self, phase):
+        """Return the number of changes done in phase."""
+        return self._done.get(phase, 0)
+
+    def save(self, phase, done):
+        """Record done changes in phase; written atomically."""
+        self._done[phase] = done
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'inputs': self.inputs, 'done': self._done}, f)
+        os.rename(tmp_path, self.path)
+
+    def clear(self):
+        """Remove the checkpoint once the load is complete."""
+        self._done = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
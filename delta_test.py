@@ -0,0 +1,102 @@
+import os
+import tempfile
+import test
+import kvs
+import delta
+
+
+class DiffPairsTestCase(test.TestCase):
+    def test_diff_pairs(self):
+        old = [('a', 1), ('b', 2), ('c', 3)]
+        new = [('c', 3), ('d', 4), ('a', 1)]
+        self.assertEqual(
+            list(delta.diff_pairs(old, new)),
+            [(delta.ADDED, ('d', 4)), (delta.REMOVED, ('b', 2))])
+
+
+class TermChangesTestCase(test.TestCase):
+    def setUp(self):
+        self.stemmer = test.mock.Mock()
+        self.stemmer.stem_many.side_effect = lambda words: [
+            word.lower() for word in words]
+
+    def test_term_changes(self):
+        changes = [
+            (delta.REMOVED, ('x', 'National Park')),
+            (delta.ADDED, ('x', 'National Museum')),
+            (delta.ADDED, ('y', 'Park')),
+        ]
+        self.assertEqual(
+            delta.term_changes(changes, self.stemmer),
+            [
+                (delta.REMOVED, ('park', 'x')),
+                (delta.ADDED, ('museum', 'x')),
+                (delta.ADDED, ('park', 'y')),
+            ])
+
+    def test_term_changes_kept_by_other_labels(self):
+        changes = [
+            (delta.REMOVED, ('x', 'National Park')),
+            (delta.ADDED, ('x', 'City')),
+        ]
+        labels = [('x', 'Park Gardens'), ('x', 'City'), ('y', 'National')]
+        self.assertEqual(
+            delta.term_changes(changes, self.stemmer, labels=labels),
+            [
+                (delta.REMOVED, ('national', 'x')),
+                (delta.ADDED, ('city', 'x')),
+            ])
+
+    def test_term_changes_categories(self):
+        categories = test.mock.Mock()
+        categories.intern.side_effect = {'x': 7}.get
+        changes = [(delta.ADDED, ('x', 'Park'))]
+        self.assertEqual(
+            delta.term_changes(changes, self.stemmer, categories),
+            [(delta.ADDED, ('park', 7))])
+
+
+class ApplyChangesTestCase(test.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.path)
+        self.kvs = kvs.Dict()
+        self.kvs.put_many([('a', 1), ('a', 2), ('b', 3)])
+        self.changes = [
+            (delta.REMOVED, ('a', 1)),
+            (delta.ADDED, ('c', 4)),
+            (delta.REMOVED, ('b', 3)),
+            (delta.ADDED, ('a', 5)),
+        ]
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def test_apply_changes(self):
+        done = delta.apply_changes(self.kvs, self.changes, batch_size=3)
+        self.assertEqual(done, 4)
+        self.assertItemsEqual(self.kvs.get('a'), [2, 5])
+        self.assertItemsEqual(self.kvs.get('c'), [4])
+        self.assertNotIn('b', self.kvs)
+
+    def test_apply_changes_resume(self):
+        checkpoint = delta.Checkpoint(self.path, ['inputs'])
+        checkpoint.save('terms', 2)
+        checkpoint = delta.Checkpoint(self.path, ['inputs'])
+        done = delta.apply_changes(
+            self.kvs, self.changes, checkpoint, 'terms', batch_size=1)
+        self.assertEqual(done, 4)
+        self.assertItemsEqual(self.kvs.get('a'), [1, 2, 5])
+        self.assertNotIn('c', self.kvs)
+        self.assertNotIn('b', self.kvs)
+        self.assertEqual(delta.Checkpoint(self.path, ['inputs']).get('terms'), 4)
+
+    def test_checkpoint_other_inputs(self):
+        delta.Checkpoint(self.path, ['old']).save('terms', 2)
+        self.assertEqual(delta.Checkpoint(self.path, ['new']).get('terms'), 0)
+        checkpoint = delta.Checkpoint(self.path, ['old'])
+        self.assertEqual(checkpoint.get('terms'), 2)
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
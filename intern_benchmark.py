@@ -0,0 +1,102 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Memory benchmark for category interning
+
+Loads a synthetic dump into the in-memory stores, with category URIs and
+with interned category IDs, and reports the peak memory each load adds.
+Each load runs in its own process.
+
+To run:
+$ python intern_benchmark.py --categories 200000
+"""
+from __future__ import print_function
+
+import random
+import resource
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import kvs
+import loader
+
+RESOURCE = 'http://dbpedia.org/resource/{}'
+FILE_PATH = 'http://commons.wikimedia.org/wiki/Special:FilePath/{}.jpg'
+
+
+def parse_args(prog='intern_benchmark', description='Interning benchmark.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--categories', type=int, default=200000,
+        help="categories in the synthetic dump")
+    parser.add_argument(
+        '--vocabulary', type=int, default=20000,
+        help="distinct label words in the synthetic dump")
+    return parser.parse_args()
+
+
+def labels(categories, vocabulary):
+    """Yield (category, label) pairs with Zipf-distributed label words."""
+    rand = random.Random(0)
+    words = ['word{}'.format(i) for i in range(vocabulary)]
+    for i in range(categories):
+        label = ' '.join(
+            words[min(int(rand.paretovariate(1)) - 1, vocabulary - 1)]
+            for _ in range(rand.randint(1, 5)))
+        yield (RESOURCE.format('Category_{}'.format(i)), label)
+
+
+def images(categories):
+    """Yield a (category, url) pair for every other category."""
+    for i in range(0, categories, 2):
+        name = 'Category_{}'.format(i)
+        yield (RESOURCE.format(name), FILE_PATH.format(name))
+
+
+def run(task):
+    """Load the synthetic dump; return the peak memory it added in KiB."""
+    intern, n, vocabulary = task
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    categories = loader.Categories() if intern else None
+    images_kvs = kvs.Dict()
+    terms_kvs = kvs.Postings() if intern else kvs.Dict()
+    loader.load_images(images_kvs, images(n), categories=categories)
+    loader.load_terms(
+        terms_kvs, images_kvs, labels(n, vocabulary),
+        stemmer=_IdentityStemmer(), categories=categories)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+
+class _IdentityStemmer(object):
+    """Identity stemmer, so that only the stores are measured."""
+    def stem_many(self, words, processes=None):
+        return words
+
+
+def main():
+    args = parse_args()
+    for intern in (False, True):
+        pool = Pool(1)
+        kib = pool.apply(run, ((intern, args.categories, args.vocabulary),))
+        pool.close()
+        pool.join()
+        print('{:<10} {:>10,.1f} MiB'.format(
+            'interned' if intern else 'uris', kib / 1024.0))
+
+if __name__ == '__main__':
+    main()
@@ -15,13 +15,145 @@
 # limitations under the License.
 # =============================================================================
 
-"""Key-Value Stores"""
+"""Key-Value Stores
 
+The DynamoDB adapter imports boto3 only when it is created, so the local
+stores can be used without paying for (or installing) it. Any store can be
+wrapped in a BloomGuard, which answers lookups of missing keys from a Bloom
+filter saved next to the store, and in a PrefixCoded store, which stores
+URI values front-coded against a table of common prefixes that it keeps
+in the store. A Sharded store
+spreads its keys over several stores of one backend.
+"""
+
+import importlib
+import json
+import mmap
+import os
 import shelve
+import sqlite3
+import struct
+import sys
+import threading
+import time
 
-from boto3 import resource
+from array import array
+from bisect import bisect
 from collections import defaultdict
-from botocore.exceptions import ClientError
+from hashlib import md5
+from itertools import chain, islice
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
+from bloom import BloomFilter, ERROR_RATE
+
+# Approximate bytes of values put_many buffers before writing them out.
+BUFFER_SIZE = 64 * 1024 * 1024
+
+# BatchWriteItem accepts at most 25 put requests per call.
+BATCH_WRITE_SIZE = 25
+# Retries of UnprocessedItems, with exponential backoff from RETRY_DELAY.
+MAX_RETRIES = 10
+RETRY_DELAY = 0.05
+# BatchGetItem accepts at most 100 keys per call; chunks are sent
+# concurrently by up to BATCH_GET_WORKERS threads.
+BATCH_GET_SIZE = 100
+BATCH_GET_WORKERS = 8
+
+# Index file layout: INDEX_MAGIC, then INDEX_HEADER (flags, number of keys,
+# number of values, and the offsets of the values, keys and postings
+# sections). Each section is an array of n + 1 little-endian uint64 offsets
+# into the blob that follows it.
+INDEX_MAGIC = b'KVSIDX01'
+INDEX_HEADER = struct.Struct('<6Q')
+INDEX_OFFSET = struct.Struct('<Q')
+# Values are integers stored in the postings, not IDs into a values table.
+INDEX_INT_VALUES = 1
+# Array type code of the offsets where unsigned long has 8 bytes; elsewhere
+# they are unpacked with struct.
+_OFFSET_TYPECODE = 'L' if array('L').itemsize == 8 else None
+# Decoded values an index keeps between lookups; cleared when full.
+INDEX_VALUE_CACHE_SIZE = 100000
+
+# Rows written per SQLite transaction, and keys per SELECT ... IN query
+# (SQLite binds at most 999 parameters per statement).
+SQLITE_BATCH_SIZE = 100000
+SQLITE_MAX_VARIABLES = 999
+
+# Keys a new BloomGuard filter is sized for, and recent keys put_many
+# remembers so that repeated keys are hashed once.
+BLOOM_CAPACITY = 4000000
+BLOOM_SEEN_KEYS = 100000
+
+# A prefix-coded value starts with a code character: PREFIX_ESCAPE for a
+# value stored as is, or PREFIX_ESCAPE + 1 + i for the i-th prefix of the
+# table. Code characters are control characters, which URIs never start
+# with. The table is learned from the first PREFIX_SAMPLE_SIZE values put,
+# and stored as JSON under PREFIX_TABLE_KEY, which holds a space and so is
+# never a term, a category URI nor an ID.
+PREFIX_ESCAPE = 0
+PREFIX_TABLE_SIZE = 31
+PREFIX_SAMPLE_SIZE = 100000
+PREFIX_TABLE_KEY = ' prefixes'
+
+# Points of each shard on the consistent hashing ring of a Sharded store,
+# and pairs that put_many routes before writing them to the shards.
+SHARD_REPLICAS = 64
+SHARD_BATCH_SIZE = 100000
+# Key under which each store records the number of shards it was loaded
+# among; it holds a space, so it is never a term, a category URI nor an ID.
+SHARDS_KEY = ' shards'
+
+
+def _group(items):
+    """Return a dict that maps the keys of (key, value) pairs to value sets."""
+    grouped = defaultdict(set)
+    for key, value in items:
+        grouped[key].add(value)
+    return grouped
+
+
+class Registry(object):
+    """Lazy registry of key-value store backends.
+
+    Maps backend names to "module:Class" paths, or to the names of classes
+    in this module. A backend's module is imported, and its class looked
+    up, only when the backend is selected, so that selecting one backend
+    never imports the dependencies of another. Lookups of unknown names
+    raise KeyError, like a dict.
+    """
+    def __init__(self, backends):
+        self._backends = dict(backends)
+        self._classes = {}
+
+    def __contains__(self, name):
+        return name in self._backends
+
+    def __iter__(self):
+        return iter(self._backends)
+
+    def __len__(self):
+        return len(self._backends)
+
+    def keys(self):
+        return self._backends.keys()
+
+    def __getitem__(self, name):
+        backend = self._classes.get(name)
+        if backend is None:
+            path, _, attr = self._backends[name].rpartition(':')
+            module = sys.modules[__name__]
+            if path:
+                module = importlib.import_module(path)
+            backend = self._classes[name] = getattr(module, attr)
+        return backend
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def register(self, name, backend):
+        """Add (or replace) backend, a "module:Class" path, as name."""
+        self._backends[name] = backend
+        self._classes.pop(name, None)
 
 
 class _KVS(object):
@@ -39,9 +171,64 @@ class _KVS(object):
     def delete(self, key):
         raise NotImplementedError
 
+    def keys(self):
+        """Return the keys of the KVS."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Return a dict that maps each of keys found in the KVS to its values.
+        """
+        found = {}
+        for key in keys:
+            try:
+                found[key] = self.get(key)
+            except KeyError:
+                pass
+        return found
+
+    def put_many(self, items):
+        """Store an iterable of (key, value) pairs."""
+        for key, value in items:
+            self.put(key, value)
+
+    def remove_many(self, items):
+        """Remove an iterable of (key, value) pairs from their keys' values.
+
+        Pairs that are not stored are ignored, and keys left without values
+        are deleted.
+        """
+        removed = _group(items)
+        for key, values in self.get_many(removed).iteritems():
+            remaining = set(values) - removed[key]
+            if len(remaining) < len(values):
+                self._replace(key, remaining)
+
+    def _replace(self, key, values):
+        """Replace the values of key with values; delete it if empty."""
+        self.delete(key)
+        self.put_many((key, value) for value in values)
+        self.flush()
+
+    def flush(self):
+        pass
+
+    def refresh(self):
+        """Pick up a new version of the store written by another process.
+
+        Most stores read what is stored at every lookup and need nothing;
+        a store that reads a snapshot, such as an Index, reopens it.
+        """
+        pass
+
     def close(self):
         pass
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 class Dict(_KVS):
     """In memory key-value store: dictionary"""
@@ -59,18 +246,84 @@ class Dict(_KVS):
             raise KeyError
         return self._kvs[key]
 
+    def get_many(self, keys):
+        kvs = self._kvs
+        return dict((key, kvs[key]) for key in set(keys) if key in kvs)
+
+    def delete(self, key):
+        del self._kvs[key]
+
+    def keys(self):
+        return self._kvs.keys()
+
+    def _replace(self, key, values):
+        if values:
+            self._kvs[key] = values
+        else:
+            del self._kvs[key]
+
+
+class Postings(_KVS):
+    """In memory key-value store of integer values: array('I') per key.
+
+    Values are appended as they are put, and a key's array is sorted and
+    deduplicated when the key is next read.
+    """
+    def __init__(self, table_name=''):
+        self._kvs = {}
+        self._unsorted = set()
+
+    def __contains__(self, key):
+        return key in self._kvs
+
+    def put(self, key, value):
+        values = self._kvs.get(key)
+        if values is None:
+            values = self._kvs[key] = array('I')
+        elif values[-1] >= value:
+            self._unsorted.add(key)
+        values.append(value)
+
+    def get(self, key):
+        values = self._kvs[key]
+        if key in self._unsorted:
+            values = self._kvs[key] = array('I', sorted(set(values)))
+            self._unsorted.discard(key)
+        return values
+
     def delete(self, key):
         del self._kvs[key]
+        self._unsorted.discard(key)
+
+    def keys(self):
+        return self._kvs.keys()
+
+    def _replace(self, key, values):
+        if values:
+            self._kvs[key] = array('I', sorted(values))
+            self._unsorted.discard(key)
+        else:
+            self.delete(key)
 
 
 class Shelf(_KVS):
-    """Local key-value store: shelve adapter."""
+    """Local key-value store: shelve adapter.
+
+    Every put unpickles and re-pickles the whole value set of a key, so
+    put_many collects values per key in memory instead and writes each key
+    once per flush. The buffer is flushed when it holds about buffer_size
+    bytes, on flush(), and before any read, delete or close.
+    """
     # gdbm key must be string, not unicode
-    def __init__(self, table_name):
+    def __init__(self, table_name, buffer_size=BUFFER_SIZE):
         self.table_name = table_name
+        self.buffer_size = buffer_size
+        self._buffer = defaultdict(set)
+        self._buffered = 0
         self._kvs = shelve.open(self.table_name, flag='c')
 
     def __contains__(self, key):
+        self.flush()
         return str(key) in self._kvs
 
     def put(self, key, value):
@@ -79,21 +332,85 @@ class Shelf(_KVS):
         values.add(value)
         self._kvs[key] = values
 
+    def put_many(self, items):
+        for key, value in items:
+            key = str(key)
+            values = self._buffer[key]
+            if value not in values:
+                values.add(value)
+                self._buffered += sys.getsizeof(value)
+                if self._buffered >= self.buffer_size:
+                    self.flush()
+
+    def flush(self):
+        """Merge buffered values into the shelf, writing each key once."""
+        if not self._buffer:
+            return
+        for key, values in self._buffer.iteritems():
+            if key in self._kvs:
+                values.update(self._kvs[key])
+            self._kvs[key] = values
+        self._buffer.clear()
+        self._buffered = 0
+
     def get(self, key):
+        self.flush()
         return self._kvs[str(key)]
 
+    def get_many(self, keys):
+        self.flush()
+        found = {}
+        for key in set(keys):
+            values = self._kvs.get(str(key))
+            if values is not None:
+                found[key] = values
+        return found
+
     def delete(self, key):
+        self.flush()
         del self._kvs[str(key)]
 
+    def keys(self):
+        self.flush()
+        return self._kvs.keys()
+
+    def _replace(self, key, values):
+        if values:
+            self._kvs[str(key)] = values
+        else:
+            del self._kvs[str(key)]
+
     def close(self):
+        self.flush()
         self._kvs.close()
 
 
 class DynamoDB(_KVS):
-    """DynamoDB adapter."""
+    """DynamoDB adapter.
+
+    Keys are stored as strings, so integer keys work as well.
 
-    def __init__(self, name, **kwargs):
+    put_many groups values per key on the client and writes them with
+    BatchWriteItem, one item per key, when flushed. A put request replaces
+    the item, so keys are merged with ADD updates instead when the table
+    already held data (merge=None checks this on the first flush) or when
+    the key was written before, by put or an earlier flush. Written keys
+    are remembered in a Bloom filter of written_capacity keys, so memory
+    stays bounded; a false positive only turns a put request into an ADD.
+    """
+
+    def __init__(self, name, buffer_size=BUFFER_SIZE, merge=None,
+                 written_capacity=BLOOM_CAPACITY, **kwargs):
         self.table_name = name
+        self.buffer_size = buffer_size
+        self.written_capacity = written_capacity
+        self._merge = merge
+        self._buffer = defaultdict(set)
+        self._buffered = 0
+        self._written = None
+        self._pool = None
+        self._lock = threading.Lock()  # guards the lazy _pool
+        from boto3 import resource
         dynamodb_resource = resource('dynamodb', **kwargs)
         self._kvs = dynamodb_resource.Table(self.table_name)
 
@@ -105,23 +422,1019 @@ class DynamoDB(_KVS):
             return False
 
     def get(self, key):
-        response = self._kvs.get_item(Key={'kvs_key': key})
+        self.flush()
+        response = self._kvs.get_item(Key={'kvs_key': unicode(key)})
         return response['Item']['kvs_values']
 
+    def get_many(self, keys):
+        """Look keys up with BatchGetItem, sending the chunks concurrently."""
+        self.flush()
+        originals = dict((unicode(key), key) for key in keys)
+        keys = list(originals)
+        chunks = [
+            keys[i:i + BATCH_GET_SIZE]
+            for i in range(0, len(keys), BATCH_GET_SIZE)]
+        if len(chunks) > 1:
+            results = self._batch_pool().map(self._batch_get, chunks)
+        else:
+            results = [self._batch_get(chunk) for chunk in chunks]
+        found = {}
+        for result in results:
+            for key, values in result.iteritems():
+                found[originals.get(key, key)] = values
+        return found
+
     def put(self, key, value):
-        self._kvs.update_item(
-            Key={'kvs_key': key},
-            UpdateExpression=(
-                "add #attrName :attrValue"),
-            ExpressionAttributeNames={'#attrName': 'kvs_values'},
-            ExpressionAttributeValues={':attrValue': set([value])},
-            ReturnValues='NONE')
+        self._add(key, set([value]))
+        self._written_keys().add(unicode(key))
+
+    def put_many(self, items):
+        for key, value in items:
+            values = self._buffer[unicode(key)]
+            if value not in values:
+                values.add(value)
+                self._buffered += sys.getsizeof(value)
+                if self._buffered >= self.buffer_size:
+                    self.flush()
+
+    def flush(self):
+        """Write buffered values, one item per key."""
+        if not self._buffer:
+            return
+        if self._merge is None:
+            self._merge = self._kvs.scan(Select='COUNT', Limit=1)['Count'] > 0
+        requests = []
+        written = self._written_keys()
+        for key, values in self._buffer.iteritems():
+            if self._merge or key in written:
+                self._add(key, values)
+                continue
+            written.add(key)
+            requests.append({
+                'PutRequest': {
+                    'Item': {'kvs_key': key, 'kvs_values': values}}})
+        for i in range(0, len(requests), BATCH_WRITE_SIZE):
+            self._batch_write(requests[i:i + BATCH_WRITE_SIZE])
+        self._buffer.clear()
+        self._buffered = 0
 
     def delete(self, key):
+        from botocore.exceptions import ClientError
+        self.flush()
         try:
             self._kvs.delete_item(
-                Key={'kvs_key': key},
+                Key={'kvs_key': unicode(key)},
                 ConditionExpression="attribute_exists(kvs_key)",)
         except ClientError as e:
             if e.response['Error']['Code'] == "ConditionalCheckFailedException":
                 raise KeyError(e.response['Error']['Message'])
+
+    def remove_many(self, items):
+        """Remove the pairs with DELETE updates, one per key.
+
+        Each key's values are updated in place, so a reader never finds a
+        key that keeps values missing; a key left without values is then
+        deleted, unless a writer added values in between.
+        """
+        from botocore.exceptions import ClientError
+        self.flush()
+        for key, values in _group(items).iteritems():
+            response = self._kvs.update_item(
+                Key={'kvs_key': unicode(key)},
+                UpdateExpression="delete #attrName :attrValue",
+                ExpressionAttributeNames={'#attrName': 'kvs_values'},
+                ExpressionAttributeValues={':attrValue': values},
+                ReturnValues='UPDATED_NEW')
+            if 'kvs_values' in response.get('Attributes', {}):
+                continue
+            try:
+                self._kvs.delete_item(
+                    Key={'kvs_key': unicode(key)},
+                    ConditionExpression="attribute_not_exists(kvs_values)")
+            except ClientError as e:
+                if (e.response['Error']['Code'] !=
+                        "ConditionalCheckFailedException"):
+                    raise
+
+    def keys(self):
+        """Scan the table for its keys."""
+        self.flush()
+        keys = []
+        kwargs = {'ProjectionExpression': 'kvs_key'}
+        while True:
+            response = self._kvs.scan(**kwargs)
+            keys.extend(item['kvs_key'] for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return keys
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+
+    def _batch_pool(self):
+        """Return the pool of threads that send BatchGetItem chunks.
+
+        It is started by the first get_many that needs it, which may run in
+        several threads at once.
+        """
+        pool = self._pool
+        if pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(BATCH_GET_WORKERS)
+                pool = self._pool
+        return pool
+
+    def _written_keys(self):
+        """Return the Bloom filter of the keys written so far."""
+        if self._written is None:
+            self._written = BloomFilter(self.written_capacity)
+        return self._written
+
+    def _add(self, key, values):
+        self._kvs.update_item(
+            Key={'kvs_key': unicode(key)},
+            UpdateExpression=(
+                "add #attrName :attrValue"),
+            ExpressionAttributeNames={'#attrName': 'kvs_values'},
+            ExpressionAttributeValues={':attrValue': values},
+            ReturnValues='NONE')
+
+    def _batch_write(self, requests):
+        """Send put requests with BatchWriteItem, retrying unprocessed ones."""
+        client = self._kvs.meta.client
+        request_items = {self.table_name: requests}
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            response = client.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return
+        raise IOError('{}: {} unprocessed items after {} retries'.format(
+            self.table_name, len(request_items[self.table_name]), MAX_RETRIES))
+
+    def _batch_get(self, keys):
+        """Fetch up to BATCH_GET_SIZE keys, retrying unprocessed ones."""
+        client = self._kvs.meta.client
+        request_items = {
+            self.table_name: {'Keys': [{'kvs_key': key} for key in keys]}}
+        found = {}
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            response = client.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(self.table_name, []):
+                if 'kvs_values' in item:
+                    found[item['kvs_key']] = item['kvs_values']
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                return found
+        raise IOError('{}: {} unprocessed keys after {} retries'.format(
+            self.table_name, len(request_items[self.table_name]['Keys']),
+            MAX_RETRIES))
+
+
+def _encode_varints(numbers, out):
+    """Append delta- and varint-encoded sorted numbers to a bytearray."""
+    last = 0
+    for number in numbers:
+        delta = number - last
+        last = number
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+
+
+def _decode_varints(data):
+    """Return the sorted numbers encoded by _encode_varints."""
+    numbers = []
+    last = delta = shift = 0
+    for byte in bytearray(data):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            last += delta
+            numbers.append(last)
+            delta = shift = 0
+    return numbers
+
+
+def _read_offsets(buf, pos, count):
+    """Return an array of the count little-endian uint64 offsets at pos."""
+    data = buf[pos:pos + INDEX_OFFSET.size * count]
+    if _OFFSET_TYPECODE is None:
+        return struct.unpack('<{}Q'.format(count), data)
+    offsets = array(_OFFSET_TYPECODE)
+    offsets.fromstring(data)
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets
+
+
+def _encode_text(s):
+    return s if isinstance(s, bytes) else unicode(s).encode('utf-8')
+
+
+class Index(_KVS):
+    """Immutable inverted index file.
+
+    The file holds a sorted key dictionary and, for each key, a posting list
+    of integer value IDs (or of the integer values themselves) that is
+    delta- and varint-encoded. The file is memory-mapped, so opening it is
+    cheap and a lookup only decodes the postings it touches. The offsets of
+    a section are read into an array the first time it is searched, and
+    get_many looks its keys up in sorted order, each search starting where
+    the previous one ended. Up to INDEX_VALUE_CACHE_SIZE decoded values are
+    kept, since the values of frequent keys are looked up over and over.
+    Integer values are returned as the sorted list they are stored as, so
+    postings.intersect gallops through them rather than probing a set.
+
+    If the file doesn't exist yet, the index is built instead: put values
+    are collected in memory and the file is written on close. An existing
+    index is read-only; remove its file to build it again. A build writes a
+    new file and renames it into place, so readers keep the file they
+    opened until refresh switches them to the new one.
+    """
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.path = '{}.idx'.format(table_name)
+        self._postings = None
+        self._file = None
+        if os.path.exists(self.path):
+            self._file = _IndexFile(self.path)
+        else:
+            self._postings = defaultdict(set)
+
+    def __contains__(self, key):
+        if self._postings is not None:
+            return key in self._postings
+        return self._file.find(_encode_text(key)) >= 0
+
+    def get(self, key):
+        if self._postings is not None:
+            if key not in self._postings:
+                raise KeyError(key)
+            return self._postings[key]
+        index_file = self._file
+        i = index_file.find(_encode_text(key))
+        if i < 0:
+            raise KeyError(key)
+        return index_file.values(i)
+
+    def get_many(self, keys):
+        if self._postings is not None:
+            postings = self._postings
+            return dict(
+                (key, postings[key]) for key in keys if key in postings)
+        return self._file.get_many(keys)
+
+    def put(self, key, value):
+        if self._postings is None:
+            raise IOError('{}: index is read-only'.format(self.path))
+        self._postings[key].add(value)
+
+    def delete(self, key):
+        if self._postings is None:
+            raise IOError('{}: index is read-only'.format(self.path))
+        del self._postings[key]
+
+    def keys(self):
+        if self._postings is not None:
+            return self._postings.keys()
+        index_file = self._file
+        return [
+            index_file.key(i).decode('utf-8')
+            for i in xrange(index_file.n_keys)]
+
+    def refresh(self):
+        """Switch to the file at path if a build replaced the one opened.
+
+        Lookups in progress finish on the file they started with, which is
+        unmapped when they drop it.
+        """
+        if self._file is None:
+            return
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return
+        if inode != self._file.inode:
+            self._file = _IndexFile(self.path)
+
+    def close(self):
+        if self._postings is not None:
+            self._write()
+            self._postings = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self):
+        postings = self._postings
+        int_values = all(
+            isinstance(value, (int, long))
+            for values in postings.itervalues() for value in values)
+        if int_values:
+            flags, values, value_ids = INDEX_INT_VALUES, [], None
+        else:
+            flags = 0
+            values = sorted(set(
+                _encode_text(value)
+                for values in postings.itervalues() for value in values))
+            value_ids = dict((value, i) for i, value in enumerate(values))
+        keys = sorted((_encode_text(key), key) for key in postings)
+        encoded = []
+        for _, key in keys:
+            if int_values:
+                ids = sorted(postings[key])
+            else:
+                ids = sorted(
+                    value_ids[_encode_text(value)] for value in postings[key])
+            out = bytearray()
+            _encode_varints(ids, out)
+            encoded.append(bytes(out))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            header_pos = f.tell()
+            f.write(INDEX_HEADER.pack(0, 0, 0, 0, 0, 0))
+            positions = [
+                self._write_section(f, values),
+                self._write_section(f, [key for key, _ in keys]),
+                self._write_section(f, encoded)]
+            f.seek(header_pos)
+            f.write(INDEX_HEADER.pack(
+                flags, len(keys), len(values), *positions))
+        os.rename(tmp_path, self.path)
+
+    def _write_section(self, f, entries):
+        """Write an offsets array and blob of entries; return its position."""
+        pos = f.tell()
+        offset = 0
+        for entry in entries:
+            f.write(INDEX_OFFSET.pack(offset))
+            offset += len(entry)
+        f.write(INDEX_OFFSET.pack(offset))
+        for entry in entries:
+            f.write(entry)
+        return pos
+
+
+class _IndexFile(object):
+    """A memory-mapped index file, as opened by Index; see Index."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buf[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise IOError('{}: not an index file'.format(path))
+        (self._flags, self.n_keys, self._n_values, self._values_pos,
+         self._keys_pos, self._postings_pos) = INDEX_HEADER.unpack_from(
+            self._buf, len(INDEX_MAGIC))
+        # Section position => (array of entry offsets, blob position).
+        self._offsets = {}
+        self._decoded = {}  # value ID => value
+
+    def close(self):
+        self._buf.close()
+
+    def get_many(self, keys):
+        offsets, blob = self._section(self._keys_pos, self.n_keys)
+        buf, n = self._buf, self.n_keys
+        found = {}
+        lo = 0
+        for encoded, key in sorted((_encode_text(key), key) for key in keys):
+            # Gallop from the previous key to bracket this one, then bisect.
+            bound, step = lo, 1
+            while (bound < n and
+                   buf[blob + offsets[bound]:blob + offsets[bound + 1]] <
+                   encoded):
+                lo = bound + 1
+                bound += step
+                step *= 2
+            lo = self.bisect(encoded, lo, min(bound, n))
+            if lo < n and self.key(lo) == encoded:
+                found[key] = self.values(lo)
+        return found
+
+    def key(self, i):
+        return self._slice(self._keys_pos, self.n_keys, i)
+
+    def values(self, i):
+        """Return the values of key i; integer values as a sorted list."""
+        ids = _decode_varints(self._slice(self._postings_pos, self.n_keys, i))
+        if self._flags & INDEX_INT_VALUES:
+            return ids
+        offsets, blob = self._section(self._values_pos, self._n_values)
+        buf = self._buf
+        decoded = self._decoded
+        if len(decoded) >= INDEX_VALUE_CACHE_SIZE:
+            decoded.clear()
+        values = set()
+        for value_id in ids:
+            value = decoded.get(value_id)
+            if value is None:
+                value = decoded[value_id] = buf[
+                    blob + offsets[value_id]:blob + offsets[value_id + 1]
+                ].decode('utf-8')
+            values.add(value)
+        return values
+
+    def bisect(self, key, lo=0, hi=None):
+        """Return the position of the first key >= key in [lo, hi)."""
+        offsets, blob = self._section(self._keys_pos, self.n_keys)
+        buf = self._buf
+        if hi is None:
+            hi = self.n_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if buf[blob + offsets[mid]:blob + offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key):
+        """Return the position of key in the key dictionary, or -1."""
+        i = self.bisect(key)
+        if i < self.n_keys and self.key(i) == key:
+            return i
+        return -1
+
+    def _slice(self, pos, n, i):
+        """Return entry i of the section at pos, which has n entries."""
+        offsets, blob = self._section(pos, n)
+        return self._buf[blob + offsets[i]:blob + offsets[i + 1]]
+
+    def _section(self, pos, n):
+        """Return the offsets array and blob position of the section at pos.
+        """
+        section = self._offsets.get(pos)
+        if section is None:
+            section = self._offsets[pos] = (
+                _read_offsets(self._buf, pos, n + 1), pos + 8 * (n + 1))
+        return section
+
+
+class SQLite(_KVS):
+    """Local key-value store: SQLite table of (key, value) rows.
+
+    Keys are stored as text, so integer keys work as well. The primary key
+    (key, value) indexes the rows by key and drops duplicate values.
+    put_many inserts rows in transactions of SQLITE_BATCH_SIZE with
+    executemany, and get_many looks keys up with one SELECT ... IN query
+    per SQLITE_MAX_VARIABLES keys. The database is in WAL mode, so other
+    processes (the querier) can read it while the loader writes, and each
+    thread has a connection of its own.
+    """
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.path = '{}.sqlite'.format(table_name)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS kvs (key TEXT NOT NULL, '
+                'value NOT NULL, PRIMARY KEY (key, value)) WITHOUT ROWID')
+
+    def _connection(self):
+        """Return the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def __contains__(self, key):
+        return self._connection().execute(
+            'SELECT 1 FROM kvs WHERE key = ? LIMIT 1',
+            (unicode(key),)).fetchone() is not None
+
+    def get(self, key):
+        values = set(value for value, in self._connection().execute(
+            'SELECT value FROM kvs WHERE key = ?', (unicode(key),)))
+        if not values:
+            raise KeyError(key)
+        return values
+
+    def get_many(self, keys):
+        originals = dict((unicode(key), key) for key in keys)
+        keys = list(originals)
+        connection = self._connection()
+        found = defaultdict(set)
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[i:i + SQLITE_MAX_VARIABLES]
+            for key, value in connection.execute(
+                    'SELECT key, value FROM kvs WHERE key IN ({})'.format(
+                        ', '.join('?' * len(chunk))), chunk):
+                found[originals[key]].add(value)
+        return dict(found)
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        rows = ((unicode(key), value) for key, value in items)
+        connection = self._connection()
+        while True:
+            batch = list(islice(rows, SQLITE_BATCH_SIZE))
+            if not batch:
+                break
+            with connection:
+                connection.executemany(
+                    'INSERT OR IGNORE INTO kvs VALUES (?, ?)', batch)
+
+    def delete(self, key):
+        with self._connection() as connection:
+            cursor = connection.execute(
+                'DELETE FROM kvs WHERE key = ?', (unicode(key),))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def remove_many(self, items):
+        with self._connection() as connection:
+            connection.executemany(
+                'DELETE FROM kvs WHERE key = ? AND value = ?',
+                ((unicode(key), value) for key, value in items))
+
+    def keys(self):
+        return [key for key, in self._connection().execute(
+            'SELECT DISTINCT key FROM kvs')]
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+def _hash(key):
+    """Return a 64-bit hash of key, stable across processes."""
+    return struct.unpack_from(
+        '<Q', md5(unicode(key).encode('utf-8')).digest())[0]
+
+
+class Sharded(_KVS):
+    """Key-value store over shards, stores of one backend.
+
+    Keys are routed to shards by consistent hashing, so a store with one
+    more shard moves only about 1/shards of the keys. put_many and
+    remove_many route batches of pairs and write them with one thread per
+    shard, and get_many looks keys up in their shards concurrently. A
+    store must always be opened with the same number of shards: each shard
+    records it under SHARDS_KEY (see check_shards).
+
+    Args:
+        table_name: string, name of the store; shard i is table_name-i
+        backend: class, _KVS backend of the shards
+        shards: int, number of shards
+        create: bool, record the number of shards in shards that have none
+        kwargs: passed to the backend
+
+    Raises:
+        ValueError: a shard records another number of shards, or none
+            without create.
+    """
+    def __init__(self, table_name, backend, shards, create=False, **kwargs):
+        self.table_name = table_name
+        self.shards = [
+            backend('{}-{}'.format(table_name, i), **kwargs)
+            for i in range(shards)]
+        for i, shard in enumerate(self.shards):
+            check_shards(
+                shard, '{}-{}'.format(table_name, i), shards, create)
+        ring = sorted(
+            (_hash('{}-{}'.format(i, replica)), i)
+            for i in range(shards) for replica in range(SHARD_REPLICAS))
+        self._points = [point for point, _ in ring]
+        self._owners = [i for _, i in ring]
+        self._pool = ThreadPool(shards)
+
+    def _index(self, key):
+        """Return the index of the shard of key."""
+        return self._owners[
+            bisect(self._points, _hash(key)) % len(self._owners)]
+
+    def _shard(self, key):
+        return self.shards[self._index(key)]
+
+    def _route(self, items, key=itemgetter(0)):
+        """Return a list of (shard, items of shard) pairs; key returns the
+        key of an item."""
+        routed = defaultdict(list)
+        for item in items:
+            routed[self._index(key(item))].append(item)
+        return [(self.shards[i], routed[i]) for i in sorted(routed)]
+
+    def _call(self, method, calls):
+        """Call method on shards with one thread per shard.
+
+        Args:
+            method: string, name of the _KVS method
+            calls: list of (shard, argument) pairs
+        Returns:
+            list of the results.
+        """
+        def call(shard_argument):
+            shard, argument = shard_argument
+            return getattr(shard, method)(argument)
+        if len(calls) > 1:
+            return self._pool.map(call, calls)
+        return map(call, calls)
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def get(self, key):
+        return self._shard(key).get(key)
+
+    def get_many(self, keys):
+        found = {}
+        routed = self._route(set(keys), key=lambda key: key)
+        for result in self._call('get_many', routed):
+            found.update(result)
+        return found
+
+    def put(self, key, value):
+        self._shard(key).put(key, value)
+
+    def put_many(self, items):
+        items = iter(items)
+        while True:
+            batch = list(islice(items, SHARD_BATCH_SIZE))
+            if not batch:
+                break
+            self._call('put_many', self._route(batch))
+
+    def delete(self, key):
+        self._shard(key).delete(key)
+
+    def remove_many(self, items):
+        self._call('remove_many', self._route(items))
+
+    def keys(self):
+        return [
+            key for key in chain.from_iterable(
+                shard.keys() for shard in self.shards)
+            if key != SHARDS_KEY]
+
+    def flush(self):
+        self._pool.map(lambda shard: shard.flush(), self.shards)
+
+    def refresh(self):
+        for shard in self.shards:
+            shard.refresh()
+
+    def close(self):
+        self._pool.map(lambda shard: shard.close(), self.shards)
+        self._pool.close()
+        self._pool.join()
+
+
+def check_shards(kvs, name, shards, create=False):
+    """Check that kvs, the store name, was loaded as one of shards stores.
+
+    A store records the number of shards it was loaded among, 1 if it
+    isn't sharded, as the value of SHARDS_KEY, so that it is not read with
+    the keys of another number of shards, or with and without --shards.
+    The count is put as an int, and compared as an int whichever form the
+    store reads its values back in.
+
+    Args:
+        kvs: object, key-value store
+        name: string, name of the store, for errors
+        shards: int, number of shards it is opened among
+        create: bool, record shards in a store that has no record, as a
+            load does
+
+    Raises:
+        ValueError: kvs records another number of shards, or none without
+            create.
+    """
+    recorded = kvs.get_many([SHARDS_KEY]).get(SHARDS_KEY)
+    if recorded:
+        # Stores of text values read the count back as text.
+        recorded = set(int(value) for value in recorded)
+        if recorded != set([shards]):
+            raise ValueError('{}: loaded as {} shards, opened as {}'.format(
+                name, max(recorded), shards))
+    elif create:
+        kvs.put(SHARDS_KEY, shards)
+        kvs.flush()
+    else:
+        raise ValueError('{}: no shard count recorded, not loaded as {} '
+                         'shards'.format(name, shards))
+
+
+class BloomGuard(_KVS):
+    """Key-value store wrapper that answers lookups of missing keys from a
+    Bloom filter of the keys, without reading the store.
+
+    The filter is a sidecar file at path, next to the store: it is saved on
+    flush and close with the epoch marker of the store, and read back when
+    the store is opened again. A sidecar recorded at another epoch than the
+    store's, as after a load that did not go through a guard, is stale: the
+    store's keys are read once to build a new filter instead, and on
+    refresh when the epoch changes. Only a guard that persists saves its
+    filter; a reader's guard keeps the filter it builds in memory. Every
+    writer of the store must go through the guard, or the sidecar misses
+    its keys. Deleted keys stay in the filter as false positives.
+    Lookups answered by the filter alone are counted in skipped.
+
+    Args:
+        kvs: object, key-value store to guard
+        path: string, path of the sidecar file
+        capacity: int, keys a new filter is sized for
+        error_rate: float, false-positive rate of a new filter at capacity
+        epoch: function that returns the epoch marker of the store, or None
+            if it has none
+        persist: bool, save the filter to path
+    """
+    def __init__(self, kvs, path, capacity=BLOOM_CAPACITY,
+                 error_rate=ERROR_RATE, epoch=lambda: None, persist=True):
+        self.kvs = kvs
+        self.path = path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.epoch = epoch
+        self.persist = persist
+        self.skipped = 0
+        self._dirty = False
+        self.filter = None
+        self._check()
+
+    def _check(self):
+        """Load the sidecar, or build a new filter if it is missing or
+        stale."""
+        epoch = self.epoch()
+        if self.filter is not None and self.filter.epoch == epoch:
+            return
+        if os.path.exists(self.path):
+            bloom_filter = BloomFilter.load(self.path)
+            if bloom_filter.epoch == epoch:
+                self.filter = bloom_filter
+                return
+        keys = self.kvs.keys()
+        self.filter = BloomFilter(
+            max(self.capacity, len(keys)), self.error_rate)
+        self.filter.update(keys)
+        self.filter.epoch = epoch
+        self._dirty = True
+        self._save()
+
+    def __contains__(self, key):
+        if key not in self.filter:
+            self.skipped += 1
+            return False
+        return key in self.kvs
+
+    def get(self, key):
+        if key not in self.filter:
+            self.skipped += 1
+            raise KeyError(key)
+        return self.kvs.get(key)
+
+    def get_many(self, keys):
+        keys = set(keys)
+        maybe = [key for key in keys if key in self.filter]
+        self.skipped += len(keys) - len(maybe)
+        return self.kvs.get_many(maybe) if maybe else {}
+
+    def put(self, key, value):
+        self.filter.add(key)
+        self._dirty = True
+        self.kvs.put(key, value)
+
+    def put_many(self, items):
+        self._dirty = True
+        self.kvs.put_many(self._add_keys(items))
+
+    def _add_keys(self, items):
+        """Add the keys of items to the filter as they are stored."""
+        add = self.filter.add
+        seen = set()
+        for key, value in items:
+            if key not in seen:
+                if len(seen) >= BLOOM_SEEN_KEYS:
+                    seen.clear()
+                seen.add(key)
+                add(key)
+            yield key, value
+
+    def delete(self, key):
+        self.kvs.delete(key)
+
+    def remove_many(self, items):
+        self.kvs.remove_many(items)
+
+    def keys(self):
+        return self.kvs.keys()
+
+    def flush(self):
+        self.kvs.flush()
+        self._save()
+
+    def refresh(self):
+        self.kvs.refresh()
+        self._check()
+
+    def close(self):
+        self._save()
+        self.kvs.close()
+
+    def _save(self):
+        if not self.persist:
+            return
+        epoch = self.epoch()
+        if self._dirty or epoch != self.filter.epoch:
+            self.filter.epoch = epoch
+            self.filter.save(self.path)
+            self._dirty = False
+
+
+class PrefixCodec(object):
+    """Front coding of string values against a table of prefixes.
+
+    A value is encoded as the code of the longest prefix of the table that
+    ends at one of its '/', followed by the rest of the value. Values that
+    aren't strings are left as they are.
+
+    Args:
+        prefixes: list of strings, the prefix table
+    """
+    def __init__(self, prefixes):
+        self.prefixes = list(prefixes)[:PREFIX_TABLE_SIZE]
+        self._codes = dict(
+            (prefix, unichr(PREFIX_ESCAPE + 1 + i))
+            for i, prefix in enumerate(self.prefixes))
+
+    @classmethod
+    def learn(cls, values, size=PREFIX_TABLE_SIZE):
+        """Return a codec of the size prefixes that save the most in values.
+        """
+        counts = defaultdict(int)
+        for value in values:
+            if not isinstance(value, basestring):
+                continue
+            pos = value.find('/')
+            while pos >= 0:
+                counts[value[:pos + 1]] += 1
+                pos = value.find('/', pos + 1)
+        savings = sorted(
+            ((len(prefix) - 1) * count, prefix)
+            for prefix, count in counts.iteritems() if count > 1)
+        return cls(prefix for _, prefix in reversed(savings[-size:]))
+
+    def encode(self, value):
+        if not isinstance(value, basestring):
+            return value
+        codes = self._codes
+        pos = value.rfind('/')
+        while pos >= 0:
+            code = codes.get(value[:pos + 1])
+            if code is not None:
+                return code + value[pos + 1:]
+            pos = value.rfind('/', 0, pos)
+        if value and ord(value[0]) <= PREFIX_TABLE_SIZE:
+            return unichr(PREFIX_ESCAPE) + value
+        return value
+
+    def decode(self, value):
+        """Return the value encoded as value.
+
+        Raises:
+            ValueError: value is coded with a prefix the table doesn't have.
+        """
+        if not isinstance(value, basestring) or not value:
+            return value
+        code = ord(value[0]) - PREFIX_ESCAPE
+        if code > PREFIX_TABLE_SIZE:
+            return value
+        if code == 0:
+            return value[1:]
+        if code > len(self.prefixes):
+            raise ValueError(
+                'value coded with prefix {} of {}: prefix table missing or '
+                'truncated'.format(code, len(self.prefixes)))
+        return self.prefixes[code - 1] + value[1:]
+
+
+class PrefixCoded(_KVS):
+    """Key-value store wrapper that stores values prefix-coded.
+
+    Values are encoded with a PrefixCodec on put and decoded on get, so
+    callers see the values they put. The prefix table is learned from the
+    first sample_size values of the first put_many, then stored in the
+    store itself under PREFIX_TABLE_KEY, before any value coded with it,
+    and never changed, so every stored value stays decodable. Values put
+    before it is learned are stored as they are, and remove_many removes
+    both forms. A value coded against a table the store doesn't hold
+    raises a ValueError when read. The encoded and decoded sizes of the
+    values put are counted in coded_bytes and raw_bytes.
+
+    Args:
+        kvs: object, key-value store of set values
+        sample_size: int, values to learn the prefix table from
+
+    Raises:
+        ValueError: the store holds several prefix tables.
+    """
+    def __init__(self, kvs, sample_size=PREFIX_SAMPLE_SIZE):
+        self.kvs = kvs
+        self.sample_size = sample_size
+        self.raw_bytes = self.coded_bytes = 0
+        tables = kvs.get_many([PREFIX_TABLE_KEY]).get(PREFIX_TABLE_KEY)
+        if tables and len(tables) > 1:
+            raise ValueError('several prefix tables: {}'.format(len(tables)))
+        self.learned = bool(tables)
+        if self.learned:
+            self.codec = PrefixCodec(json.loads(next(iter(tables))))
+        else:
+            self.codec = PrefixCodec([])
+
+    def __contains__(self, key):
+        return key in self.kvs
+
+    def get(self, key):
+        return self._decode(self.kvs.get(key))
+
+    def get_many(self, keys):
+        return dict(
+            (key, self._decode(values))
+            for key, values in self.kvs.get_many(keys).iteritems())
+
+    def put(self, key, value):
+        self.kvs.put(key, self._encode(value))
+
+    def put_many(self, items):
+        items = iter(items)
+        if not self.learned:
+            sample = list(islice(items, self.sample_size))
+            self._learn(value for _, value in sample)
+            items = chain(sample, items)
+        self.kvs.put_many((key, self._encode(value)) for key, value in items)
+
+    def delete(self, key):
+        self.kvs.delete(key)
+
+    def remove_many(self, items):
+        self.kvs.remove_many(self._stored_forms(items))
+
+    def _stored_forms(self, items):
+        """Yield each pair coded, and as it is if it differs, as it may
+        have been put before the table was learned."""
+        encode = self.codec.encode
+        for key, value in items:
+            coded = encode(value)
+            yield key, coded
+            if coded != value:
+                yield key, value
+
+    def keys(self):
+        return [key for key in self.kvs.keys() if key != PREFIX_TABLE_KEY]
+
+    def flush(self):
+        self.kvs.flush()
+
+    def refresh(self):
+        self.kvs.refresh()
+
+    def close(self):
+        self.kvs.close()
+
+    def _learn(self, values):
+        self.codec = PrefixCodec.learn(values)
+        self.learned = True
+        self.kvs.put(PREFIX_TABLE_KEY, json.dumps(self.codec.prefixes))
+
+    def _encode(self, value):
+        coded = self.codec.encode(value)
+        if isinstance(value, basestring):
+            self.raw_bytes += _utf8_size(value)
+            self.coded_bytes += _utf8_size(coded)
+        return coded
+
+    def _decode(self, values):
+        decode = self.codec.decode
+        return set(decode(value) for value in values)
+
+
+def _utf8_size(s):
+    """Return the size of s encoded in UTF-8."""
+    return len(s.encode('utf-8')) if isinstance(s, unicode) else len(s)
@@ -1,12 +1,40 @@
 import os
+import postings
 import tempfile
+import threading
 import test
 
+from bloom import BloomFilter
 from boto3 import resource
-from kvs import Shelf, Dict, DynamoDB
+from botocore.stub import ANY, Stubber
+from glob import glob
+from kvs import (
+    BloomGuard, PrefixCodec, PrefixCoded, Shelf, Sharded, SQLite, Dict,
+    DynamoDB, Index, Postings, Registry, PREFIX_TABLE_KEY, SHARDS_KEY,
+    check_shards)
 from unittest import skipUnless
 
 
+class RegistryTestCase(test.TestCase):
+    def test_lookup(self):
+        registry = Registry({'mem': 'Dict', 'disk': 'Shelf'})
+        self.assertIs(registry['mem'], Dict)
+        self.assertIs(registry.get('disk'), Shelf)
+        self.assertIsNone(registry.get('cloud'))
+        self.assertItemsEqual(['mem', 'disk'], registry)
+        self.assertIn('mem', registry)
+        self.assertEqual(2, len(registry))
+        with self.assertRaises(KeyError):
+            registry['cloud']
+
+    def test_register(self):
+        registry = Registry({})
+        registry.register('json', 'json:JSONDecoder')
+        self.assertEqual('JSONDecoder', registry['json'].__name__)
+        registry.register('json', 'Dict')
+        self.assertIs(registry['json'], Dict)
+
+
 class CommonTestCase(object):
     def test_put_get(self):
         self.kvs.put('key', 'value')
@@ -38,6 +66,29 @@ class CommonTestCase(object):
         with self.assertRaises(KeyError):
             self.kvs.delete('key')
 
+    def test_get_many(self):
+        self.kvs.put('key1', 'value1')
+        self.kvs.put('key2', 'value2')
+        self.kvs.put('key2', 'value3')
+        found = self.kvs.get_many(['key1', 'key2', 'key1', 'nokey'])
+        self.assertItemsEqual(found.keys(), ['key1', 'key2'])
+        self.assertItemsEqual(found['key1'], ['value1'])
+        self.assertItemsEqual(found['key2'], ['value2', 'value3'])
+
+    def test_put_many(self):
+        self.kvs.put_many([('key', 'value1'), ('key', 'value2'), ('k', 'v')])
+        self.kvs.flush()
+        self.assertItemsEqual(self.kvs.get('key'), ['value1', 'value2'])
+        self.assertItemsEqual(self.kvs.get('k'), ['v'])
+
+    def test_remove_many(self):
+        self.kvs.put_many([('key', 'value1'), ('key', 'value2'), ('k', 'v')])
+        self.kvs.remove_many([
+            ('key', 'value1'), ('key', 'value3'), ('k', 'v'), ('nokey', 'v')])
+        self.assertItemsEqual(self.kvs.get('key'), ['value2'])
+        self.assertFalse('k' in self.kvs)
+        self.assertFalse('nokey' in self.kvs)
+
 
 class ShelfTestCase(test.TestCase, CommonTestCase):
     def setUp(self):
@@ -47,12 +98,413 @@ class ShelfTestCase(test.TestCase, CommonTestCase):
     def tearDown(self):
         os.unlink(self.table_name)
 
+    def test_put_many_buffered(self):
+        self.kvs.put_many([('key', 'value1'), ('key', 'value2')])
+        self.assertItemsEqual(self.kvs._buffer['key'], ['value1', 'value2'])
+        self.assertNotIn('key', self.kvs._kvs)
+        self.kvs.flush()
+        self.assertItemsEqual(self.kvs._kvs['key'], ['value1', 'value2'])
+
+    def test_put_many_merges_stored_values(self):
+        self.kvs.put('key', 'value1')
+        self.kvs.put_many([('key', 'value2')])
+        self.assertItemsEqual(self.kvs.get('key'), ['value1', 'value2'])
+
+    def test_put_many_buffer_size(self):
+        self.kvs.buffer_size = 1
+        self.kvs.put_many([('key', 'value1')])
+        self.assertFalse(self.kvs._buffer)
+        self.assertItemsEqual(self.kvs._kvs['key'], ['value1'])
+
+    def test_context_manager_flushes(self):
+        with self.kvs as kvs:
+            kvs.put_many([('key', 'value')])
+        kvs = Shelf(self.table_name)
+        self.assertItemsEqual(kvs.get('key'), ['value'])
+        kvs.close()
+
+
+class BloomGuardTestCase(test.TestCase, CommonTestCase):
+    def setUp(self):
+        self.table_name = next(tempfile._get_candidate_names())
+        self.path = self.table_name + '.bloom'
+        self.kvs = BloomGuard(Shelf(self.table_name), self.path, capacity=100)
+
+    def tearDown(self):
+        for path in (self.table_name, self.path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def test_skips_missing_keys(self):
+        self.kvs.put_many([('key', 'value')])
+        self.kvs.kvs = test.mock.Mock(wraps=self.kvs.kvs)
+        self.assertNotIn('nokey', self.kvs)
+        with self.assertRaises(KeyError):
+            self.kvs.get('nokey')
+        self.assertEqual(self.kvs.get_many(['nokey']), {})
+        self.assertEqual(self.kvs.skipped, 3)
+        self.assertFalse(self.kvs.kvs.get_many.called)
+        self.assertItemsEqual(self.kvs.get_many(['key'])['key'], ['value'])
+
+    def test_reopen(self):
+        self.kvs.put_many([('key', 'value'), (7, 'value')])
+        self.kvs.close()
+        self.kvs = BloomGuard(Shelf(self.table_name), self.path)
+        self.assertEqual(self.kvs.filter.capacity, 100)
+        self.assertIn('key', self.kvs.filter)
+        self.assertIn(7, self.kvs.filter)
+
+    def test_builds_missing_sidecar(self):
+        self.kvs.close()
+        os.unlink(self.path)
+        kvs = Shelf(self.table_name)
+        kvs.put_many([('key', 'value'), (7, 'value')])
+        self.kvs = BloomGuard(kvs, self.path, capacity=0)
+        self.assertTrue(os.path.exists(self.path))
+        self.assertEqual(self.kvs.filter.capacity, 2)
+        self.assertIn('key', self.kvs)
+        self.assertIn(7, self.kvs)
+
+    def test_stale_sidecar(self):
+        epochs = ['e1']
+        self.kvs.close()
+        self.kvs = BloomGuard(
+            Shelf(self.table_name), self.path, epoch=lambda: epochs[0])
+        self.kvs.put('key', 'value')
+        self.kvs.close()
+        kvs = Shelf(self.table_name)
+        kvs.put('other', 'value')
+        epochs[0] = 'e2'
+        self.kvs = BloomGuard(kvs, self.path, epoch=lambda: epochs[0])
+        self.assertIn('other', self.kvs)
+        self.assertEqual(BloomFilter.load(self.path).epoch, 'e2')
+
+    def test_reader_does_not_persist(self):
+        self.kvs.close()
+        os.unlink(self.path)
+        self.kvs = BloomGuard(Shelf(self.table_name), self.path, persist=False)
+        self.kvs.put('key', 'value')
+        self.kvs.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_refresh(self):
+        epochs = ['e1']
+        kvs = Shelf(self.table_name)
+        self.kvs = BloomGuard(
+            kvs, self.path, epoch=lambda: epochs[0], persist=False)
+        kvs.put('key', 'value')
+        self.assertNotIn('key', self.kvs)
+        epochs[0] = 'e2'
+        self.kvs.refresh()
+        self.assertIn('key', self.kvs)
+
+
+class PrefixCodecTestCase(test.TestCase):
+    def setUp(self):
+        self.codec = PrefixCodec.learn([
+            u'http://dbpedia.org/resource/A',
+            u'http://dbpedia.org/resource/B',
+            u'http://commons.wikimedia.org/wiki/Special:FilePath/A.jpg',
+            u'http://commons.wikimedia.org/wiki/Special:FilePath/B.jpg',
+        ])
+
+    def test_learn(self):
+        self.assertEqual(self.codec.prefixes[0], (
+            u'http://commons.wikimedia.org/wiki/Special:FilePath/'))
+        self.assertIn(u'http://dbpedia.org/resource/', self.codec.prefixes)
+
+    def test_encode_decode(self):
+        for value in [
+                u'http://dbpedia.org/resource/AC/DC',
+                u'http://commons.wikimedia.org/wiki/Special:FilePath/C.jpg',
+                u'http://example.org/', u'\x01escaped', u'', 7]:
+            coded = self.codec.encode(value)
+            self.assertEqual(self.codec.decode(coded), value)
+        self.assertEqual(
+            self.codec.encode(u'http://dbpedia.org/resource/AC/DC'),
+            u'{}AC/DC'.format(unichr(1 + self.codec.prefixes.index(
+                u'http://dbpedia.org/resource/'))))
+
+
+class PrefixCodedTestCase(test.TestCase, CommonTestCase):
+    def setUp(self):
+        self.kvs = PrefixCoded(Dict())
+
+    def test_put_many_learns_prefixes(self):
+        inner = self.kvs.kvs
+        self.kvs.put_many([
+            ('a', u'http://dbpedia.org/resource/A'),
+            ('b', u'http://dbpedia.org/resource/B')])
+        self.assertIn(PREFIX_TABLE_KEY, inner)
+        self.assertItemsEqual(self.kvs.keys(), ['a', 'b'])
+        self.assertItemsEqual(
+            self.kvs.get('a'), [u'http://dbpedia.org/resource/A'])
+        self.assertEqual(len(next(iter(inner.get('a')))), 2)
+        self.assertLess(self.kvs.coded_bytes, self.kvs.raw_bytes)
+        self.kvs.remove_many([('b', u'http://dbpedia.org/resource/B')])
+        self.assertNotIn('b', self.kvs)
+
+        reopened = PrefixCoded(inner)
+        self.assertEqual(reopened.codec.prefixes, self.kvs.codec.prefixes)
+        self.assertItemsEqual(
+            reopened.get_many(['a'])['a'], [u'http://dbpedia.org/resource/A'])
+
+    def test_missing_table(self):
+        self.kvs.put_many([
+            ('a', u'http://dbpedia.org/resource/A'),
+            ('b', u'http://dbpedia.org/resource/B')])
+        inner = self.kvs.kvs
+        inner.delete(PREFIX_TABLE_KEY)
+        with self.assertRaises(ValueError):
+            PrefixCoded(inner).get('a')
+
+    def test_remove_many_values_put_before_learning(self):
+        value = u'http://dbpedia.org/resource/A'
+        self.kvs.put('a', value)
+        self.kvs.put_many([('b', value), ('c', value)])
+        self.kvs.remove_many([('a', value), ('b', value)])
+        self.assertNotIn('a', self.kvs)
+        self.assertNotIn('b', self.kvs)
+        self.assertItemsEqual(self.kvs.get('c'), [value])
+
+
+class SQLiteTestCase(test.TestCase, CommonTestCase):
+    def setUp(self):
+        self.table_name = next(tempfile._get_candidate_names())
+        self.kvs = SQLite(self.table_name)
+
+    def tearDown(self):
+        self.kvs.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.kvs.path + suffix):
+                os.unlink(self.kvs.path + suffix)
+
+    def test_int_keys_and_values(self):
+        self.kvs.put_many([(1, 10), (1, 11), (2, u'b')])
+        self.assertEqual(self.kvs.get_many([1, 2, 3]), {
+            1: set([10, 11]), 2: set([u'b'])})
+        self.assertItemsEqual(self.kvs.keys(), [u'1', u'2'])
+
+    def test_get_many_chunks(self):
+        items = [('key{}'.format(i), i) for i in range(2500)]
+        self.kvs.put_many(items)
+        found = self.kvs.get_many(key for key, _ in items)
+        self.assertEqual(
+            found, dict((key, set([value])) for key, value in items))
+
+    def test_read_while_writing(self):
+        self.kvs.put('key', 'value')
+        reader = SQLite(self.table_name)
+        connection = self.kvs._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute("INSERT INTO kvs VALUES ('other', 'value')")
+        self.assertItemsEqual(reader.get('key'), ['value'])
+        self.assertNotIn('other', reader)
+        connection.commit()
+        self.assertIn('other', reader)
+        reader.close()
+
+
+class ShardedTestCase(test.TestCase, CommonTestCase):
+    def setUp(self):
+        self.kvs = Sharded('test', Dict, 4, create=True)
+
+    def tearDown(self):
+        self.kvs.close()
+
+    def test_put_many_spreads_keys(self):
+        items = [('key{}'.format(i), i) for i in range(1000)]
+        self.kvs.put_many(items)
+        sizes = [
+            len(set(shard.keys()) - set([SHARDS_KEY]))
+            for shard in self.kvs.shards]
+        self.assertEqual(sum(sizes), 1000)
+        self.assertGreater(min(sizes), 100)
+        found = self.kvs.get_many(key for key, _ in items)
+        self.assertEqual(
+            found, dict((key, set([value])) for key, value in items))
+
+    def test_consistent_hashing(self):
+        keys = ['key{}'.format(i) for i in range(1000)]
+        more = Sharded('test', Dict, 5, create=True)
+        moved = sum(
+            1 for key in keys
+            if self.kvs._index(key) != more._index(key))
+        more.close()
+        self.assertLess(moved, 400)
+
+    def test_shard_names(self):
+        self.kvs.close()
+        backend = test.mock.Mock()
+        backend.return_value.get_many.return_value = {SHARDS_KEY: set([2])}
+        self.kvs = Sharded('test', backend, 2, region_name='x')
+        self.assertEqual(backend.call_args_list, [
+            test.mock.call('test-0', region_name='x'),
+            test.mock.call('test-1', region_name='x')])
+
+    def test_shard_count(self):
+        self.kvs.put_many([('key', 'value')])
+        self.assertEqual(self.kvs.keys(), ['key'])
+        table_name = next(tempfile._get_candidate_names())
+        paths = ['{}-{}'.format(table_name, i) for i in range(3)]
+        try:
+            Sharded(table_name, Shelf, 2, create=True).close()
+            Sharded(table_name, Shelf, 2).close()
+            with self.assertRaises(ValueError):
+                Sharded(table_name, Shelf, 3, create=True)
+            with self.assertRaises(ValueError):
+                check_shards(Shelf(paths[0]), paths[0], 1, create=True)
+            with self.assertRaises(ValueError):
+                check_shards(Shelf(table_name), table_name, 1)
+            paths.append(table_name)
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def test_shard_count_reopened(self):
+        for backend, value in [
+                (Index, 'value'), (Index, 7), (SQLite, 'value'),
+                (Shelf, 'value')]:
+            table_name = next(tempfile._get_candidate_names())
+            kvs = backend(table_name)
+            try:
+                check_shards(kvs, table_name, 1, create=True)
+                kvs.put('key', value)
+                kvs.close()
+                kvs = backend(table_name)
+                check_shards(kvs, table_name, 1)
+                with self.assertRaises(ValueError):
+                    check_shards(kvs, table_name, 2)
+                self.assertItemsEqual(kvs.get('key'), [value])
+            finally:
+                kvs.close()
+                for path in glob('{}*'.format(table_name)):
+                    os.unlink(path)
+
 
 class DictTestCase(test.TestCase, CommonTestCase):
     def setUp(self):
         self.kvs = Dict()
 
 
+class PostingsTestCase(test.TestCase):
+    def setUp(self):
+        self.kvs = Postings()
+
+    def test_put_get(self):
+        self.kvs.put_many([('key', 3), ('key', 1), ('key', 3), ('k', 2)])
+        self.assertEqual(list(self.kvs.get('key')), [1, 3])
+        self.assertEqual(list(self.kvs.get('k')), [2])
+        self.kvs.put('key', 5)
+        self.assertEqual(list(self.kvs.get('key')), [1, 3, 5])
+
+    def test_contains_delete(self):
+        self.kvs.put('key', 1)
+        self.assertIn('key', self.kvs)
+        self.kvs.delete('key')
+        self.assertNotIn('key', self.kvs)
+        with self.assertRaises(KeyError):
+            self.kvs.get('key')
+        with self.assertRaises(KeyError):
+            self.kvs.delete('key')
+
+    def test_remove_many(self):
+        self.kvs.put_many([('key', 3), ('key', 1), ('key', 2), ('k', 2)])
+        self.kvs.remove_many([('key', 3), ('key', 1), ('k', 2), ('x', 1)])
+        self.assertEqual(list(self.kvs.get('key')), [2])
+        self.assertNotIn('k', self.kvs)
+
+
+class IndexTestCase(test.TestCase, CommonTestCase):
+    def setUp(self):
+        self.table_name = next(tempfile._get_candidate_names())
+        self.kvs = Index(self.table_name)
+
+    def tearDown(self):
+        if os.path.exists(self.kvs.path):
+            os.unlink(self.kvs.path)
+
+    def _reopen(self):
+        self.kvs.close()
+        self.kvs = Index(self.table_name)
+
+    def test_reopen(self):
+        self.kvs.put_many([
+            (u'american', u'http://dbpedia.org/resource/American_Samoa'),
+            (u'american', u'http://dbpedia.org/resource/Americanism'),
+            (u'samoa', u'http://dbpedia.org/resource/American_Samoa'),
+            (u'\xe9t\xe9', u'http://dbpedia.org/resource/\xc9t\xe9'),
+        ])
+        self._reopen()
+        self.assertItemsEqual(self.kvs.get('american'), [
+            'http://dbpedia.org/resource/American_Samoa',
+            'http://dbpedia.org/resource/Americanism'])
+        self.assertItemsEqual(self.kvs.get('samoa'), [
+            'http://dbpedia.org/resource/American_Samoa'])
+        self.assertItemsEqual(self.kvs.get(u'\xe9t\xe9'), [
+            u'http://dbpedia.org/resource/\xc9t\xe9'])
+        self.assertIn('samoa', self.kvs)
+        self.assertNotIn('sam', self.kvs)
+        self.assertNotIn('zzz', self.kvs)
+        with self.assertRaises(KeyError):
+            self.kvs.get('americans')
+        self.assertEqual(
+            self.kvs.get_many(['samoa', 'nokey']).keys(), ['samoa'])
+
+    def test_get_many_sorted_merge(self):
+        keys = ['key{:03}'.format(i) for i in range(0, 200, 2)]
+        self.kvs.put_many(
+            (key, 'value{}'.format(i % 7)) for i, key in enumerate(keys))
+        self.kvs.put(7, 'seven')
+        self._reopen()
+        lookups = ['key{:03}'.format(i) for i in range(199, -1, -3)] + [7]
+        found = self.kvs.get_many(lookups)
+        self.assertEqual(
+            set(found), set(key for key in lookups if key in keys) | set([7]))
+        for key, values in found.iteritems():
+            self.assertEqual(values, self.kvs.get(key))
+
+    def test_reopen_int_values(self):
+        self.kvs.put_many([('key', 300), ('key', 1), ('key', 2 ** 40)])
+        self._reopen()
+        self.assertItemsEqual(self.kvs.get('key'), [1, 300, 2 ** 40])
+
+    def test_intersect_int_postings(self):
+        self.kvs.put_many(('large', i) for i in range(0, 10000, 3))
+        self.kvs.put_many(('small', i) for i in (9000, 500, 3))
+        self._reopen()
+        found = self.kvs.get_many(['large', 'small'])
+        self.assertEqual(found['small'], [3, 500, 9000])
+        with test.mock.patch.object(
+                postings, 'gallop', wraps=postings.gallop) as gallop:
+            self.assertEqual(
+                postings.intersect(found.values()), [3, 9000])
+        self.assertTrue(gallop.called)
+
+    def test_reopen_empty(self):
+        self._reopen()
+        self.assertNotIn('key', self.kvs)
+
+    def test_read_only(self):
+        self._reopen()
+        with self.assertRaises(IOError):
+            self.kvs.put('key', 'value')
+        with self.assertRaises(IOError):
+            self.kvs.delete('key')
+
+    def test_refresh(self):
+        self.kvs.put('key', 'old')
+        self._reopen()
+        builder = Index(self.table_name + '.new')
+        builder.put('key', 'new')
+        builder.close()
+        os.rename(builder.path, self.kvs.path)
+        self.assertItemsEqual(self.kvs.get('key'), ['old'])
+        self.kvs.refresh()
+        self.assertItemsEqual(self.kvs.get('key'), ['new'])
+
+
 @skipUnless(test.TEST_DYNAMODB_LOCAL, 'requires dynamodb local')
 # Running DynamoDB on Your Computer:
 # docs.aws.amazon.com/amazondynamodb/latest/developerguide/DynamoDBLocal.html
@@ -90,6 +542,155 @@ class DynamoDBTestCase(test.TestCase, CommonTestCase):
     def tearDown(self):
         self.table.delete()
 
+    def test_put_many_merges_stored_values(self):
+        self.kvs.put('key', 'value1')
+        self.kvs.put_many([('key', 'value2'), ('k', 'v')])
+        self.kvs.flush()
+        self.assertItemsEqual(self.kvs.get('key'), ['value1', 'value2'])
+        self.assertItemsEqual(self.kvs.get('k'), ['v'])
+
+    def test_put_many_batches(self):
+        items = [('key{}'.format(i), 'value') for i in range(60)]
+        self.kvs.put_many(items)
+        self.kvs.flush()
+        for key, value in items:
+            self.assertItemsEqual(self.kvs.get(key), [value])
+
+
+class DynamoDBBatchTestCase(test.TestCase):
+    """BatchWriteItem and BatchGetItem paths against a stubbed client."""
+    def setUp(self):
+        self.kvs = DynamoDB(
+            'test', region_name='us-east-1', aws_access_key_id='test',
+            aws_secret_access_key='test')
+        self.stubber = Stubber(self.kvs._kvs.meta.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def _put_requests(self, count):
+        return [{'PutRequest': {'Item': ANY}}] * count
+
+    def test_flush_batches_keys(self):
+        self.stubber.add_response('scan', {'Count': 0})
+        self.stubber.add_response(
+            'batch_write_item', {},
+            {'RequestItems': {'test': self._put_requests(25)}})
+        self.stubber.add_response(
+            'batch_write_item', {},
+            {'RequestItems': {'test': self._put_requests(5)}})
+        self.kvs.put_many(('key{}'.format(i), 'value') for i in range(30))
+        self.kvs.put_many([('key0', 'value2')])
+        self.kvs.flush()
+        self.stubber.assert_no_pending_responses()
+
+    @test.mock.patch('kvs.time.sleep')
+    def test_flush_retries_unprocessed_items(self, sleep):
+        unprocessed = {'test': [{'PutRequest': {'Item': {
+            'kvs_key': {'S': 'key'}, 'kvs_values': {'SS': ['value']}}}}]}
+        self.stubber.add_response('scan', {'Count': 0})
+        self.stubber.add_response(
+            'batch_write_item', {'UnprocessedItems': unprocessed})
+        self.stubber.add_response(
+            'batch_write_item', {},
+            {'RequestItems': {'test': self._put_requests(1)}})
+        self.kvs.put_many([('key', 'value')])
+        self.kvs.flush()
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_flush_merges_into_existing_table(self):
+        self.stubber.add_response('scan', {'Count': 1})
+        self.stubber.add_response('update_item', {}, {
+            'TableName': 'test', 'Key': ANY, 'UpdateExpression': ANY,
+            'ExpressionAttributeNames': ANY,
+            'ExpressionAttributeValues': ANY, 'ReturnValues': 'NONE'})
+        self.kvs.put_many([('key', 'value1'), ('key', 'value2')])
+        self.kvs.flush()
+        self.stubber.assert_no_pending_responses()
+
+    def test_flush_merges_keys_written_by_put(self):
+        update = {
+            'TableName': 'test', 'Key': {'kvs_key': 'key'},
+            'UpdateExpression': ANY, 'ExpressionAttributeNames': ANY,
+            'ExpressionAttributeValues': ANY, 'ReturnValues': 'NONE'}
+        self.stubber.add_response('update_item', {}, update)
+        self.stubber.add_response('scan', {'Count': 0})
+        self.stubber.add_response('update_item', {}, update)
+        self.kvs.put('key', 'value1')
+        self.kvs.put_many([('key', 'value2')])
+        self.kvs.flush()
+        self.stubber.assert_no_pending_responses()
+
+    def test_written_keys_bounded(self):
+        kvs = DynamoDB(
+            'test', written_capacity=100, region_name='us-east-1',
+            aws_access_key_id='test', aws_secret_access_key='test')
+        written = kvs._written_keys()
+        self.assertEqual(written.capacity, 100)
+        self.assertIs(kvs._written_keys(), written)
+
+    def test_remove_many_updates_in_place(self):
+        self.stubber.add_response(
+            'update_item', {'Attributes': {'kvs_values': {'SS': ['v2']}}},
+            {'TableName': 'test', 'Key': {'kvs_key': 'key1'},
+             'UpdateExpression': ANY, 'ExpressionAttributeNames': ANY,
+             'ExpressionAttributeValues': {':attrValue': set(['v1'])},
+             'ReturnValues': 'UPDATED_NEW'})
+        self.stubber.add_response('update_item', {}, {
+            'TableName': 'test', 'Key': {'kvs_key': 'key2'},
+            'UpdateExpression': ANY, 'ExpressionAttributeNames': ANY,
+            'ExpressionAttributeValues': {':attrValue': set(['v'])},
+            'ReturnValues': 'UPDATED_NEW'})
+        self.stubber.add_response('delete_item', {}, {
+            'TableName': 'test', 'Key': {'kvs_key': 'key2'},
+            'ConditionExpression': 'attribute_not_exists(kvs_values)'})
+        self.kvs.remove_many([('key1', 'v1')])
+        self.kvs.remove_many([('key2', 'v')])
+        self.stubber.assert_no_pending_responses()
+
+    def test_batch_pool_started_once(self):
+        pools = []
+        threads = [
+            threading.Thread(target=lambda: pools.append(
+                self.kvs._batch_pool()))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(set(map(id, pools))))
+        self.kvs.close()
+        self.assertIsNone(self.kvs._pool)
+
+    def test_keys_scans_pages(self):
+        self.stubber.add_response(
+            'scan', {'Items': [{'kvs_key': {'S': 'key1'}}],
+                     'LastEvaluatedKey': {'kvs_key': {'S': 'key1'}}},
+            {'TableName': 'test', 'ProjectionExpression': 'kvs_key'})
+        self.stubber.add_response(
+            'scan', {'Items': [{'kvs_key': {'S': 'key2'}}]},
+            {'TableName': 'test', 'ProjectionExpression': 'kvs_key',
+             'ExclusiveStartKey': {'kvs_key': 'key1'}})
+        self.assertEqual(self.kvs.keys(), ['key1', 'key2'])
+        self.stubber.assert_no_pending_responses()
+
+    @test.mock.patch('kvs.time.sleep')
+    def test_get_many_retries_unprocessed_keys(self, sleep):
+        self.stubber.add_response('batch_get_item', {
+            'Responses': {'test': [{
+                'kvs_key': {'S': 'key1'}, 'kvs_values': {'SS': ['value1']}}]},
+            'UnprocessedKeys': {'test': {'Keys': [{'kvs_key': {'S': 'key2'}}]}},
+        })
+        self.stubber.add_response('batch_get_item', {
+            'Responses': {'test': [{
+                'kvs_key': {'S': 'key2'}, 'kvs_values': {'SS': ['value2']}}]},
+        })
+        found = self.kvs.get_many(['key1', 'key2', 'nokey'])
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(found, {'key1': set(['value1']), 'key2': set(['value2'])})
+
 
 if __name__ == '__main__':
     test.main()
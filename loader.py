@@ -26,19 +26,55 @@ $ python loader.py -d --filter=Al
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import binascii
 import logging
+import os
+import sys
+import time
 
+from collections import defaultdict
+from itertools import islice
+from multiprocessing import Pool
 from argparse import ArgumentParser, FileType
-from .kvs import Dict, DynamoDB, Shelf
-from .parser_nt import image_iterator, label_iterator, Stemmer
+from .bloom import ERROR_RATE, BloomFilter
+from .delta import (
+    Checkpoint, apply_changes, diff_pairs, fingerprint, image_changes,
+    term_changes)
+from .kvs import (
+    BLOOM_CAPACITY, PREFIX_TABLE_KEY, BloomGuard, PrefixCoded, Registry,
+    Sharded, check_shards)
+from .parser_nt import (
+    PARSER_MODES, image_diff_iterator, image_iterator, label_diff_iterator,
+    label_iterator, shared_stemmer, Stemmer)
+from .stats import Recorder
 
 IMAGES_KVS_NAME = 'images'
 TERMS_KVS_NAME = 'terms'
-STORAGE_CHOICES = {
-    'disk': Shelf,
-    'mem': Dict,
-    'cloud': DynamoDB
-}
+CATEGORIES_KVS_NAME = 'categories'
+STATISTICS_KVS_NAME = 'statistics'
+LENGTHS_KVS_NAME = 'lengths'
+# Bloom filter sidecar of a store guarded with --bloom.
+BLOOM_PATH = '{}.bloom'
+# Key of the epoch markers in the images store. Every load adds a new one,
+# and the newest EPOCH_HISTORY are kept.
+EPOCH_KEY = 'epoch'
+EPOCH_HISTORY = 4
+# Backends are imported when selected: only 'cloud' needs boto3.
+STORAGE_CHOICES = Registry({
+    'disk': 'Shelf',
+    'mem': 'Dict',
+    'cloud': 'DynamoDB',
+    'index': 'Index',
+    'sqlite': 'SQLite',
+})
+# Stores for the terms KVS when its values are interned category IDs.
+POSTINGS_CHOICES = Registry({
+    'mem': 'Postings',
+})
+# Labels whose words are stemmed together by one stem_many call.
+STEM_BATCH_SIZE = 100000
+# Categories with images that the --prune filter is sized for.
+PRUNE_CAPACITY = 4000000
 
 
 def parse_args(prog='loader', description='Wiki loader.'):
@@ -55,10 +91,256 @@ def parse_args(prog='loader', description='Wiki loader.'):
     parser.add_argument(
         '--labels', type=FileType('r'), default='data/labels_en.nt',
         help="path to labels data file")
-    return parser.parse_args()
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="parse data files and stem labels with WORKERS processes")
+    parser.add_argument(
+        '--parser', choices=PARSER_MODES, default='bytes',
+        help="parse data files in PARSER mode")
+    parser.add_argument(
+        '--vocabulary',
+        help="warm-start the stemmer from VOCABULARY and save it after loading")
+    parser.add_argument(
+        '--intern', action='store_true',
+        help="store categories as integer IDs")
+    parser.add_argument(
+        '--statistics', action='store_true',
+        help="store term and label statistics for ranked queries")
+    parser.add_argument(
+        '--prune', action='store_true',
+        help="index only the labels of categories with images")
+    parser.add_argument(
+        '--prune-capacity', type=int, default=PRUNE_CAPACITY,
+        help="size the --prune filter for PRUNE_CAPACITY categories with "
+             "images")
+    parser.add_argument(
+        '--prune-error-rate', type=float, default=ERROR_RATE,
+        help="false-positive rate of the --prune filter at capacity: the "
+             "share of labels without images that are still indexed")
+    parser.add_argument(
+        '--shards', type=int, default=1,
+        help="split the images and terms stores over SHARDS stores, loaded "
+             "in parallel (the querier needs the same --shards)")
+    parser.add_argument(
+        '--prefix-coding', action='store_true',
+        help="store URI values front-coded against a prefix table learned "
+             "from the data")
+    parser.add_argument(
+        '--bloom', action='store_true',
+        help="keep a Bloom filter of the keys of the images and terms "
+             "stores next to them, for the querier --bloom")
+    parser.add_argument(
+        '--bloom-capacity', type=int, default=BLOOM_CAPACITY,
+        help="size new Bloom filters for BLOOM_CAPACITY keys")
+    parser.add_argument(
+        '--bloom-error-rate', type=float, default=ERROR_RATE,
+        help="false-positive rate of new Bloom filters at capacity")
+    parser.add_argument(
+        '--previous-images', type=FileType('r'),
+        help="load only the changes from PREVIOUS_IMAGES to IMAGES")
+    parser.add_argument(
+        '--previous-labels', type=FileType('r'),
+        help="load only the changes from PREVIOUS_LABELS to LABELS")
+    parser.add_argument(
+        '--diff', action='store_true',
+        help="IMAGES and LABELS are diffs (diff -u) of two versions: "
+             "load only their changes")
+    parser.add_argument(
+        '--new-labels', type=FileType('r'),
+        help="with --diff, the new version of the labels file, to keep "
+             "the terms of removed labels that other labels still hold")
+    parser.add_argument(
+        '--checkpoint', default='loader.checkpoint',
+        help="record the progress of a change load in CHECKPOINT, "
+             "and resume from it")
+    parser.add_argument(
+        '--stats', action='store_true',
+        help="time parsing, stemming and store operations, and print a "
+             "summary to stderr")
+    parser.add_argument(
+        '--stats-json',
+        help="time parsing, stemming and store operations, and write them "
+             "as JSON to STATS_JSON")
+    args = parser.parse_args()
+    if args.diff or args.previous_images or args.previous_labels:
+        if args.kvs == 'index':
+            parser.error("the index store cannot load changes, rebuild it")
+        if args.statistics:
+            parser.error("--statistics needs a full load")
+        if args.prune:
+            parser.error("--prune needs a full load")
+    if args.diff and args.new_labels is None:
+        parser.error("--diff needs --new-labels to remove terms")
+    return args
+
+
+class Categories(object):
+    """Category dictionary: maps category URIs to dense integer IDs."""
+    def __init__(self):
+        self._ids = {}
+        self.uris = []
+
+    def __len__(self):
+        return len(self.uris)
+
+    def intern(self, uri):
+        """Return the ID of uri, assigning the next one if it is new."""
+        category_id = self._ids.get(uri)
+        if category_id is None:
+            category_id = self._ids[uri] = len(self.uris)
+            self.uris.append(uri)
+        return category_id
+
+    def save(self, kvs):
+        """Store (ID, URI) pairs in kvs."""
+        kvs.put_many(enumerate(self.uris))
+        kvs.flush()
+
+    def load(self, kvs, batch_size=10000):
+        """Read the (ID, URI) pairs stored in kvs by save."""
+        while True:
+            category_ids = range(len(self.uris), len(self.uris) + batch_size)
+            uris = kvs.get_many(category_ids)
+            for category_id in category_ids:
+                if not uris.get(category_id):
+                    return
+                self.intern(next(iter(uris[category_id])))
+
+
+class Statistics(object):
+    """Term and label statistics for ranking.
 
+    Counts the document frequency of every term and the label length of
+    every category. The frequencies are saved under document_frequency_key
+    with the number of categories and their total label length under
+    DOCUMENTS_KEY and WORDS_KEY, and the lengths in a store of their own,
+    keyed by category like the images store.
+    """
+    DOCUMENTS_KEY = 'documents'
+    WORDS_KEY = 'words'
+
+    def __init__(self):
+        self.frequencies = defaultdict(int)
+        self.lengths = defaultdict(int)
+
+    @staticmethod
+    def document_frequency_key(term):
+        return 'df:{}'.format(term)
+
+    def add(self, category, terms):
+        """Count the terms of a category label."""
+        self.lengths[category] += len(terms)
+        for term in set(terms):
+            self.frequencies[term] += 1
+
+    def save(self, kvs, lengths_kvs):
+        """Store the frequencies and totals in kvs, the lengths in lengths_kvs.
+        """
+        kvs.put_many(
+            (self.document_frequency_key(term), frequency)
+            for term, frequency in self.frequencies.iteritems())
+        kvs.put(self.DOCUMENTS_KEY, len(self.lengths))
+        kvs.put(self.WORDS_KEY, sum(self.lengths.itervalues()))
+        kvs.flush()
+        lengths_kvs.put_many(self.lengths.iteritems())
+        lengths_kvs.flush()
+
+
+def bloom_guard(kvs, name, capacity=BLOOM_CAPACITY, error_rate=ERROR_RATE,
+                images_kvs=None, persist=True):
+    """Wrap kvs, the store name, in a BloomGuard with its sidecar.
+
+    The sidecar is checked against the epoch marker of images_kvs, the
+    images store loaded with kvs (default: kvs), and saved with persist
+    only.
+    """
+    if images_kvs is None:
+        images_kvs = kvs
+    return BloomGuard(
+        kvs, BLOOM_PATH.format(name), capacity, error_rate,
+        epoch=lambda: read_epoch(images_kvs), persist=persist)
 
-def load_images(kvs, image_iterator):
+
+def open_kvs(backend, name, shards=1, create=False):
+    """Open the store name with backend, as a Sharded store if shards > 1.
+
+    The store must have been loaded with as many shards (see check_shards);
+    with create, as for a load, a store that records none records shards.
+
+    Raises:
+        ValueError: the store was loaded with another number of shards.
+    """
+    if shards > 1:
+        return Sharded(name, backend, shards, create=create)
+    kvs = backend(name)
+    check_shards(kvs, name, shards, create)
+    return kvs
+
+
+def prefix_coded(kvs, prefix_coding=False):
+    """Wrap kvs in a PrefixCoded store if prefix_coding, or if it holds a
+    prefix table already; else return kvs."""
+    if prefix_coding or PREFIX_TABLE_KEY in kvs:
+        return PrefixCoded(kvs)
+    return kvs
+
+
+def instrument(recorder, kvs, name, backend):
+    """Wrap kvs, the store name on backend, to be timed by recorder, or
+    return it as it is without one."""
+    if recorder is None:
+        return kvs
+    return recorder.kvs(kvs, name, backend)
+
+
+def stats_recorder(args):
+    """Return a Recorder if args ask for --stats or --stats-json, else None.
+    """
+    return Recorder() if args.stats or args.stats_json else None
+
+
+def report_stats(recorder, args):
+    """Print the summary of recorder with --stats, and dump it as JSON to
+    --stats-json."""
+    if args.stats:
+        print(recorder.summary(), file=sys.stderr)
+    if args.stats_json:
+        recorder.dump(args.stats_json)
+
+
+def write_epoch(kvs):
+    """Add a new epoch marker to kvs and return it.
+
+    The marker tells readers, such as the querier's QueryCache, that a new
+    generation of the stores was loaded. Markers start with the time they
+    were written, so the newest sorts last. It is added with one put, and
+    only then are markers beyond the newest EPOCH_HISTORY removed, so
+    readers always find a marker, the previous one or the new one.
+    """
+    epoch = '{:020d}-{}'.format(
+        int(time.time() * 1e6), binascii.hexlify(os.urandom(8)))
+    kvs.put(EPOCH_KEY, epoch)
+    kvs.flush()
+    epochs = sorted(read_epochs(kvs))
+    if len(epochs) > EPOCH_HISTORY:
+        kvs.remove_many(
+            (EPOCH_KEY, old) for old in epochs[:-EPOCH_HISTORY])
+        kvs.flush()
+    return epoch
+
+
+def read_epochs(kvs):
+    """Return the epoch markers in kvs."""
+    return kvs.get_many([EPOCH_KEY]).get(EPOCH_KEY) or set()
+
+
+def read_epoch(kvs):
+    """Return the newest epoch marker in kvs, or None if it has none."""
+    epochs = read_epochs(kvs)
+    return max(epochs) if epochs else None
+
+
+def load_images(kvs, image_iterator, categories=None, images=None):
     """Build index from image data.
 
     Store images in KVS where the key is the Wikipedia category and the value
@@ -71,16 +353,28 @@ def load_images(kvs, image_iterator):
     Args:
         kvs: object, key-value store to store image category, URL pairs
         image_iterator: generator, yields (category, URL) pairs
+        categories: object, Categories to key the images by category ID
+        images: object, set or BloomFilter to add the category URIs to
     """
-    
-    for image in image_iterator:
-        #kvs[image[0]] = image[1]
-        print(image[0], '-', image[1])
-        kvs.put(image[0], image[1])
+    if images is not None:
+        image_iterator = _collect(image_iterator, images)
+    if categories is not None:
+        image_iterator = (
+            (categories.intern(category), url)
+            for category, url in image_iterator)
+    kvs.put_many(image_iterator)
+    kvs.flush()
 
 
+def _collect(image_iterator, images):
+    """Add the category of each (category, url) pair to images."""
+    for category, url in image_iterator:
+        images.add(category)
+        yield category, url
 
-def load_terms(kvs, images_kvs, label_iterator):
+
+def load_terms(kvs, images_kvs, label_iterator, stemmer=None, processes=None,
+               categories=None, statistics=None, images=None):
     """Build "inverted index" from labels data.
 
     Store labels in KVS where the key is a word from the label and the value
@@ -104,18 +398,131 @@ def load_terms(kvs, images_kvs, label_iterator):
     Args:
         kvs: object, key-value store (modified label, category) pairs
         label_iterator: generator, yields (category, label) pairs
+        stemmer: object, Stemmer to use (default: the shared Stemmer)
+        processes: int, number of processes to stem the labels with; one
+            pool of them stems every batch
+        categories: object, Categories to store category IDs instead of URIs
+        statistics: object, Statistics to count the stemmed labels in
+        images: object, set or BloomFilter of the categories with images, as
+            filled by load_images; the labels of other categories are skipped
+    Returns:
+        (labels, skipped) pair: the number of labels read, and skipped.
+    """
+    stemmer = stemmer or shared_stemmer()
+    label_iterator = iter(label_iterator)
+    pool = Pool(processes) if processes and processes > 1 else None
+    try:
+        return _load_terms(
+            kvs, label_iterator, stemmer, processes, pool, categories,
+            statistics, images)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _load_terms(kvs, label_iterator, stemmer, processes, pool, categories,
+                statistics, images):
+    """Load the labels in batches; see load_terms."""
+    total = skipped = 0
+    while True:
+        labels = list(islice(label_iterator, STEM_BATCH_SIZE))
+        if not labels:
+            break
+        total += len(labels)
+        if images is not None:
+            skipped += len(labels)
+            labels = [
+                (category, words) for category, words in labels
+                if category in images]
+            skipped -= len(labels)
+        if categories is not None:
+            labels = [
+                (categories.intern(category), words)
+                for category, words in labels]
+        pairs = [
+            (word, category)
+            for category, words in labels
+            for word in words.split(" ")]
+        stems = stemmer.stem_many(
+            [word for word, _ in pairs], processes=processes, pool=pool)
+        if statistics is not None:
+            start = 0
+            for category, words in labels:
+                end = start + words.count(" ") + 1
+                statistics.add(category, stems[start:end])
+                start = end
+        kvs.put_many(
+            (stem, category) for stem, (_, category) in zip(stems, pairs))
+    kvs.flush()
+    return total, skipped
+
+
+def load_changes(args, images_kvs, terms_kvs, stemmer, categories=None,
+                 recorder=None):
+    """Apply the changes between two versions of the data files.
+
+    The changes come from the diffs in args.images and args.labels with
+    args.diff, or else from comparing args.previous_images with args.images
+    and args.previous_labels with args.labels; a store without a previous
+    version is left as is. The terms of removed labels are checked against
+    the new labels, args.new_labels with args.diff or else args.labels,
+    read again. Progress is checkpointed in args.checkpoint.
+    Statistics are not updated: a ranked store needs a full load.
+
+    Args:
+        args: object, parsed loader arguments
+        images_kvs: object, images key-value store to update
+        terms_kvs: object, terms key-value store to update
+        stemmer: object, Stemmer to use
+        categories: object, Categories loaded from the categories store
+        recorder: object, Recorder to time the parsing of the changes with
     """
-    
-    for label in label_iterator:
-        category = label[0]
-        words = label[1]
-        #print(words)
-        for word in words.split(" "):
-            #kvs[word.lower()] = category
-            #print("99999",word)
-            #print("99999",category)
-            kvs.put(word,category)
-            #print("999",kvs.get(word))
+    images = labels = new_labels = None
+    if args.diff:
+        images = image_diff_iterator(args.images, filter=args.filter)
+        labels = label_diff_iterator(args.labels)
+        new_labels = args.new_labels
+    if args.previous_images:
+        images = diff_pairs(
+            image_iterator(
+                args.previous_images, filter=args.filter,
+                workers=args.workers, mode=args.parser),
+            image_iterator(
+                args.images, filter=args.filter, workers=args.workers,
+                mode=args.parser))
+    if args.previous_labels:
+        labels = diff_pairs(
+            label_iterator(
+                args.previous_labels, workers=args.workers, mode=args.parser),
+            label_iterator(
+                args.labels, workers=args.workers, mode=args.parser))
+        new_labels = open(args.labels.name)
+    if new_labels is not None:
+        new_labels = label_iterator(
+            new_labels, workers=args.workers, mode=args.parser)
+    if recorder is not None:
+        if images is not None:
+            images = recorder.iterator(images, 'parser.images')
+        if labels is not None:
+            labels = recorder.iterator(labels, 'parser.labels')
+
+    inputs = [
+        args.images, args.labels, args.previous_images, args.previous_labels,
+        args.new_labels]
+    checkpoint = Checkpoint(args.checkpoint, fingerprint(
+        [f.name for f in inputs if f is not None]))
+    if images is not None:
+        done = apply_changes(
+            images_kvs, image_changes(images, categories), checkpoint,
+            'images')
+        logging.debug('image changes {}'.format(done))
+    if labels is not None:
+        done = apply_changes(
+            terms_kvs, term_changes(labels, stemmer, categories, new_labels),
+            checkpoint, 'terms')
+        logging.debug('term changes {}'.format(done))
+    checkpoint.clear()
 
 
 def main():
@@ -127,17 +534,127 @@ def main():
     logging.debug('labels {}'.format(args.labels))
     logging.debug('filter {}'.format(args.filter))
     logging.debug('kvs {}'.format(args.kvs))
+    logging.debug('workers {}'.format(args.workers))
+    logging.debug('parser {}'.format(args.parser))
+    logging.debug('vocabulary {}'.format(args.vocabulary))
+    logging.debug('intern {}'.format(args.intern))
+    logging.debug('statistics {}'.format(args.statistics))
+    logging.debug('prune {} capacity {} error rate {}'.format(
+        args.prune, args.prune_capacity, args.prune_error_rate))
+    logging.debug('shards {}'.format(args.shards))
+    logging.debug('prefix coding {}'.format(args.prefix_coding))
+    logging.debug('bloom {} capacity {} error rate {}'.format(
+        args.bloom, args.bloom_capacity, args.bloom_error_rate))
+    logging.debug('previous images {}'.format(args.previous_images))
+    logging.debug('previous labels {}'.format(args.previous_labels))
+    logging.debug('diff {}'.format(args.diff))
+    logging.debug('new labels {}'.format(args.new_labels))
+    logging.debug('stats {} json {}'.format(args.stats, args.stats_json))
+
+    stats = stats_recorder(args)
+    stemmer = shared_stemmer()
+    if args.vocabulary and os.path.exists(args.vocabulary):
+        stemmer.load_vocabulary(args.vocabulary)
+
+    categories = Categories() if args.intern else None
+    if args.intern:
+        terms_store = POSTINGS_CHOICES.get(args.kvs, STORAGE_CHOICES[args.kvs])
+    else:
+        terms_store = STORAGE_CHOICES[args.kvs]
+    try:
+        images_kvs = open_kvs(
+            STORAGE_CHOICES[args.kvs], IMAGES_KVS_NAME, args.shards,
+            create=True)
+        terms_kvs = open_kvs(
+            terms_store, TERMS_KVS_NAME, args.shards, create=True)
+    except ValueError as e:
+        sys.exit('loader: {}'.format(e))
+    if stats is not None:
+        stemmer = stats.stemmer(stemmer)
+    images_kvs = instrument(stats, images_kvs, IMAGES_KVS_NAME, args.kvs)
+    terms_kvs = instrument(stats, terms_kvs, TERMS_KVS_NAME, args.kvs)
+    images_kvs = prefix_coded(images_kvs, args.prefix_coding)
+    if not args.intern:
+        terms_kvs = prefix_coded(terms_kvs, args.prefix_coding)
+    coded = [
+        (name, kvs)
+        for name, kvs in ((IMAGES_KVS_NAME, images_kvs),
+                          (TERMS_KVS_NAME, terms_kvs))
+        if isinstance(kvs, PrefixCoded)]
+    if args.bloom:
+        terms_kvs = bloom_guard(
+            terms_kvs, TERMS_KVS_NAME, args.bloom_capacity,
+            args.bloom_error_rate, images_kvs)
+        images_kvs = bloom_guard(
+            images_kvs, IMAGES_KVS_NAME, args.bloom_capacity,
+            args.bloom_error_rate)
+    statistics = Statistics() if args.statistics else None
+
+    if args.diff or args.previous_images or args.previous_labels:
+        if args.intern:
+            categories_kvs = instrument(
+                stats, STORAGE_CHOICES[args.kvs](CATEGORIES_KVS_NAME),
+                CATEGORIES_KVS_NAME, args.kvs)
+            categories.load(categories_kvs)
+            categories_kvs.close()
+        load_changes(
+            args, images_kvs, terms_kvs, stemmer, categories, recorder=stats)
+    else:
+        images = image_iterator(
+            args.images, filter=args.filter, workers=args.workers,
+            mode=args.parser)
+        if stats is not None:
+            images = stats.iterator(images, 'parser.images')
+        with_images = None
+        if args.prune:
+            with_images = BloomFilter(
+                args.prune_capacity, args.prune_error_rate)
+        load_images(
+            images_kvs, images, categories=categories, images=with_images)
+        labels = label_iterator(
+            args.labels, workers=args.workers, mode=args.parser)
+        if stats is not None:
+            labels = stats.iterator(labels, 'parser.labels')
+        total, skipped = load_terms(
+            terms_kvs, images_kvs, labels, stemmer=stemmer,
+            processes=args.workers, categories=categories,
+            statistics=statistics, images=with_images)
+        if args.prune:
+            print('labels {} pruned {} ({:.1%})'.format(
+                total, skipped, float(skipped) / max(total, 1)),
+                file=sys.stderr)
+    logging.debug('stemmer hits {} misses {}'.format(
+        stemmer.hits, stemmer.misses))
+    if args.vocabulary:
+        stemmer.save_vocabulary(args.vocabulary)
 
-    images = image_iterator(args.images, filter=args.filter)
-    images_kvs = STORAGE_CHOICES[args.kvs](IMAGES_KVS_NAME)
-    load_images(images_kvs, images)
+    if args.intern:
+        logging.debug('categories {}'.format(len(categories)))
+        categories_kvs = instrument(
+            stats, STORAGE_CHOICES[args.kvs](CATEGORIES_KVS_NAME),
+            CATEGORIES_KVS_NAME, args.kvs)
+        categories.save(categories_kvs)
+        categories_kvs.close()
 
-    terms_kvs = STORAGE_CHOICES[args.kvs](TERMS_KVS_NAME)
-    labels = label_iterator(args.labels)
-    load_terms(terms_kvs, images_kvs, labels)
+    if args.statistics:
+        statistics_kvs = instrument(
+            stats, STORAGE_CHOICES[args.kvs](STATISTICS_KVS_NAME),
+            STATISTICS_KVS_NAME, args.kvs)
+        lengths_kvs = instrument(
+            stats, STORAGE_CHOICES[args.kvs](LENGTHS_KVS_NAME),
+            LENGTHS_KVS_NAME, args.kvs)
+        statistics.save(statistics_kvs, lengths_kvs)
+        lengths_kvs.close()
+        statistics_kvs.close()
 
+    for name, kvs in coded:
+        logging.debug('{} value bytes {} prefix-coded {}'.format(
+            name, kvs.raw_bytes, kvs.coded_bytes))
+    logging.debug('epoch {}'.format(write_epoch(images_kvs)))
     terms_kvs.close()
     images_kvs.close()
+    if stats is not None:
+        report_stats(stats, args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
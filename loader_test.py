@@ -22,6 +22,14 @@ class LoadImagesTestCase(test.TestCase):
         for key, value in self.image_iterator:
             self.assertItemsEqual(self.kvs.get(key), [value])
 
+    def test_load_image_kvs_categories(self):
+        categories = loader.Categories()
+        loader.load_images(self.kvs, self.image_iterator, categories)
+        self.assertEqual(
+            categories.uris, [key for key, _ in self.image_iterator])
+        for category_id, (key, value) in enumerate(self.image_iterator):
+            self.assertItemsEqual(self.kvs.get(category_id), [value])
+
 
 class LoadTermsTestCase(test.TestCase):
     def setUp(self):
@@ -54,6 +62,63 @@ class LoadTermsTestCase(test.TestCase):
             test.mock.call('Standards'), test.mock.call('Institute')
         ])
 
+    @test.mock.patch('loader.Stemmer.stem')
+    def test_load_labels_categories(self, mock):
+        mock.side_effect = lambda x: x
+        self.kvs = kvs.Postings()
+        categories = loader.Categories()
+        categories.intern('http://dbpedia.org/resource/American_Samoa')
+        loader.load_terms(
+            self.kvs, self.images_kvs, self.label_iterator,
+            categories=categories)
+        for word, category in self.word_categories:
+            self.assertEqual(list(self.kvs.get(word)), [1])
+        self.assertEqual(categories.uris[1], category)
+
+    @test.mock.patch('loader.Stemmer.stem')
+    def test_load_labels_statistics(self, mock):
+        mock.side_effect = lambda x: x.lower()
+        statistics = loader.Statistics()
+        self.label_iterator.append(('x', 'National Park'))
+        loader.load_terms(
+            self.kvs, self.images_kvs, self.label_iterator,
+            statistics=statistics)
+        self.assertEqual(
+            statistics.lengths, {self.label_iterator[0][0]: 4, 'x': 2})
+        self.assertEqual(statistics.frequencies['national'], 2)
+        self.assertEqual(statistics.frequencies['park'], 1)
+
+    @test.mock.patch('loader.Stemmer.stem')
+    def test_load_labels_prune(self, mock):
+        mock.side_effect = lambda x: x
+        images = set()
+        loader.load_images(
+            self.images_kvs, [(self.label_iterator[0][0], 'url')],
+            images=images)
+        self.label_iterator.append(('x', 'Park'))
+        self.assertEqual(
+            loader.load_terms(
+                self.kvs, self.images_kvs, self.label_iterator,
+                images=images),
+            (2, 1))
+        for word, category in self.word_categories:
+            self.assertItemsEqual(self.kvs.get(word), [category])
+        self.assertNotIn('Park', self.kvs)
+
+    @test.mock.patch('loader.STEM_BATCH_SIZE', 1)
+    @test.mock.patch('loader.Pool')
+    def test_load_labels_one_pool(self, pool):
+        pool.return_value.map.side_effect = map
+        self.images_kvs.put(self.label_iterator[0][0], 'url')
+        self.label_iterator.append((self.label_iterator[0][0], 'Museum'))
+        loader.load_terms(
+            self.kvs, self.images_kvs, self.label_iterator,
+            stemmer=loader.Stemmer(), processes=2)
+        pool.assert_called_once_with(2)
+        self.assertEqual(pool.return_value.map.call_count, 2)
+        pool.return_value.close.assert_called_once_with()
+        self.assertIn('museum', self.kvs)
+
     def test_load_labels_no_image(self):
         loader.load_terms(self.kvs, self.images_kvs, self.label_iterator)
         for word, category in self.word_categories:
@@ -61,5 +126,90 @@ class LoadTermsTestCase(test.TestCase):
                 self.kvs.get(word)
 
 
+class CategoriesTestCase(test.TestCase):
+    def test_intern(self):
+        categories = loader.Categories()
+        self.assertEqual(categories.intern('a'), 0)
+        self.assertEqual(categories.intern('b'), 1)
+        self.assertEqual(categories.intern('a'), 0)
+        self.assertEqual(len(categories), 2)
+
+    def test_save(self):
+        categories = loader.Categories()
+        categories.intern('a')
+        categories.intern('b')
+        categories_kvs = kvs.Dict()
+        categories.save(categories_kvs)
+        self.assertItemsEqual(categories_kvs.get(1), ['b'])
+
+    def test_load(self):
+        categories = loader.Categories()
+        for uri in ['a', 'b', 'c']:
+            categories.intern(uri)
+        categories_kvs = kvs.Dict()
+        categories.save(categories_kvs)
+        loaded = loader.Categories()
+        loaded.load(categories_kvs, batch_size=2)
+        self.assertEqual(loaded.uris, ['a', 'b', 'c'])
+        self.assertEqual(loaded.intern('d'), 3)
+
+
+class StatisticsTestCase(test.TestCase):
+    def test_save(self):
+        statistics = loader.Statistics()
+        statistics.add('a', ['x', 'y', 'x'])
+        statistics.add('b', ['y'])
+        statistics_kvs = kvs.Dict()
+        lengths_kvs = kvs.Dict()
+        statistics.save(statistics_kvs, lengths_kvs)
+        self.assertItemsEqual(statistics_kvs.get('df:x'), [1])
+        self.assertItemsEqual(statistics_kvs.get('df:y'), [2])
+        self.assertItemsEqual(lengths_kvs.get('a'), [3])
+        self.assertItemsEqual(statistics_kvs.get('documents'), [2])
+        self.assertItemsEqual(statistics_kvs.get('words'), [4])
+
+
+class EpochTestCase(test.TestCase):
+    def test_epoch(self):
+        images_kvs = kvs.Dict()
+        self.assertIsNone(loader.read_epoch(images_kvs))
+        first = loader.write_epoch(images_kvs)
+        self.assertEqual(first, loader.read_epoch(images_kvs))
+        second = loader.write_epoch(images_kvs)
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, loader.read_epoch(images_kvs))
+
+    def test_history(self):
+        images_kvs = kvs.Dict()
+        epochs = [
+            loader.write_epoch(images_kvs)
+            for _ in range(loader.EPOCH_HISTORY + 2)]
+        self.assertEqual(epochs, sorted(epochs))
+        self.assertItemsEqual(
+            epochs[-loader.EPOCH_HISTORY:], images_kvs.get(loader.EPOCH_KEY))
+
+    def test_never_missing(self):
+        images_kvs = test.mock.Mock(wraps=kvs.Dict())
+        images_kvs.delete.side_effect = AssertionError('epoch deleted')
+        loader.write_epoch(images_kvs)
+        loader.write_epoch(images_kvs)
+        self.assertEqual(2, len(images_kvs.get(loader.EPOCH_KEY)))
+
+
+
+class InstrumentTestCase(test.TestCase):
+    def test_instrument(self):
+        store = kvs.Dict()
+        self.assertIs(
+            loader.instrument(None, store, loader.LENGTHS_KVS_NAME, 'mem'),
+            store)
+        recorder = test.mock.Mock()
+        self.assertIs(
+            loader.instrument(
+                recorder, store, loader.LENGTHS_KVS_NAME, 'mem'),
+            recorder.kvs.return_value)
+        recorder.kvs.assert_called_once_with(
+            store, loader.LENGTHS_KVS_NAME, 'mem')
+
 if __name__ == '__main__':
     test.main()
@@ -32,21 +32,205 @@ the ones in labels_en.nt where B is http://www.w3.org/2000/01/rdf-schema#label
 """
 from __future__ import print_function
 
-from nltk import stem
+import io
+import mmap
+import os
+
+from collections import deque, OrderedDict
+from itertools import islice
+from multiprocessing import cpu_count, Pool
+from stemmer import FastPorterStemmer
 
 
 IMAGE_ASSOCIATION = '<http://xmlns.com/foaf/0.1/depiction>'
 LABEL_ASSOCIATION = '<http://www.w3.org/2000/01/rdf-schema#label>'
 
+# Bytes of input handed to a worker process at a time in parallel mode.
+SHARD_SIZE = 16 * 1024 * 1024
+# Shards submitted to the pool per worker and not yet consumed: bounds the
+# parsed pairs held in memory when the consumer is slower than the workers.
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+# Bytes of the memory-mapped file searched at a time in mmap mode.
+MMAP_WINDOW = 1024 * 1024
+
+# text: decode and split every line; bytes: check the association on the raw
+# line first and decode only the lines that are kept; mmap: search the mapped
+# file for the association and only slice out the lines that contain it.
+PARSER_MODES = ('text', 'bytes', 'mmap')
+
+# Line prefixes of added and removed triples in a diff of two files.
+ADDED = '+'
+REMOVED = '-'
+
+# Words remembered by the Stemmer; label words follow a Zipf distribution, so
+# a cache much smaller than the vocabulary absorbs most lookups.
+STEM_CACHE_SIZE = 100000
+
 
 class Stemmer(object):
-    """Implement stemming algorithm."""
-    def __init__(self):
-        self._stemmer = stem.PorterStemmer()
+    """Implement stemming algorithm.
+
+    Stemmed words are memoized in a cache of at most cache_size words that
+    evicts the least recently used word first; hits and misses count the
+    cache lookups. The cache can be warm-started from a vocabulary file
+    written by save_vocabulary. Words are stemmed by FastPorterStemmer,
+    which gives the stems of NLTK's PorterStemmer with less work per word.
+    It is built on the first cache miss, so a warm cache never builds it.
+    """
+    def __init__(self, cache_size=STEM_CACHE_SIZE, vocabulary=None):
+        self._stemmer = None
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        if vocabulary:
+            self.load_vocabulary(vocabulary)
 
     def stem(self, word):
         """Return transformed word."""
-        return self._stemmer.stem(word).lower().decode('latin1')
+        cache = self._cache
+        try:
+            stemmed = cache.pop(word)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            stemmed = self._porter_stemmer().stem(word).lower().decode(
+                'latin1')
+            self._remember(word, stemmed)
+            return stemmed
+        cache[word] = stemmed
+        return stemmed
+
+    def stem_many(self, words, processes=None, pool=None):
+        """Return transformed words, in the same order.
+
+        Each distinct word is transformed once. If processes is more than 1,
+        the distinct words missing from the cache are split across a pool of
+        that many processes, which only pays off for large batches. Callers
+        that stem many batches should pass a pool of their own, which is
+        reused; otherwise one is started for the call.
+
+        Args:
+            words: iterable of strings.
+            processes: int, number of processes to stem with.
+            pool: object, multiprocessing Pool of processes to stem with.
+        Returns:
+            list of transformed words.
+        """
+        words = list(words)
+        distinct = list(OrderedDict.fromkeys(words))
+        stems = {}
+        if processes and processes > 1:
+            misses = [word for word in distinct if word not in self._cache]
+            if misses:
+                chunks = [misses[i::processes] for i in range(processes)]
+                if pool is not None:
+                    results = pool.map(_stem_words, chunks)
+                else:
+                    pool = Pool(processes)
+                    try:
+                        results = pool.map(_stem_words, chunks)
+                    finally:
+                        pool.close()
+                        pool.join()
+                for chunk, result in zip(chunks, results):
+                    stems.update(zip(chunk, result))
+                self.misses += len(stems)
+                for word in misses:
+                    self._remember(word, stems[word])
+        for word in distinct:
+            if word not in stems:
+                stems[word] = self.stem(word)
+        return [stems[word] for word in words]
+
+    def _porter_stemmer(self):
+        if self._stemmer is None:
+            self._stemmer = FastPorterStemmer()
+        return self._stemmer
+
+    def _remember(self, word, stemmed):
+        if not self.cache_size:
+            return
+        if len(self._cache) >= self.cache_size:
+            self._cache.popitem(last=False)
+        self._cache[word] = stemmed
+
+    def save_vocabulary(self, path):
+        """Write the cached (word, stem) pairs, least recently used first."""
+        with io.open(path, 'w', encoding='utf-8') as f:
+            for word, stemmed in self._cache.iteritems():
+                f.write(u'{}\t{}\n'.format(word, stemmed))
+
+    def load_vocabulary(self, path):
+        """Fill the cache from a file written by save_vocabulary."""
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                pair = line.rstrip(u'\n').split(u'\t')
+                if len(pair) == 2:
+                    self._remember(*pair)
+
+
+def _stem_words(words):
+    """Transform a list of words in a pool process."""
+    stemmer = Stemmer(cache_size=0)
+    return [stemmer.stem(word) for word in words]
+
+
+_shared_stemmer = None
+
+
+def shared_stemmer():
+    """Return the Stemmer shared by the loader and the querier."""
+    global _shared_stemmer
+    if _shared_stemmer is None:
+        _shared_stemmer = Stemmer()
+    return _shared_stemmer
+
+
+def _strip(s):
+    return s.replace('<', '').replace('>', '')
+
+
+def _object(c):
+    """Return the object C of a triple from the rest of its line, "C .".
+
+    C is everything up to the final ".", so labels keep all their words.
+    """
+    c = c.rstrip()
+    if c.endswith('.'):
+        c = c[:-1].rstrip()
+    return c
+
+
+def _parse_triple(line, association, a_filter):
+    """Return the (A, C) pair of a line, or None if it doesn't match."""
+    line = unicode(line)
+    a, b, c = line.split(None, 2)
+    if b != association:
+        return None
+    if a_filter and not a.rsplit('/', 1)[-1].startswith(a_filter):
+        return None
+    return (_strip(a), _strip(_object(c)))
+
+
+def _parse_triple_bytes(line, association, a_filter):
+    """Bytes version of _parse_triple; only the kept A and C are decoded.
+
+    The caller is expected to have checked that association is in line.
+    """
+    a, b, c = line.split(None, 2)
+    if b != association:
+        return None
+    if a_filter and not a.rsplit(b'/', 1)[-1].startswith(a_filter):
+        return None
+    return (
+        a.translate(None, b'<>').decode('utf-8'),
+        _object(c).translate(None, b'<>').decode('utf-8'))
+
+
+def _clean_label(pair):
+    category, label = pair
+    return (category, label.replace('"', '').split('@')[0])
 
 
 def parse_triples(text_stream, association, a_filter=''):
@@ -63,20 +247,198 @@ def parse_triples(text_stream, association, a_filter=''):
     Yields:
         (A, C) pairs where A and C have the specified association.
     """
-    strip = lambda s: s.replace('<', '').replace('>', '')
     next(text_stream)  # skip first line
     for line in text_stream:
-        line = unicode(line)
-        a, b, c = line.split()[:3]
-        if b != association:
-            continue
-        if a_filter and not a.rsplit('/', 1)[-1].startswith(a_filter):
-            continue
-        yield (strip(a), strip(c))
+        pair = _parse_triple(line, association, a_filter)
+        if pair is not None:
+            yield pair
+    text_stream.close()
+
+
+def parse_triples_bytes(byte_stream, association, a_filter=''):
+    """Iterate on the DBpedia file without decoding every line.
+
+    Same as parse_triples, but lines are read as bytes and rejected with a
+    single substring check for the association, so only the A and C fields
+    of the lines that are kept get decoded.
+
+    Args:
+        byte_stream: file-like object, binary I/O stream that produces bytes.
+        association: string, the type of association.
+        a_filter: string, yield entries with A that starts with string.
+    Yields:
+        (A, C) pairs where A and C have the specified association.
+    """
+    association = association.encode('utf-8')
+    a_filter = a_filter.encode('utf-8')
+    next(byte_stream)  # skip first line
+    for line in byte_stream:
+        if association in line:
+            pair = _parse_triple_bytes(line, association, a_filter)
+            if pair is not None:
+                yield pair
+    byte_stream.close()
+
+
+def parse_triples_mmap(text_stream, association, a_filter=''):
+    """Iterate on the DBpedia file through a memory map.
+
+    Same as parse_triples_bytes, but the file is mapped into memory and
+    searched for the association directly, so lines that don't contain it
+    never become Python strings. Streams that can't be mapped (pipes,
+    in-memory files) are read with parse_triples_bytes instead.
+
+    Args:
+        text_stream: file object, opened DBpedia file.
+        association: string, the type of association.
+        a_filter: string, yield entries with A that starts with string.
+    Yields:
+        (A, C) pairs where A and C have the specified association.
+    """
+    try:
+        buf = mmap.mmap(text_stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        for pair in parse_triples_bytes(text_stream, association, a_filter):
+            yield pair
+        return
+    association = association.encode('utf-8')
+    a_filter = a_filter.encode('utf-8')
+    size = len(buf)
+    try:
+        start = buf.find(b'\n') + 1  # skip first line
+        while 0 < start < size:
+            # Search a window of whole lines at a time; mmap.find scans byte
+            # by byte while str.find uses a fast search.
+            end = buf.find(b'\n', min(start + MMAP_WINDOW, size) - 1) + 1
+            if end == 0:
+                end = size
+            window = buf[start:end]
+            pos = window.find(association)
+            while pos >= 0:
+                line_start = window.rfind(b'\n', 0, pos) + 1
+                line_end = window.find(b'\n', pos)
+                if line_end < 0:
+                    line_end = len(window)
+                pair = _parse_triple_bytes(
+                    window[line_start:line_end], association, a_filter)
+                if pair is not None:
+                    yield pair
+                pos = window.find(association, line_end)
+            start = end
+    finally:
+        buf.close()
+        text_stream.close()
+
+
+def _triples_parser(mode):
+    """Return the parse_triples function for a PARSER_MODES mode."""
+    if mode == 'bytes':
+        return parse_triples_bytes
+    if mode == 'mmap':
+        return parse_triples_mmap
+    return parse_triples
+
+
+def shard_ranges(path, shard_size=SHARD_SIZE):
+    """Split a file into (start, end) byte ranges aligned to line boundaries.
+
+    Args:
+        path: string, path of the file.
+        shard_size: int, approximate size of each range in bytes.
+    Returns:
+        list of (start, end) offsets that cover the file in order.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            end = start + shard_size
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            end = min(end, size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _parse_shard(task):
+    """Parse the lines in a byte range of a file in a worker process."""
+    path, start, end, association, a_filter, clean, mode = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).split('\n')
+    if start == 0:
+        lines = lines[1:]  # skip first line
+    if lines and not lines[-1]:
+        lines.pop()  # split artifact after the last newline
+    pairs = []
+    if mode != 'text':
+        association = association.encode('utf-8')
+        a_filter = a_filter.encode('utf-8')
+        for line in lines:
+            if association in line:
+                pair = _parse_triple_bytes(line, association, a_filter)
+                if pair is not None:
+                    pairs.append(clean(pair) if clean else pair)
+        return pairs
+    for line in lines:
+        pair = _parse_triple(line, association, a_filter)
+        if pair is not None:
+            pairs.append(clean(pair) if clean else pair)
+    return pairs
+
+
+def parse_triples_parallel(text_stream, association, a_filter='',
+                           workers=None, shard_size=SHARD_SIZE, clean=None,
+                           mode='text', in_flight=None):
+    """Iterate on the DBpedia file with a pool of worker processes.
+
+    The file is split into byte ranges aligned to line boundaries, which are
+    parsed by the workers with the same rules as parse_triples. Pairs are
+    yielded in file order as soon as their range is parsed. At most
+    in_flight ranges are submitted ahead of the one being consumed, so a
+    slow consumer holds back the workers rather than piling up their pairs.
+
+    Args:
+        text_stream: file object, opened DBpedia file; only its name is used.
+        association: string, the type of association.
+        a_filter: string, yield entries with A that starts with string.
+        workers: int, number of worker processes (default: CPU count).
+        shard_size: int, approximate size of each byte range.
+        clean: function, applied to each pair in the worker.
+        mode: string, one of PARSER_MODES.
+        in_flight: int, ranges submitted and not yet consumed (default:
+            SHARDS_IN_FLIGHT_PER_WORKER per worker).
+    Yields:
+        (A, C) pairs where A and C have the specified association.
+    """
+    path = text_stream.name
     text_stream.close()
+    workers = workers or cpu_count()
+    in_flight = in_flight or SHARDS_IN_FLIGHT_PER_WORKER * workers
+    tasks = iter([
+        (path, start, end, association, a_filter, clean, mode)
+        for start, end in shard_ranges(path, shard_size)])
+    pool = Pool(workers)
+    try:
+        pending = deque(
+            pool.apply_async(_parse_shard, (task,))
+            for task in islice(tasks, in_flight))
+        while pending:
+            pairs = pending.popleft().get()
+            for task in islice(tasks, 1):
+                pending.append(pool.apply_async(_parse_shard, (task,)))
+            for pair in pairs:
+                yield pair
+    finally:
+        pool.terminate()
+        pool.join()
 
 
-def image_iterator(text_stream, filter=''):
+def image_iterator(text_stream, filter='', workers=1, mode='text'):
     """Iterate on the DBpedia image data.
 
     This generates (category, url) pairs with specified relationship in the
@@ -87,13 +449,20 @@ def image_iterator(text_stream, filter=''):
     Args:
         text_stream: file-like object, text I/O stream that produces strings.
         filter: string, yield entries with categories that starts with string.
+        workers: int, parse in parallel with this many processes if > 1.
+        mode: string, one of PARSER_MODES.
     Yields:
         (key, value) pairs, where key is category and value is url.
     """
-    return parse_triples(text_stream, IMAGE_ASSOCIATION, a_filter=filter)
+    if workers > 1:
+        return parse_triples_parallel(
+            text_stream, IMAGE_ASSOCIATION, a_filter=filter, workers=workers,
+            mode=mode)
+    parse = _triples_parser(mode)
+    return parse(text_stream, IMAGE_ASSOCIATION, a_filter=filter)
 
 
-def label_iterator(text_stream):
+def label_iterator(text_stream, workers=1, mode='text'):
     """Iterate on the DBpedia label data.
 
     This generates (category, label) pairs with specified relationship in the
@@ -103,9 +472,64 @@ def label_iterator(text_stream):
 
     Args:
         text_stream: file-like object, text I/O stream that produces strings.
+        workers: int, parse in parallel with this many processes if > 1.
+        mode: string, one of PARSER_MODES.
     Yields:
         (key, value) pairs, where key is category and value is label.
     """
-    for category, label in parse_triples(text_stream, LABEL_ASSOCIATION):
-        label = label.replace('"', '').split('@')[0]
-        yield (category, label)
+    if workers > 1:
+        return parse_triples_parallel(
+            text_stream, LABEL_ASSOCIATION, workers=workers,
+            clean=_clean_label, mode=mode)
+    parse = _triples_parser(mode)
+    return (
+        _clean_label(pair)
+        for pair in parse(text_stream, LABEL_ASSOCIATION))
+
+
+def parse_diff(byte_stream, association, a_filter=''):
+    """Iterate on a diff of two DBpedia files.
+
+    The diff holds the changed triples, one per line, prefixed with ADDED
+    or REMOVED, as in the output of diff -u. Other lines, including the
+    +++ and --- file headers, are skipped.
+
+    Args:
+        byte_stream: file-like object, binary I/O stream that produces bytes.
+        association: string, the type of association.
+        a_filter: string, yield entries with A that starts with string.
+    Yields:
+        (sign, (A, C)) pairs, where sign is ADDED or REMOVED and A and C
+        have the specified association.
+    """
+    association = association.encode('utf-8')
+    a_filter = a_filter.encode('utf-8')
+    for line in byte_stream:
+        sign = line[:1]
+        if sign not in (ADDED, REMOVED) or line[:3] in (b'+++', b'---'):
+            continue
+        if association in line:
+            pair = _parse_triple_bytes(line[1:], association, a_filter)
+            if pair is not None:
+                yield (str(sign), pair)
+    byte_stream.close()
+
+
+def image_diff_iterator(byte_stream, filter=''):
+    """Iterate on a diff of two DBpedia image files; see parse_diff.
+
+    Yields:
+        (sign, (category, url)) pairs.
+    """
+    return parse_diff(byte_stream, IMAGE_ASSOCIATION, a_filter=filter)
+
+
+def label_diff_iterator(byte_stream):
+    """Iterate on a diff of two DBpedia label files; see parse_diff.
+
+    Yields:
+        (sign, (category, label)) pairs.
+    """
+    return (
+        (sign, _clean_label(pair))
+        for sign, pair in parse_diff(byte_stream, LABEL_ASSOCIATION))
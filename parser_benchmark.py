@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Micro-benchmark for the triples parser
+
+Writes a synthetic file shaped like images_en.nt, where only one line in
+five is a depiction triple, and reports the lines/sec of each parser mode.
+
+To run:
+$ python parser_benchmark.py --lines 1000000
+"""
+from __future__ import print_function
+
+import os
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from parser import IMAGE_ASSOCIATION, PARSER_MODES, image_iterator
+
+RESOURCE = '<http://dbpedia.org/resource/{}>'
+FILE_PATH = '<http://commons.wikimedia.org/wiki/Special:FilePath/{}>'
+TRIPLES = [
+    '{resource} ' + IMAGE_ASSOCIATION + ' {image} .\n',
+    '{resource} <http://dbpedia.org/ontology/thumbnail> {thumbnail} .\n',
+    '{image} <http://xmlns.com/foaf/0.1/thumbnail> {thumbnail} .\n',
+    '{image} <http://purl.org/dc/elements/1.1/rights> {rights} .\n',
+    '{thumbnail} <http://purl.org/dc/elements/1.1/rights> {rights} .\n',
+]
+
+
+def parse_args(prog='parser_benchmark', description='Parser benchmark.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--lines', type=int, default=1000000, help="lines in the data file")
+    parser.add_argument(
+        '--repeat', type=int, default=3, help="best of REPEAT runs")
+    return parser.parse_args()
+
+
+def write_images(f, lines):
+    """Write about lines triples shaped like images_en.nt to f."""
+    f.write('# started 2014-07-25T21:33:17Z\n')
+    for i in range(lines // len(TRIPLES)):
+        name = 'Category_{}'.format(i)
+        fields = {
+            'resource': RESOURCE.format(name),
+            'image': FILE_PATH.format(name + '.jpg'),
+            'thumbnail': FILE_PATH.format(name + '.jpg?width=300'),
+            'rights': '<http://en.wikipedia.org/wiki/File:{}.jpg>'.format(name),
+        }
+        for triple in TRIPLES:
+            f.write(triple.format(**fields))
+
+
+def run(path, mode):
+    """Return the seconds taken to parse path in mode."""
+    start = time.time()
+    for _ in image_iterator(open(path, 'rb'), mode=mode):
+        pass
+    return time.time() - start
+
+
+def main():
+    args = parse_args()
+    fd, path = tempfile.mkstemp(suffix='.nt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            write_images(f, args.lines)
+        with open(path, 'rb') as f:
+            lines = sum(1 for _ in f)
+        for mode in PARSER_MODES:
+            seconds = min(run(path, mode) for _ in range(args.repeat))
+            print('{:<8} {:>12,.0f} lines/sec'.format(mode, lines / seconds))
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import test
 import parser
 
@@ -26,6 +28,14 @@ class ImageIteratorTestCase(test.TestCase):
         mock.assert_called_once_with(
             text_stream, parser.IMAGE_ASSOCIATION, a_filter=filter)
 
+    def test_parse_images_triples_bytes(self):
+        expected = list(parser.image_iterator(test.StringIO(
+            self.text_stream.getvalue()), filter="Az"))
+        actual = list(parser.image_iterator(
+            self.text_stream, filter="Az", mode='bytes'))
+        self.assertEqual(actual, expected)
+        self.assertTrue(self.text_stream.closed)
+
     def test_parse_images_triples(self):
         expected = [
             ('http://dbpedia.org/resource/Azhikode,_Thrissur', 'http://commons.wikimedia.org/wiki/Special:FilePath/Azhikode_Munakkal_-_Estuary_(Hari_Bhagirath).jpg'),
@@ -52,6 +62,25 @@ class LabelIteratorTestCase(test.TestCase):
         list(parser.label_iterator(self.text_stream))
         mock.assert_called_once_with(self.text_stream, parser.LABEL_ASSOCIATION)
 
+    def test_parse_labels_triples_bytes(self):
+        expected = list(parser.label_iterator(test.StringIO(
+            self.text_stream.getvalue())))
+        actual = list(parser.label_iterator(self.text_stream, mode='bytes'))
+        self.assertEqual(actual, expected)
+        self.assertTrue(self.text_stream.closed)
+
+    def test_parse_labels_many_words(self):
+        data = (
+            "# started 2014-07-25T21:33:17Z\n"
+            "<http://dbpedia.org/resource/ANSI> " + self.label_association +
+            " \"American National Standards Institute\"@en .\n")
+        expected = [(
+            'http://dbpedia.org/resource/ANSI',
+            'American National Standards Institute')]
+        for mode in parser.PARSER_MODES:
+            actual = list(parser.label_iterator(test.StringIO(data), mode=mode))
+            self.assertEqual(actual, expected, mode)
+
     def test_parse_labels_triples(self):
         expected = [
             ('http://dbpedia.org/resource/AccessibleComputing', 'AccessibleComputing'),
@@ -62,21 +91,172 @@ class LabelIteratorTestCase(test.TestCase):
         self.assertTrue(self.text_stream.closed)
 
 
+class DiffIteratorTestCase(test.TestCase):
+    def test_diff_iterators(self):
+        data = (
+            "--- old/images_en.nt\n"
+            "+++ new/images_en.nt\n"
+            "@@ -1,2 +1,2 @@\n"
+            " <http://dbpedia.org/resource/Albedo> " + parser.IMAGE_ASSOCIATION + " <http://a/Albedo.svg> .\n"
+            "-<http://dbpedia.org/resource/Azhikode> " + parser.IMAGE_ASSOCIATION + " <http://a/Old.jpg> .\n"
+            "+<http://dbpedia.org/resource/Azhikode> " + parser.IMAGE_ASSOCIATION + " <http://a/New.jpg> .\n"
+            "+<http://dbpedia.org/resource/ANSI> " + parser.LABEL_ASSOCIATION + " \"American National\"@en .\n"
+        )
+        self.assertEqual(
+            list(parser.image_diff_iterator(test.StringIO(data), filter='Az')),
+            [
+                (parser.REMOVED, ('http://dbpedia.org/resource/Azhikode', 'http://a/Old.jpg')),
+                (parser.ADDED, ('http://dbpedia.org/resource/Azhikode', 'http://a/New.jpg')),
+            ])
+        self.assertEqual(
+            list(parser.label_diff_iterator(test.StringIO(data))),
+            [(parser.ADDED, ('http://dbpedia.org/resource/ANSI', 'American National'))])
+
+
+class ParallelIteratorTestCase(test.TestCase):
+    def setUp(self):
+        lines = ["# started 2014-07-25T21:33:17Z\n"]
+        for i in range(200):
+            lines.append(
+                "<http://dbpedia.org/resource/A{0}> {1} \"A{0}\"@en .\n"
+                "<http://dbpedia.org/resource/B{0}> {2} <http://commons.wikimedia.org/wiki/Special:FilePath/B{0}.jpg> .\n"
+                "<http://dbpedia.org/resource/B{0}> <http://dbpedia.org/ontology/thumbnail> <http://commons.wikimedia.org/wiki/Special:FilePath/B{0}.jpg?width=300> .\n".format(
+                    i, parser.LABEL_ASSOCIATION, parser.IMAGE_ASSOCIATION))
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_shard_ranges(self):
+        ranges = parser.shard_ranges(self.path, shard_size=1000)
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[start - 1], '\n')
+
+    def test_parallel_image_iterator(self):
+        serial = list(parser.image_iterator(open(self.path), filter='B1'))
+        parallel = list(parser.parse_triples_parallel(
+            open(self.path), parser.IMAGE_ASSOCIATION, a_filter='B1',
+            workers=2, shard_size=1000))
+        self.assertEqual(len(serial), 111)
+        self.assertEqual(parallel, serial)
+
+    def test_parallel_in_flight(self):
+        serial = list(parser.image_iterator(open(self.path)))
+        parallel = list(parser.parse_triples_parallel(
+            open(self.path), parser.IMAGE_ASSOCIATION, workers=2,
+            shard_size=1000, in_flight=1))
+        self.assertEqual(parallel, serial)
+
+    def test_parallel_label_iterator(self):
+        serial = list(parser.label_iterator(open(self.path)))
+        parallel = list(parser.parse_triples_parallel(
+            open(self.path), parser.LABEL_ASSOCIATION, workers=2,
+            shard_size=1000, clean=parser._clean_label))
+        self.assertEqual(len(serial), 200)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(
+            list(parser.label_iterator(open(self.path), workers=2)), serial)
+        self.assertEqual(list(parser.label_iterator(
+            open(self.path), workers=2, mode='bytes')), serial)
+
+    def test_mmap_iterators(self):
+        serial = list(parser.image_iterator(open(self.path), filter='B1'))
+        text_stream = open(self.path)
+        actual = list(parser.image_iterator(
+            text_stream, filter='B1', mode='mmap'))
+        self.assertEqual(actual, serial)
+        self.assertTrue(text_stream.closed)
+        serial = list(parser.label_iterator(open(self.path)))
+        actual = list(parser.label_iterator(open(self.path), mode='mmap'))
+        self.assertEqual(actual, serial)
+
+    def test_mmap_unmappable_stream(self):
+        with open(self.path) as f:
+            text_stream = test.StringIO(f.read())
+        serial = list(parser.label_iterator(open(self.path)))
+        actual = list(parser.label_iterator(text_stream, mode='mmap'))
+        self.assertEqual(actual, serial)
+
+
 class StemmerTestCase(test.TestCase):
     def setUp(self):
         self.stemmer = parser.Stemmer()
 
-    @test.mock.patch('nltk.stem.PorterStemmer.stem')
+    @test.mock.patch('stemmer.FastPorterStemmer.stem')
     def test_stemmer_stem(self, mock):
         self.stemmer.stem('Abc')
         mock.assert_called_once_with('Abc')
 
-    @test.mock.patch('nltk.stem.PorterStemmer.stem')
+    @test.mock.patch('stemmer.FastPorterStemmer.stem')
     def test_stemmer_lower(self, mock):
         mock.side_effect = lambda x: x
         transformed = self.stemmer.stem('Abc')
         self.assertEqual(transformed, 'abc')
 
+    @test.mock.patch('stemmer.FastPorterStemmer.stem')
+    def test_stemmer_cache(self, mock):
+        mock.side_effect = lambda x: x
+        self.assertEqual(self.stemmer.stem('Abc'), 'abc')
+        self.assertEqual(self.stemmer.stem('Abc'), 'abc')
+        mock.assert_called_once_with('Abc')
+        self.assertEqual((self.stemmer.hits, self.stemmer.misses), (1, 1))
+
+    @test.mock.patch('stemmer.FastPorterStemmer.stem')
+    def test_stemmer_cache_evicts_least_recently_used(self, mock):
+        mock.side_effect = lambda x: x
+        stemmer = parser.Stemmer(cache_size=2)
+        for word in ['a', 'b', 'a', 'c', 'a', 'b']:
+            stemmer.stem(word)
+        self.assertEqual(
+            mock.call_args_list,
+            [test.mock.call(w) for w in ['a', 'b', 'c', 'b']])
+        self.assertEqual(list(stemmer._cache), ['a', 'b'])
+
+    @test.mock.patch('stemmer.FastPorterStemmer.stem')
+    def test_stemmer_vocabulary(self, mock):
+        mock.side_effect = lambda x: x
+        self.stemmer.stem('Abc')
+        self.stemmer.stem('Def')
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.stemmer.save_vocabulary(path)
+            stemmer = parser.Stemmer(vocabulary=path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(stemmer.stem('Def'), 'def')
+        self.assertEqual(stemmer.stem('Abc'), 'abc')
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual((stemmer.hits, stemmer.misses), (2, 0))
+
+    @test.mock.patch('stemmer.FastPorterStemmer.stem')
+    def test_stemmer_stem_many(self, mock):
+        mock.side_effect = lambda x: x
+        stems = self.stemmer.stem_many(['Abc', 'Def', 'Abc', 'Abc'])
+        self.assertEqual(stems, ['abc', 'def', 'abc', 'abc'])
+        self.assertEqual(
+            mock.call_args_list, [test.mock.call('Abc'), test.mock.call('Def')])
+
+    def test_stemmer_stem_many_processes(self):
+        words = ['running', 'Dogs', 'running', 'ponies', 'Dogs', 'caress']
+        self.stemmer.stem('ponies')
+        stems = self.stemmer.stem_many(words, processes=2)
+        self.assertEqual(stems, [parser.Stemmer().stem(w) for w in words])
+        self.assertEqual((self.stemmer.hits, self.stemmer.misses), (1, 4))
+        self.assertEqual(self.stemmer.stem('Dogs'), stems[1])
+        self.assertEqual(self.stemmer.hits, 2)
+
+    def test_shared_stemmer(self):
+        self.assertIs(parser.shared_stemmer(), parser.shared_stemmer())
+
 
 if __name__ == '__main__':
     test.main()
@@ -0,0 +1,126 @@
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Posting list operations
+
+A posting list holds the categories of a term. The stores return them as
+sets, or as sorted arrays of category IDs (Postings). These functions
+combine posting lists into sorted lists without copying or sorting the
+large ones: an intersection walks the smallest list and gallops through
+the others, and set-valued lists are probed by membership.
+"""
+from array import array
+from bisect import bisect_left
+from heapq import merge
+
+
+def as_sorted(values):
+    """Return values as a sorted sequence; sorted arrays are returned as is."""
+    if isinstance(values, array):
+        return values
+    return sorted(values)
+
+
+def gallop(values, target, lo=0):
+    """Return the first index from lo of sorted values with item >= target.
+
+    Probes lo, lo + 1, lo + 3, lo + 7, ... and then bisects the last gap,
+    so a search that moves n items ahead costs O(log n) comparisons.
+    """
+    n = len(values)
+    hi, step = lo, 1
+    while hi < n and values[hi] < target:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+    return bisect_left(values, target, lo, min(hi, n))
+
+
+def contains(values, value):
+    """Return whether posting list values holds value."""
+    if isinstance(values, (set, frozenset)):
+        return value in values
+    pos = bisect_left(values, value)
+    return pos < len(values) and values[pos] == value
+
+
+def _contains(values, value, pos):
+    """Return (found, pos) for value in posting list values from pos."""
+    if isinstance(values, (set, frozenset)):
+        return value in values, pos
+    pos = gallop(values, value, pos)
+    return pos < len(values) and values[pos] == value, pos
+
+
+def intersect(postings):
+    """Return the sorted values in every posting list.
+
+    Args:
+        postings: list, posting lists
+
+    Returns:
+        sorted list of values
+    """
+    if not postings:
+        return []
+    postings = sorted(postings, key=len)
+    result = as_sorted(postings[0])
+    for values in postings[1:]:
+        if not result:
+            break
+        matches, pos = [], 0
+        for value in result:
+            found, pos = _contains(values, value, pos)
+            if found:
+                matches.append(value)
+        result = matches
+    return list(result)
+
+
+def union(postings):
+    """Return the sorted values in any posting list.
+
+    Args:
+        postings: list, posting lists
+
+    Returns:
+        sorted list of values
+    """
+    result = []
+    for value in merge(*[as_sorted(values) for values in postings]):
+        if not result or result[-1] != value:
+            result.append(value)
+    return result
+
+
+def difference(values, postings):
+    """Return the sorted values that are in no posting list of postings.
+
+    Args:
+        values: sorted sequence of values
+        postings: list, posting lists to exclude
+
+    Returns:
+        sorted list of values
+    """
+    result = list(values)
+    for excluded in postings:
+        matches, pos = [], 0
+        for value in result:
+            found, pos = _contains(excluded, value, pos)
+            if not found:
+                matches.append(value)
+        result = matches
+    return result
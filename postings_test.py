@@ -0,0 +1,45 @@
+import test
+
+from array import array
+from postings import as_sorted, difference, gallop, intersect, union
+
+
+class PostingsTestCase(test.TestCase):
+    def test_as_sorted(self):
+        values = array('I', [1, 5, 9])
+        self.assertIs(values, as_sorted(values))
+        self.assertEqual([1, 5, 9], as_sorted(set([9, 1, 5])))
+
+    def test_gallop(self):
+        values = list(range(0, 200, 2))
+        for lo in (0, 3, 50):
+            for target in range(-1, 202):
+                expected = max(lo, (target + 1) // 2)
+                self.assertEqual(
+                    min(expected, len(values)), gallop(values, target, lo))
+        self.assertEqual(0, gallop([], 1))
+
+    def test_intersect(self):
+        small = array('I', [3, 500, 9000])
+        large = array('I', range(0, 10000, 3))
+        self.assertEqual([3, 9000], intersect([large, small]))
+        self.assertEqual(
+            [9000], intersect([large, small, set([9000, 1])]))
+        self.assertEqual([], intersect([large, small, []]))
+        self.assertEqual(['a', 'b'], intersect([set(['b', 'a'])]))
+        self.assertEqual([], intersect([]))
+
+    def test_union(self):
+        self.assertEqual(
+            [1, 2, 3, 5],
+            union([array('I', [1, 3]), set([2, 3]), [5]]))
+        self.assertEqual([], union([]))
+
+    def test_difference(self):
+        self.assertEqual(
+            [1, 4], difference([1, 2, 3, 4], [array('I', [2]), set([3, 9])]))
+        self.assertEqual([1, 2], difference(array('I', [1, 2]), []))
+
+
+if __name__ == '__main__':
+    test.main()
@@ -19,40 +19,712 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import argparse
+import bisect
+import heapq
+import json
 import logging
+import math
+import sys
+import threading
+import time
 
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from .kvs import _hash, _KVS
 from .loader import (
-    IMAGES_KVS_NAME, TERMS_KVS_NAME, STORAGE_CHOICES, Stemmer)
+    ERROR_RATE, IMAGES_KVS_NAME, LENGTHS_KVS_NAME, STATISTICS_KVS_NAME,
+    TERMS_KVS_NAME, STORAGE_CHOICES, bloom_guard, instrument, open_kvs,
+    prefix_coded, read_epoch, report_stats, shared_stemmer, stats_recorder,
+    Statistics, Stemmer)
+from .postings import contains, difference, intersect, union
+
+# Query operators: "a OR b" matches either keyword, and "NOT a" or "-a"
+# excludes a keyword. Keywords are otherwise combined with AND.
+OR = 'OR'
+NOT = 'NOT'
+# BM25 term frequency saturation and label length normalization.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Bounds of the query result cache.
+QUERY_CACHE_SIZE = 10000
+QUERY_CACHE_BYTES = 64 * 1024 * 1024
+# Seconds between two checks of the epoch marker by a QueryCache.
+EPOCH_CHECK_INTERVAL = 1.0
+# Queries of a batch answered together.
+BATCH_SIZE = 10000
+# Categories whose label lengths LabelLengths reads with one get_many.
+LENGTHS_BATCH_SIZE = 10000
+# Longest label length LabelLengths holds; longer labels are capped.
+MAX_LABEL_LENGTH = 255
+# Query server address (HOST:PORT) and threads.
+SERVER_ADDRESS = '127.0.0.1:8765'
+SERVER_THREADS = 8
 
 
 def parse_args(prog='querier', description='Image querier.'):
     parser = argparse.ArgumentParser(prog=prog, description=description)
     parser.add_argument('-d', dest='debug', action='store_true', help="debug")
     parser.add_argument(
-        'keywords', nargs='*', help="find image URLs that match KEYWORDS")
+        'keywords', nargs='*',
+        help="find image URLs that match all KEYWORDS; use OR and NOT to "
+             "match either keyword or to exclude one")
     parser.add_argument(
         '--kvs', choices=STORAGE_CHOICES.keys(), default='disk',
         help="store data in KVS")
+    parser.add_argument(
+        '--vocabulary', help="warm-start the stemmer from VOCABULARY")
+    parser.add_argument(
+        '--top-k', type=int,
+        help="rank matches by BM25 and print the images of the best TOP_K "
+             "categories (needs a loader run with --statistics); with "
+             "--serve, allow ranked queries")
+    parser.add_argument(
+        '--serve', action='store_true',
+        help="keep the stores open and answer queries over HTTP at ADDRESS")
+    parser.add_argument(
+        '--remote', action='store_true',
+        help="send the query to the server at ADDRESS")
+    parser.add_argument(
+        '--address', default=SERVER_ADDRESS,
+        help="HOST:PORT of the query server")
+    parser.add_argument(
+        '--threads', type=int, default=SERVER_THREADS,
+        help="serve queries with THREADS threads")
+    parser.add_argument(
+        '--batch', type=argparse.FileType('r'),
+        help="answer the queries in BATCH, one per line ('-' for stdin), "
+             "and print the results as JSON lines")
+    parser.add_argument(
+        '--shards', type=int, default=1,
+        help="read images and terms stores split over SHARDS stores by the "
+             "loader --shards")
+    parser.add_argument(
+        '--bloom', action='store_true',
+        help="skip lookups of missing keys with the Bloom filters saved by "
+             "the loader --bloom (built in memory from the stores if missing "
+             "or stale)")
+    parser.add_argument(
+        '--bloom-error-rate', type=float, default=ERROR_RATE,
+        help="false-positive rate of Bloom filters built from the stores")
+    parser.add_argument(
+        '--stats', action='store_true',
+        help="time queries, stemming and store operations, and print a "
+             "summary to stderr")
+    parser.add_argument(
+        '--stats-json',
+        help="time queries, stemming and store operations, and write them "
+             "as JSON to STATS_JSON")
     return parser.parse_args()
 
 
-def query(keywords, images_kvs, terms_kvs):
+def parse_query(keywords, stemmer):
+    """Parse keywords into a boolean query of stemmed terms.
+
+    Keywords are ANDed. OR binds adjacent keywords into one clause, and
+    NOT (or a leading "-") excludes the next keyword. For example,
+    "american OR british -national museum" parses to the clauses
+    [american, british] and [museum], excluding national.
+
+    Args:
+        keywords: list or string, keywords (and operators)
+        stemmer: object, Stemmer to stem the keywords with
+
+    Returns:
+        (clauses, excluded) tuple: a list of lists of terms, where the terms
+        of a clause are ORed and the clauses ANDed, and a list of terms
+        to exclude
+    """
+    if isinstance(keywords, basestring):
+        keywords = keywords.split()
+    clauses, excluded = [], []
+    join = negate = False
+    for keyword in keywords:
+        if keyword == OR:
+            join = bool(clauses)
+            continue
+        if keyword == NOT:
+            negate = True
+            continue
+        if keyword.startswith('-') and len(keyword) > 1:
+            keyword, negate = keyword[1:], True
+        term = stemmer.stem(keyword)
+        if negate:
+            excluded.append(term)
+        elif join:
+            clauses[-1].append(term)
+        else:
+            clauses.append([term])
+        join = negate = False
+    return clauses, excluded
+
+
+def query_terms(clauses, excluded):
+    """Return the set of terms in a parsed query."""
+    terms = set(excluded)
+    for clause in clauses:
+        terms.update(clause)
+    return terms
+
+
+def evaluate(clauses, excluded, postings):
+    """Evaluate a parsed query over posting lists.
+
+    Each clause is the union of its terms' postings, and the clauses are
+    intersected smallest first. A query with no clauses matches nothing.
+
+    Args:
+        clauses: list, lists of terms from parse_query
+        excluded: list, terms from parse_query
+        postings: dict, (term, posting list) pairs; missing terms are empty
+
+    Returns:
+        sorted list of categories matching the query
+    """
+    lists = []
+    for clause in clauses:
+        found = [postings[term] for term in clause if term in postings]
+        if not found:
+            return []
+        lists.append(found[0] if len(found) == 1 else union(found))
+    categories = intersect(lists)
+    return difference(
+        categories, [postings[term] for term in excluded if term in postings])
+
+
+def _statistic(statistics, key, default=None):
+    """Return the number stored under key in a get_many result."""
+    if key not in statistics:
+        if default is None:
+            raise KeyError(key)
+        return default
+    return next(iter(statistics[key]))
+
+
+def rank(clauses, postings, categories, statistics_kvs, lengths_kvs, k,
+         lengths=None):
+    """Rank categories by BM25 and return the best k.
+
+    Labels are short, so each term is taken to occur once in a label: a
+    category scores, for every query term in its label,
+    idf * (k1 + 1) / (1 + k1 * (1 - b + b * length / average length)).
+    Terms of single-term clauses are in every category and are summed once;
+    the others are checked in their posting lists. The scores are kept in
+    a heap bounded to k.
+
+    Args:
+        clauses: list, lists of terms from parse_query
+        postings: dict, (term, posting list) pairs
+        categories: list, categories matching the query
+        statistics_kvs: object, key-value store with the Statistics
+        lengths_kvs: object, key-value store with (category, length) pairs,
+            or the LabelLengths read from it
+        k: int, number of categories to return
+        lengths: dict, lengths_kvs.get_many(categories), if already read
+
+    Returns:
+        list of (score, category) pairs, best first
+    """
+    if not categories:
+        return []
+    terms = set(
+        term for clause in clauses for term in clause if term in postings)
+    keys = dict(
+        (term, Statistics.document_frequency_key(term)) for term in terms)
+    statistics = statistics_kvs.get_many(
+        [Statistics.DOCUMENTS_KEY, Statistics.WORDS_KEY] + keys.values())
+    documents = _statistic(statistics, Statistics.DOCUMENTS_KEY)
+    average_length = (
+        _statistic(statistics, Statistics.WORDS_KEY) / float(documents or 1))
+    weights = {}
+    for term in terms:
+        frequency = _statistic(statistics, keys[term], len(postings[term]))
+        weights[term] = (BM25_K1 + 1) * math.log(
+            1 + (documents - frequency + 0.5) / (frequency + 0.5))
+    common = sum(weights[clause[0]] for clause in clauses if len(clause) == 1)
+    optional = [
+        (weights[term], postings[term])
+        for term in terms if [term] not in clauses]
+
+    if lengths is None:
+        lengths = lengths_kvs.get_many(categories)
+    factors = {}  # label length => 1 / BM25 length normalization
+
+    def scores():
+        for category in categories:
+            values = lengths.get(category)
+            length = next(iter(values)) if values else average_length
+            factor = factors.get(length)
+            if factor is None:
+                factor = factors[length] = 1 / (1 + BM25_K1 * (
+                    1 - BM25_B + BM25_B * length / average_length))
+            weight = common
+            for term_weight, values in optional:
+                if contains(values, category):
+                    weight += term_weight
+            yield weight * factor, category
+
+    return heapq.nlargest(k, scores())
+
+
+class LabelLengths(_KVS):
+    """Label lengths of every category, read once from the lengths store.
+
+    rank looks up the length of every category it scores; held in memory,
+    those lookups cost no store I/O, so a ranked query no longer reads as
+    many lengths as it has matches. Integer category IDs of an interned
+    load index an array; other categories are found by the 64-bit hash of
+    their text, in a sorted array. This is a read-only store.
+
+    Args:
+        lengths_kvs: object, key-value store with (category, label length)
+            pairs
+        batch_size: int, categories read with one get_many
+    """
+    def __init__(self, lengths_kvs, batch_size=LENGTHS_BATCH_SIZE):
+        self._by_id = array(b'B')
+        self._count = 0
+        hashed = []
+        keys = lengths_kvs.keys()
+        for i in xrange(0, len(keys), batch_size):
+            lengths = lengths_kvs.get_many(keys[i:i + batch_size])
+            for category, values in lengths.iteritems():
+                length = min(next(iter(values)), MAX_LABEL_LENGTH)
+                self._count += 1
+                category_id = _category_id(category)
+                if category_id is None:
+                    hashed.append((_hash(category), length))
+                    continue
+                if category_id >= len(self._by_id):
+                    self._by_id.extend(
+                        [0] * (category_id + 1 - len(self._by_id)))
+                self._by_id[category_id] = length
+        hashed.sort()
+        self._hashes = [key_hash for key_hash, _ in hashed]
+        if array(b'L').itemsize == 8:
+            self._hashes = array(b'L', self._hashes)
+        self._lengths = array(b'B', [value for _, value in hashed])
+
+    def __len__(self):
+        return self._count
+
+    def _length(self, category):
+        """Return the label length of category, or 0 if it has none."""
+        if isinstance(category, (int, long)):
+            return self._by_id[category] if category < len(self._by_id) else 0
+        key_hash = _hash(category)
+        i = bisect.bisect_left(self._hashes, key_hash)
+        if i < len(self._hashes) and self._hashes[i] == key_hash:
+            return self._lengths[i]
+        return 0
+
+    def __contains__(self, key):
+        return self._length(key) > 0
+
+    def get(self, key):
+        length = self._length(key)
+        if not length:
+            raise KeyError(key)
+        return set([length])
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            length = self._length(key)
+            if length:
+                found[key] = (length,)
+        return found
+
+
+def _category_id(key):
+    """Return key as an interned category ID, or None if it is a URI.
+
+    Stores that keep keys as text, like the shelf, return the IDs as digit
+    strings.
+    """
+    if isinstance(key, (int, long)):
+        return key
+    if key.isdigit():
+        return int(key)
+    return None
+
+
+class QueryCache(object):
+    """LRU cache of query results, bounded in entries and in memory.
+
+    Results are keyed by query_key. The cache belongs to one generation of
+    the stores: validate drops every entry when the epoch marker written by
+    the loader changes, which expired asks to check every epoch_interval
+    seconds at most. Each entry keeps the time its query took, which is
+    added to saved on every hit. The cache can be shared between threads.
+    """
+    def __init__(self, max_entries=QUERY_CACHE_SIZE,
+                 max_bytes=QUERY_CACHE_BYTES,
+                 epoch_interval=EPOCH_CHECK_INTERVAL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.epoch_interval = epoch_interval
+        self._checked = None  # time of the last epoch check
+        self.size = 0  # approximate bytes of the cached results
+        self.epoch = None
+        self.hits = self.misses = 0
+        self.saved = 0.0  # seconds
+        self._entries = OrderedDict()  # key => (urls, seconds, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
+    def expired(self):
+        """Return True if the epoch is due to be checked again.
+
+        Only one of the threads that ask within epoch_interval seconds is
+        told to.
+        """
+        now = time.time()
+        with self._lock:
+            if (self._checked is not None and
+                    now - self._checked < self.epoch_interval):
+                return False
+            self._checked = now
+            return True
+
+    def validate(self, epoch):
+        """Drop all entries if epoch is not the epoch they were cached in."""
+        with self._lock:
+            if epoch != self.epoch:
+                self._entries.clear()
+                self.size = 0
+                self.epoch = epoch
+
+    def get(self, key):
+        """Return the cached urls for key, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            self.saved += entry[1]
+            return entry[0]
+
+    def put(self, key, urls, seconds):
+        """Cache the urls of key, which took seconds to find."""
+        urls = tuple(urls)
+        size = sys.getsizeof(urls) + sum(sys.getsizeof(url) for url in urls)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[2]
+            self._entries[key] = (urls, seconds, size)
+            self.size += size
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_bytes):
+                _, entry = self._entries.popitem(last=False)
+                self.size -= entry[2]
+
+
+def query_key(clauses, excluded, top_k=None):
+    """Return the normalized cache key of a parsed query.
+
+    Terms are sorted and deduplicated within each clause, and the clauses
+    and excluded terms are too, so that reordered queries share a key.
+    """
+    return (
+        tuple(sorted(set(tuple(sorted(set(clause))) for clause in clauses))),
+        tuple(sorted(set(excluded))),
+        top_k)
+
+
+def query(keywords, images_kvs, terms_kvs, stemmer=None, top_k=None,
+          statistics_kvs=None, lengths_kvs=None, cache=None):
     """Find images that match keywords.
 
     This function open connections to both the terms and images key/value
-    stores. For each keyword, it retrieves the matching Wikipedia category
-    from the terms store, then retrieve all URL matches for those
-    categories from the images key/value store.
+    stores. It parses the keywords into a boolean query (see parse_query),
+    retrieves the posting lists of all its terms from the terms store with
+    one get_many call, evaluates the query to the matching Wikipedia
+    categories, then retrieves all URL matches for those categories from
+    the images store with a second one. The categories are whatever keys
+    the images store, URIs or the integer IDs of an interned load.
+
+    With a cache, a repeated query is answered from the cache after it is
+    stemmed, as long as the loader has not written a new epoch since. The
+    epoch is read, and the stores refreshed, when the cache expires only.
 
     Args:
-        keywords: string, keywords separated by whitespace.
+        keywords: list or string, keywords separated by whitespace.
         terms_kvs: object, key-value store with (term, category) pairs
         image_kvs: object, key-value store with (category, url) pairs
+        stemmer: object, Stemmer to use (default: the shared Stemmer)
+        top_k: int, return the images of the top_k best categories only,
+            ranked by BM25 (see rank)
+        statistics_kvs: object, key-value store with the Statistics; needed
+            with top_k
+        lengths_kvs: object, key-value store with (category, label length)
+            pairs; needed with top_k
+        cache: object, QueryCache for the results
 
     Returns:
-        list of image urls matching keywords
+        list of image urls matching keywords, best first with top_k
+    """
+    stemmer = stemmer or shared_stemmer()
+    clauses, excluded = parse_query(keywords, stemmer)
+    if cache is None:
+        return _search(
+            clauses, excluded, images_kvs, terms_kvs, top_k, statistics_kvs,
+            lengths_kvs)
+    if cache.expired():
+        for kvs in (images_kvs, terms_kvs, statistics_kvs):
+            if kvs is not None:
+                kvs.refresh()
+        cache.validate(read_epoch(images_kvs))
+    key = query_key(clauses, excluded, top_k)
+    urls = cache.get(key)
+    if urls is None:
+        start = time.time()
+        urls = _search(
+            clauses, excluded, images_kvs, terms_kvs, top_k, statistics_kvs,
+            lengths_kvs)
+        cache.put(key, urls, time.time() - start)
+    return list(urls)
+
+
+class Searcher(object):
+    """Answer queries against open stores, keeping them and the caches warm.
+
+    Queries can come from several threads at once: the stores are only
+    read, the QueryCache is shared, and each thread stems with a Stemmer
+    of its own, warm-started from vocabulary.
+
+    Args:
+        images_kvs: object, key-value store with (category, url) pairs
+        terms_kvs: object, key-value store with (term, category) pairs
+        statistics_kvs: object, key-value store with the Statistics; needed
+            for ranked queries
+        lengths_kvs: object, key-value store with (category, label length)
+            pairs; needed for ranked queries
+        cache: object, QueryCache for the results
+        vocabulary: string, path of a vocabulary file for the stemmers
+        recorder: object, Recorder to time the queries and stemmers with
     """
-    return [] 
+    def __init__(self, images_kvs, terms_kvs, statistics_kvs=None,
+                 lengths_kvs=None, cache=None, vocabulary=None,
+                 recorder=None):
+        self.images_kvs = images_kvs
+        self.terms_kvs = terms_kvs
+        self.statistics_kvs = statistics_kvs
+        self.lengths_kvs = lengths_kvs
+        self.cache = cache
+        self.vocabulary = vocabulary
+        self.queries = 0
+        self.recorder = recorder
+        self._lock = threading.Lock()  # guards queries
+        self._query_op = None
+        if recorder is not None:
+            self._query_op = recorder.op('searcher', 'query')
+        self._local = threading.local()
+
+    def stemmer(self):
+        """Return the Stemmer of the calling thread."""
+        stemmer = getattr(self._local, 'stemmer', None)
+        if stemmer is None:
+            stemmer = Stemmer(vocabulary=self.vocabulary)
+            if self.recorder is not None:
+                stemmer = self.recorder.stemmer(stemmer)
+            self._local.stemmer = stemmer
+        return stemmer
+
+    def validate(self, top_k=None):
+        """Check that a query for the top_k best categories can be answered.
+
+        Raises:
+            ValueError: top_k is not positive, or was given without the
+                statistics stores.
+        """
+        if top_k is None:
+            return
+        if top_k < 1:
+            raise ValueError('top_k must be positive: {}'.format(top_k))
+        if self.statistics_kvs is None:
+            raise ValueError('no statistics for ranked queries')
+
+    def query(self, keywords, top_k=None):
+        """Return the image urls matching keywords; see query.
+
+        Raises:
+            ValueError: top_k is invalid; see validate.
+        """
+        self.validate(top_k)
+        with self._lock:
+            self.queries += 1
+        start = time.time()
+        urls = query(
+            keywords, self.images_kvs, self.terms_kvs, stemmer=self.stemmer(),
+            top_k=top_k, statistics_kvs=self.statistics_kvs,
+            lengths_kvs=self.lengths_kvs, cache=self.cache)
+        if self._query_op is not None:
+            self._query_op.record(time.time() - start)
+        return urls
+
+    def stats(self):
+        """Return a dict of query and cache statistics."""
+        stats = {'queries': self.queries}
+        if self.cache is not None:
+            stats.update({
+                'cache_entries': len(self.cache),
+                'cache_bytes': self.cache.size,
+                'cache_hits': self.cache.hits,
+                'cache_misses': self.cache.misses,
+                'cache_hit_rate': self.cache.hit_rate,
+                'cache_saved_seconds': self.cache.saved,
+            })
+        return stats
+
+
+def _search(clauses, excluded, images_kvs, terms_kvs, top_k, statistics_kvs,
+            lengths_kvs):
+    """Return the image urls of a parsed query; see query."""
+    postings = terms_kvs.get_many(query_terms(clauses, excluded))
+    categories = evaluate(clauses, excluded, postings)
+    if top_k is not None:
+        return _top_urls(
+            clauses, postings, categories, statistics_kvs, lengths_kvs, top_k,
+            images_kvs.get_many)
+    urls = set()
+    for values in images_kvs.get_many(categories).itervalues():
+        urls.update(values)
+    return list(urls)
+
+
+def _top_urls(clauses, postings, categories, statistics_kvs, lengths_kvs,
+              top_k, get_images):
+    """Return the image urls of the top_k ranked categories with images.
+
+    Categories without images are skipped, so more of them are ranked
+    until top_k have images or all are ranked. The label lengths are read
+    once for all of them. get_images is a get_many of the images store.
+    """
+    lengths = lengths_kvs.get_many(categories) if categories else {}
+    limit = top_k
+    while True:
+        ranked = rank(
+            clauses, postings, categories, statistics_kvs, lengths_kvs, limit,
+            lengths)
+        ranked = [category for _, category in ranked]
+        images = get_images(ranked)
+        ranked = [category for category in ranked if category in images]
+        if len(ranked) >= top_k or limit >= len(categories):
+            break
+        limit *= 2
+    return [
+        url for category in ranked[:top_k]
+        for url in sorted(images[category])]
+
+
+class _BatchStemmer(object):
+    """Stemmer for a batch of queries whose words were stemmed together."""
+    def __init__(self, stemmer, words):
+        words = list(words)
+        self._stemmer = stemmer
+        self._stems = dict(zip(words, stemmer.stem_many(words)))
+
+    def stem(self, word):
+        stemmed = self._stems.get(word)
+        if stemmed is None:
+            stemmed = self._stems[word] = self._stemmer.stem(word)
+        return stemmed
+
+
+def batch_query(lines, images_kvs, terms_kvs, stemmer=None, top_k=None,
+                statistics_kvs=None, lengths_kvs=None, batch_size=BATCH_SIZE):
+    """Answer a batch of queries, one per line.
+
+    The queries are answered batch_size at a time. The words of a batch are
+    stemmed together, each distinct term's postings are fetched with one
+    get_many call, and each distinct category's images with another (or,
+    with top_k, at most once as the queries are ranked). Repeated queries
+    are answered once.
+
+    Args:
+        lines: iterable of strings, keywords separated by whitespace
+        terms_kvs: object, key-value store with (term, category) pairs
+        image_kvs: object, key-value store with (category, url) pairs
+        stemmer: object, Stemmer to use (default: the shared Stemmer)
+        top_k: int, return the images of the top_k best categories only
+        statistics_kvs: object, key-value store with the Statistics; needed
+            with top_k
+        lengths_kvs: object, key-value store with (category, label length)
+            pairs; needed with top_k
+        batch_size: int, number of queries answered together
+
+    Yields:
+        (keywords, urls) pairs in the order of lines
+    """
+    stemmer = stemmer or shared_stemmer()
+    lines = iter(lines)
+    while True:
+        batch = [line.strip() for line in islice(lines, batch_size)]
+        if not batch:
+            break
+        words = set()
+        for line in batch:
+            for word in line.split():
+                if word.startswith('-') and len(word) > 1:
+                    word = word[1:]
+                words.add(word)
+        batch_stemmer = _BatchStemmer(stemmer, words)
+        keys, queries = [], {}  # query key => (clauses, excluded)
+        for line in batch:
+            clauses, excluded = parse_query(line, batch_stemmer)
+            key = query_key(clauses, excluded)
+            keys.append(key)
+            queries[key] = (clauses, excluded)
+
+        terms = set()
+        for clauses, excluded in queries.itervalues():
+            terms.update(query_terms(clauses, excluded))
+        postings = terms_kvs.get_many(terms)
+        matches = dict(
+            (key, evaluate(clauses, excluded, postings))
+            for key, (clauses, excluded) in queries.iteritems())
+
+        results = {}
+        if top_k is None:
+            categories = set()
+            for values in matches.itervalues():
+                categories.update(values)
+            images = images_kvs.get_many(categories)
+            for key, values in matches.iteritems():
+                results[key] = list(set(
+                    url for category in values if category in images
+                    for url in images[category]))
+        else:
+            images, fetched = {}, set()
+
+            def get_images(categories):
+                missing = [
+                    category for category in categories
+                    if category not in fetched]
+                images.update(images_kvs.get_many(missing))
+                fetched.update(missing)
+                return images
+
+            for key, (clauses, _) in queries.iteritems():
+                results[key] = _top_urls(
+                    clauses, postings, matches[key], statistics_kvs,
+                    lengths_kvs, top_k, get_images)
+
+        for line, key in zip(batch, keys):
+            yield line, results[key]
 
 
 def main():
@@ -61,13 +733,99 @@ def main():
         logging.basicConfig(level=logging.DEBUG)
     logging.debug('debug {}'.format(args.debug))
     logging.debug('kvs {}'.format(args.kvs))
+    logging.debug('top-k {}'.format(args.top_k))
+    logging.debug('serve {} remote {} address {}'.format(
+        args.serve, args.remote, args.address))
+    logging.debug('stats {} json {}'.format(args.stats, args.stats_json))
 
-    images_kvs = STORAGE_CHOICES[args.kvs](IMAGES_KVS_NAME)
-    terms_kvs = STORAGE_CHOICES[args.kvs](TERMS_KVS_NAME)
-    matches = query(args.keywords, images_kvs, terms_kvs)
+    if args.remote:
+        from .server import remote_query
+        try:
+            matches = remote_query(args.address, args.keywords, args.top_k)
+        except ValueError as e:
+            sys.exit('querier: {}'.format(e))
+    else:
+        try:
+            images_kvs = open_kvs(
+                STORAGE_CHOICES[args.kvs], IMAGES_KVS_NAME, args.shards)
+            terms_kvs = open_kvs(
+                STORAGE_CHOICES[args.kvs], TERMS_KVS_NAME, args.shards)
+        except ValueError as e:
+            sys.exit('querier: {}'.format(e))
+        stats = stats_recorder(args)
+        images_kvs = instrument(stats, images_kvs, IMAGES_KVS_NAME, args.kvs)
+        terms_kvs = instrument(stats, terms_kvs, TERMS_KVS_NAME, args.kvs)
+        images_kvs = prefix_coded(images_kvs)
+        terms_kvs = prefix_coded(terms_kvs)
+        if args.bloom:
+            terms_kvs = bloom_guard(
+                terms_kvs, TERMS_KVS_NAME, capacity=0,
+                error_rate=args.bloom_error_rate, images_kvs=images_kvs,
+                persist=False)
+            images_kvs = bloom_guard(
+                images_kvs, IMAGES_KVS_NAME, capacity=0,
+                error_rate=args.bloom_error_rate, persist=False)
+        statistics_kvs = lengths_kvs = None
+        if args.top_k is not None:
+            statistics_kvs = instrument(
+                stats, STORAGE_CHOICES[args.kvs](STATISTICS_KVS_NAME),
+                STATISTICS_KVS_NAME, args.kvs)
+            if Statistics.DOCUMENTS_KEY not in statistics_kvs:
+                sys.exit('querier: no statistics, load with --statistics')
+            lengths_kvs = instrument(
+                stats, STORAGE_CHOICES[args.kvs](LENGTHS_KVS_NAME),
+                LENGTHS_KVS_NAME, args.kvs)
+            if args.serve or args.batch:
+                # Many ranked queries: read the lengths into memory once.
+                lengths_store = lengths_kvs
+                lengths_kvs = LabelLengths(lengths_store)
+                lengths_store.close()
+                logging.debug('label lengths {}'.format(len(lengths_kvs)))
+        searcher = Searcher(
+            images_kvs, terms_kvs, statistics_kvs=statistics_kvs,
+            lengths_kvs=lengths_kvs,
+            cache=QueryCache() if args.serve else None,
+            vocabulary=args.vocabulary, recorder=stats)
+        if args.batch:
+            start = time.time()
+            count = 0
+            results = batch_query(
+                (line.decode('utf-8') for line in args.batch), images_kvs,
+                terms_kvs, stemmer=searcher.stemmer(), top_k=args.top_k,
+                statistics_kvs=statistics_kvs, lengths_kvs=lengths_kvs)
+            if stats is not None:
+                results = stats.iterator(results, 'searcher', 'batch_query')
+            for keywords, matches in results:
+                print(json.dumps({'keywords': keywords, 'matches': matches}))
+                count += 1
+            seconds = time.time() - start
+            print('{} queries in {:.3f}s, {:.1f} queries/sec'.format(
+                count, seconds, count / seconds if seconds else 0.0),
+                file=sys.stderr)
+            if stats is not None:
+                report_stats(stats, args)
+            return
+        if args.serve:
+            from .server import parse_address, QueryServer
+            server = QueryServer(
+                parse_address(args.address), searcher, threads=args.threads)
+            logging.debug('serving on {}:{}'.format(*server.server_address))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                logging.debug('stats {}'.format(searcher.stats()))
+            if stats is not None:
+                report_stats(stats, args)
+            return
+        matches = searcher.query(args.keywords, top_k=args.top_k)
+        if stats is not None:
+            report_stats(stats, args)
 
     print("keywords {}".format(' '.join(args.keywords)))
     print("matches \n{}".format('\n'.join(matches)))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,6 @@
 import test
 import kvs
+import loader
 import querier
 
 
@@ -64,14 +65,282 @@ class QueryTestCase(test.TestCase):
     def test_query_keywords_two(self, mock):
         words = ['azhar', 'azharuddin']
         urls = self._get_urls(words)
-        matches = querier.query(words, self.images_kvs, self.labels_kvs)
+        matches = querier.query(
+            ['azhar', 'OR', 'azharuddin'], self.images_kvs, self.labels_kvs)
         self.assertItemsEqual(urls, matches)
 
+    def test_query_keywords_and(self, mock):
+        self.labels_kvs.put(
+            'college', 'http://dbpedia.org/resource/Azhar_College')
+        self.labels_kvs.put(
+            'college', 'http://dbpedia.org/resource/Azhikodan_Raghavan')
+        matches = querier.query(
+            ['azhar', 'college'], self.images_kvs, self.labels_kvs)
+        self.assertItemsEqual(
+            self.images['http://dbpedia.org/resource/Azhar_College'], matches)
+        matches = querier.query(
+            'azhar azharuddin', self.images_kvs, self.labels_kvs)
+        self.assertEqual([], matches)
+
+    def test_query_keywords_not(self, mock):
+        self.labels_kvs.put(
+            'college', 'http://dbpedia.org/resource/Azhar_College')
+        urls = self._get_urls(['azhar']) - self.images[
+            'http://dbpedia.org/resource/Azhar_College']
+        for words in (['azhar', 'NOT', 'college'], ['azhar', '-college']):
+            matches = querier.query(words, self.images_kvs, self.labels_kvs)
+            self.assertItemsEqual(urls, matches)
+        matches = querier.query(
+            ['NOT', 'azhar'], self.images_kvs, self.labels_kvs)
+        self.assertEqual([], matches)
+
+    def test_query_keywords_interned(self, mock):
+        labels_kvs = kvs.Postings()
+        images_kvs = kvs.Dict()
+        for category, word in [(3, 'a'), (1, 'a'), (2, 'a'), (2, 'b'),
+                               (3, 'b'), (3, 'c')]:
+            labels_kvs.put(word, category)
+        for category in (1, 2, 3):
+            images_kvs.put(category, 'url{}'.format(category))
+        self.assertItemsEqual(
+            ['url2', 'url3'], querier.query('a b', images_kvs, labels_kvs))
+        self.assertItemsEqual(
+            ['url2'], querier.query('a b NOT c', images_kvs, labels_kvs))
+        self.assertItemsEqual(
+            ['url1'], querier.query('c OR a -b', images_kvs, labels_kvs))
+
     def test_query_no_keyword_match(self, mock):
         try:
             querier.query(['noop'], self.images_kvs, self.labels_kvs)
         except KeyError:
             self.fail('Unexpected KeyError.')
 
+
+class RankedStoresTestCase(test.TestCase):
+    def setUp(self):
+        labels = {
+            1: ['museum'],
+            2: ['national', 'museum'],
+            3: ['national', 'museum', 'of', 'art', 'history'],
+            4: ['national', 'park'],
+            5: ['british', 'museum'],
+        }
+        self.terms_kvs = kvs.Postings()
+        self.images_kvs = kvs.Dict()
+        self.statistics_kvs = kvs.Dict()
+        self.lengths_kvs = kvs.Dict()
+        statistics = loader.Statistics()
+        for category, terms in sorted(labels.items()):
+            statistics.add(category, terms)
+            for term in terms:
+                self.terms_kvs.put(term, category)
+            self.images_kvs.put(category, 'url{}'.format(category))
+        statistics.save(self.statistics_kvs, self.lengths_kvs)
+
+    def _query(self, keywords, top_k):
+        return querier.query(
+            keywords, self.images_kvs, self.terms_kvs, top_k=top_k,
+            statistics_kvs=self.statistics_kvs, lengths_kvs=self.lengths_kvs)
+
+
+@test.mock.patch('querier.Stemmer.stem', side_effect=lambda x: x)
+class RankTestCase(RankedStoresTestCase):
+    def test_rank_short_labels_first(self, mock):
+        self.assertEqual(['url2', 'url3'], self._query('national museum', 2))
+        matches = self._query('museum', 3)
+        self.assertEqual('url1', matches[0])
+        self.assertItemsEqual(['url2', 'url5'], matches[1:])
+
+    def test_rank_rare_terms_first(self, mock):
+        self.assertEqual(
+            ['url4', 'url2'], self._query('park OR museum national', 2))
+
+    def test_rank_all(self, mock):
+        self.assertEqual(4, len(self._query('museum', 10)))
+        self.assertEqual([], self._query('museum', 0))
+        self.assertEqual([], self._query('zoo', 3))
+
+    def test_rank_skips_no_image(self, mock):
+        self.images_kvs.delete(1)
+        self.images_kvs.delete(2)
+        self.lengths_kvs = test.mock.Mock(wraps=self.lengths_kvs)
+        self.assertEqual(['url5'], self._query('museum', 1))
+        self.assertEqual(1, self.lengths_kvs.get_many.call_count)
+
+
+@test.mock.patch('querier.Stemmer.stem', side_effect=lambda x: x)
+class QueryCacheTestCase(test.TestCase):
+    def setUp(self):
+        self.terms_kvs = kvs.Dict()
+        self.images_kvs = kvs.Dict()
+        for category, word in [('a', 'x'), ('b', 'x'), ('b', 'y')]:
+            self.terms_kvs.put(word, category)
+            self.images_kvs.put(category, 'url_' + category)
+        self.cache = querier.QueryCache(epoch_interval=0)
+
+    def _query(self, keywords):
+        return querier.query(
+            keywords, self.images_kvs, self.terms_kvs, cache=self.cache)
+
+    def test_hit(self, mock):
+        self.assertItemsEqual(['url_b'], self._query('x y'))
+        self.terms_kvs.put('x', 'c')
+        self.assertItemsEqual(['url_b'], self._query(['y', 'x', 'y']))
+        self.assertEqual((1, 1, 0.5), (
+            self.cache.hits, self.cache.misses, self.cache.hit_rate))
+        self.assertGreater(self.cache.saved, 0)
+        self.assertEqual(1, len(self.cache))
+
+    def test_epoch(self, mock):
+        loader.write_epoch(self.images_kvs)
+        self.assertItemsEqual(['url_a', 'url_b'], self._query('x'))
+        self.terms_kvs.delete('x')
+        self.assertItemsEqual(['url_a', 'url_b'], self._query('x'))
+        epoch = loader.write_epoch(self.images_kvs)
+        self.assertEqual(epoch, loader.read_epoch(self.images_kvs))
+        self.assertEqual([], self._query('x'))
+        self.assertEqual(epoch, self.cache.epoch)
+        self.assertEqual(2, self.cache.misses)
+
+    def test_epoch_interval(self, mock):
+        cache = querier.QueryCache(epoch_interval=60)
+        self.assertTrue(cache.expired())
+        self.assertFalse(cache.expired())
+        cache.epoch_interval = 0
+        self.assertTrue(cache.expired())
+
+    def test_refresh(self, mock):
+        self.images_kvs = test.mock.Mock(wraps=self.images_kvs)
+        self._query('x')
+        self._query('x')
+        self.assertEqual(2, self.images_kvs.refresh.call_count)
+        self.cache.epoch_interval = 60
+        self._query('x')
+        self.assertEqual(2, self.images_kvs.refresh.call_count)
+
+    def test_key(self, mock):
+        self.assertEqual(
+            querier.query_key([['b', 'a', 'b'], ['c']], ['e', 'd']),
+            querier.query_key([['c'], ['a', 'b']], ['d', 'e', 'd']))
+        self.assertNotEqual(
+            querier.query_key([['a']], []), querier.query_key([['a']], [], 3))
+
+    def test_eviction(self, mock):
+        cache = querier.QueryCache(max_entries=2)
+        for key in 'abc':
+            cache.put(key, [key], 0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(('b',), cache.get('b'))
+        cache.put('d', ['d'], 0.1)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(('b',), cache.get('b'))
+
+    def test_memory_bound(self, mock):
+        url = 'x' * 1000
+        cache = querier.QueryCache(max_bytes=2500)
+        cache.put('a', [url], 0.1)
+        cache.put('b', [url], 0.1)
+        self.assertEqual(2, len(cache))
+        cache.put('c', [url, url], 0.1)
+        self.assertEqual(['c'], list(cache._entries))
+        self.assertLessEqual(cache.size, 2500)
+        cache.put('d', [url] * 3, 0.1)
+        self.assertIsNone(cache.get('d'))
+
+
+@test.mock.patch('querier.Stemmer.stem', side_effect=lambda x: x)
+class BatchQueryTestCase(RankedStoresTestCase):
+    LINES = [
+        'national museum', 'museum', 'park OR museum national', 'museum',
+        'museum -national', 'zoo', '', 'museum national',
+    ]
+
+    def test_batch(self, mock):
+        expected = [
+            sorted(querier.query(line, self.images_kvs, self.terms_kvs))
+            for line in self.LINES]
+        terms_kvs = test.mock.Mock(wraps=self.terms_kvs)
+        images_kvs = test.mock.Mock(wraps=self.images_kvs)
+        results = list(querier.batch_query(
+            self.LINES, images_kvs, terms_kvs, batch_size=5))
+        self.assertEqual(self.LINES, [line for line, _ in results])
+        self.assertEqual(expected, [sorted(urls) for _, urls in results])
+        self.assertEqual(2, terms_kvs.get_many.call_count)
+        self.assertEqual(2, images_kvs.get_many.call_count)
+        self.assertItemsEqual(
+            ['museum', 'national', 'park'],
+            terms_kvs.get_many.call_args_list[0][0][0])
+
+    def test_batch_ranked(self, mock):
+        expected = [self._query(line, 2) for line in self.LINES]
+        images_kvs = test.mock.Mock(wraps=self.images_kvs)
+        results = list(querier.batch_query(
+            self.LINES, images_kvs, self.terms_kvs, top_k=2,
+            statistics_kvs=self.statistics_kvs, lengths_kvs=self.lengths_kvs))
+        self.assertEqual(expected, [urls for _, urls in results])
+        fetched = [
+            category for call in images_kvs.get_many.call_args_list
+            for category in call[0][0]]
+        self.assertEqual(len(set(fetched)), len(fetched))
+
+
+class LabelLengthsTestCase(test.TestCase):
+    def test_lengths(self):
+        lengths_kvs = kvs.Dict()
+        lengths_kvs.put_many([
+            (0, 2), ('3', 4), ('http://dbpedia.org/resource/Paris', 1),
+            (u'http://dbpedia.org/resource/\xc9t\xe9', 300)])
+        lengths = querier.LabelLengths(lengths_kvs, batch_size=3)
+        self.assertEqual(len(lengths), 4)
+        self.assertEqual(
+            lengths.get_many([
+                0, 1, 3, 99, 'http://dbpedia.org/resource/Paris',
+                u'http://dbpedia.org/resource/\xc9t\xe9',
+                'http://dbpedia.org/resource/Rome']),
+            {0: (2,), 3: (4,), 'http://dbpedia.org/resource/Paris': (1,),
+             u'http://dbpedia.org/resource/\xc9t\xe9': (255,)})
+        self.assertEqual(lengths.get(3), set([4]))
+        self.assertNotIn(1, lengths)
+        with self.assertRaises(KeyError):
+            lengths.get('http://dbpedia.org/resource/Rome')
+
+
+@test.mock.patch('querier.Stemmer.stem', side_effect=lambda x: x)
+class RankLabelLengthsTestCase(RankedStoresTestCase):
+    def test_same_ranking(self, mock):
+        expected = [self._query(line, 2) for line in ('museum', 'park')]
+        lengths_kvs = test.mock.Mock(wraps=self.lengths_kvs)
+        self.lengths_kvs = querier.LabelLengths(lengths_kvs)
+        lengths_kvs.reset_mock()
+        self.assertEqual(
+            expected, [self._query(line, 2) for line in ('museum', 'park')])
+        self.assertFalse(lengths_kvs.method_calls)
+
+
+class ParseQueryTestCase(test.TestCase):
+    def setUp(self):
+        self.stemmer = test.mock.Mock()
+        self.stemmer.stem.side_effect = lambda x: x.lower()
+
+    def test_parse_query(self):
+        self.assertEqual(
+            ([['american', 'british'], ['museum']], ['national']),
+            querier.parse_query(
+                'American OR British -national museum', self.stemmer))
+        self.assertEqual(
+            ([['a'], ['b']], ['c']),
+            querier.parse_query(['OR', 'a', 'NOT', 'c', 'b'], self.stemmer))
+        self.assertEqual(([['-']], []), querier.parse_query('-', self.stemmer))
+        self.assertEqual(([], []), querier.parse_query([], self.stemmer))
+
+    def test_evaluate(self):
+        postings = {'a': set([1, 2, 3]), 'b': [2, 3, 4], 'c': set([3])}
+        self.assertEqual(
+            [2, 3], querier.evaluate([['a'], ['b']], [], postings))
+        self.assertEqual(
+            [1, 2, 4], querier.evaluate([['a', 'b']], ['c'], postings))
+        self.assertEqual([], querier.evaluate([['a'], ['d']], [], postings))
+        self.assertEqual([], querier.evaluate([], ['a'], postings))
+
 if __name__ == '__main__':
     test.main()
@@ -0,0 +1,139 @@
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Query server for Image search
+
+Answers queries over HTTP with a searcher that keeps the stores, stemmers
+and query cache warm between requests. The server only reads the stores,
+and serves requests with a pool of threads.
+
+GET /query?q=KEYWORDS[&top_k=K] returns {"keywords": ..., "matches": [...]}
+GET /stats returns the searcher statistics
+
+To run:
+$ python querier.py --serve
+$ python querier.py --remote american museum
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+import urllib
+import urllib2
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing.pool import ThreadPool
+
+
+def parse_address(address):
+    """Return the (host, port) pair of a HOST:PORT string."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Handle query and stats requests with the server's searcher."""
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        params = urlparse.parse_qs(url.query)
+        if url.path == '/stats':
+            self._send(200, self.server.searcher.stats())
+        elif url.path == '/query':
+            try:
+                keywords = params.get('q', [b''])[0].decode('utf-8')
+                top_k = params.get('top_k')
+                top_k = int(top_k[0]) if top_k else None
+                self.server.searcher.validate(top_k)
+            except ValueError as e:
+                self._send(400, {'error': unicode(e)})
+                return
+            try:
+                matches = self.server.searcher.query(keywords, top_k=top_k)
+            except Exception:
+                logging.exception('query failed: %s', keywords)
+                self._send(500, {'error': 'internal error'})
+                return
+            self._send(200, {'keywords': keywords, 'matches': matches})
+        else:
+            self._send(404, {'error': 'not found: {}'.format(url.path)})
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug('%s %s', self.address_string(), format % args)
+
+
+class QueryServer(HTTPServer):
+    """HTTP server that answers queries with a pool of threads.
+
+    Args:
+        address: (host, port) pair to listen on; port 0 picks a free port
+        searcher: object, answers validate(top_k), query(keywords, top_k)
+            and stats()
+        threads: int, number of threads to serve requests with
+    """
+    def __init__(self, address, searcher, threads):
+        HTTPServer.__init__(self, address, QueryHandler)
+        self.searcher = searcher
+        self._pool = ThreadPool(threads)
+
+    def process_request(self, request, client_address):
+        self._pool.apply_async(
+            self._process_request, (request, client_address))
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self._pool.close()
+        self._pool.join()
+
+
+def remote_query(address, keywords, top_k=None):
+    """Send a query to the QueryServer at address; return its matches.
+
+    Args:
+        address: string, HOST:PORT of the server
+        keywords: list or string, keywords separated by whitespace
+        top_k: int, return the images of the top_k best categories only
+
+    Returns:
+        list of image urls matching keywords
+    """
+    if not isinstance(keywords, basestring):
+        keywords = ' '.join(keywords)
+    params = {'q': keywords.encode('utf-8')}
+    if top_k is not None:
+        params['top_k'] = top_k
+    host, port = parse_address(address)
+    url = 'http://{}:{}/query?{}'.format(host, port, urllib.urlencode(params))
+    try:
+        response = urllib2.urlopen(url)
+    except urllib2.HTTPError as e:
+        raise ValueError(json.load(e)['error'])
+    return json.load(response)['matches']
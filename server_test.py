@@ -0,0 +1,85 @@
+import json
+import threading
+import urllib2
+
+import test
+import kvs
+import querier
+import server
+
+
+@test.mock.patch('querier.Stemmer.stem', side_effect=lambda x: x)
+class QueryServerTestCase(test.TestCase):
+    def setUp(self):
+        terms_kvs = kvs.Dict()
+        images_kvs = kvs.Dict()
+        for category, word in [('a', 'x'), ('b', 'x'), ('b', 'y')]:
+            terms_kvs.put(word, category)
+            images_kvs.put(category, 'url_' + category)
+        self.searcher = querier.Searcher(
+            images_kvs, terms_kvs, cache=querier.QueryCache())
+        self.server = server.QueryServer(
+            ('127.0.0.1', 0), self.searcher, threads=2)
+        self.address = '{}:{}'.format(*self.server.server_address)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _get(self, path):
+        url = 'http://{}{}'.format(self.address, path)
+        try:
+            response = urllib2.urlopen(url)
+        except urllib2.HTTPError as e:
+            return e.code, json.load(e)
+        return response.getcode(), json.load(response)
+
+    def test_query(self, mock):
+        self.assertItemsEqual(
+            ['url_a', 'url_b'], server.remote_query(self.address, ['x']))
+        self.assertItemsEqual(
+            ['url_b'], server.remote_query(self.address, 'x y'))
+        self.assertItemsEqual(
+            ['url_b'], server.remote_query(self.address, 'y x'))
+        stats = self._get('/stats')[1]
+        self.assertEqual(3, stats['queries'])
+        self.assertEqual(1, stats['cache_hits'])
+
+    def test_concurrent_queries(self, mock):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                sorted(server.remote_query(self.address, 'x'))))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([['url_a', 'url_b']] * 8, results)
+        self.assertEqual(8, self.searcher.stats()['queries'])
+
+    def test_errors(self, mock):
+        self.assertEqual(404, self._get('/nope')[0])
+        self.assertEqual(400, self._get('/query?q=x&top_k=ten')[0])
+        self.assertEqual(400, self._get('/query?q=x&top_k=0')[0])
+        self.assertEqual(400, self._get('/query?q=%ff')[0])
+        with self.assertRaises(ValueError):
+            server.remote_query(self.address, 'x', top_k=3)
+
+    def test_internal_error(self, mock):
+        with test.mock.patch.object(
+                self.searcher, 'query', side_effect=ValueError('bug')):
+            code, body = self._get('/query?q=x')
+        self.assertEqual(500, code)
+        self.assertNotIn('bug', body['error'])
+
+    def test_parse_address(self, mock):
+        self.assertEqual(('localhost', 80), server.parse_address('localhost:80'))
+        self.assertEqual(('127.0.0.1', 80), server.parse_address(':80'))
+
+
+if __name__ == '__main__':
+    test.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Load and query benchmark of the SQLite and Shelf stores
+
+Loads a synthetic terms store, (word, category) pairs with Zipf-distributed
+words, into each store, adds the pairs of 1% more categories to it (as an
+incremental load does), then answers queries of one to three words, drawn
+from the same distribution, with get_many, and reports the seconds of each
+step, the queries per second, the share of looked up words found and the
+size of the store files.
+
+To run:
+$ python sqlite_benchmark.py --categories 200000
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+import kvs
+
+RESOURCE = 'http://dbpedia.org/resource/Category_{}'
+BACKENDS = [('disk', kvs.Shelf), ('sqlite', kvs.SQLite)]
+ROW = '{:<8}{:>9.2f}s{:>9.2f}s{:>9.2f}s{:>14,.0f}{:>8.1%}{:>8.1f} MiB'
+
+
+def parse_args(prog='sqlite_benchmark', description='SQLite benchmark.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--categories', type=int, default=200000,
+        help="categories in the synthetic terms store")
+    parser.add_argument(
+        '--vocabulary', type=int, default=20000,
+        help="distinct words in the synthetic terms store")
+    parser.add_argument(
+        '--queries', type=int, default=2000, help="number of queries")
+    return parser.parse_args()
+
+
+def word(rand, vocabulary):
+    """Return one of vocabulary Zipf-distributed words."""
+    return 'word{}'.format(
+        min(int(rand.paretovariate(1)) - 1, vocabulary - 1))
+
+
+def pairs(categories, vocabulary):
+    """Return (word, category) pairs of 1 to 5 Zipf-distributed words."""
+    rand = random.Random(0)
+    return [
+        (word(rand, vocabulary), RESOURCE.format(i))
+        for i in range(categories) for _ in range(rand.randint(1, 5))]
+
+
+def queries(count, vocabulary):
+    """Return count lists of 1 to 3 words, distributed like the stored
+    words so that lookups mostly find them."""
+    rand = random.Random(1)
+    return [
+        [word(rand, vocabulary) for _ in range(rand.randint(1, 3))]
+        for _ in range(count)]
+
+
+def run(backend, items, updates, keywords):
+    """Return the load, update and query seconds, the words found and the
+    file bytes of backend."""
+    cwd = tempfile.mkdtemp()
+    try:
+        store = backend(os.path.join(cwd, 'terms'))
+        start = time.time()
+        store.put_many(items)
+        store.flush()
+        loaded = time.time()
+        store.put_many(updates)
+        store.flush()
+        updated = time.time()
+        found = 0
+        for words in keywords:
+            found += len(store.get_many(words))
+        queried = time.time()
+        store.close()
+        size = sum(
+            os.path.getsize(os.path.join(cwd, f)) for f in os.listdir(cwd))
+        return (
+            loaded - start, updated - loaded, queried - updated, found, size)
+    finally:
+        shutil.rmtree(cwd)
+
+
+def main():
+    args = parse_args()
+    updated = args.categories + args.categories // 100
+    items = pairs(updated, args.vocabulary)
+    start = next(
+        i for i, (_, category) in enumerate(items)
+        if category == RESOURCE.format(args.categories))
+    items, updates = items[:start], items[start:]
+    keywords = queries(args.queries, args.vocabulary)
+    print('{} pairs, {} updates, {} queries'.format(
+        len(items), len(updates), len(keywords)))
+    lookups = sum(len(set(words)) for words in keywords)
+    print('{:<8}{:>10}{:>10}{:>10}{:>14}{:>8}{:>12}'.format(
+        'backend', 'load', 'update', 'query', 'queries/sec', 'found',
+        'size'))
+    for name, backend in BACKENDS:
+        load, update, query, found, size = run(
+            backend, items, updates, keywords)
+        print(ROW.format(
+            name, load, update, query, len(keywords) / query,
+            float(found) / lookups, size / 1048576.0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Cold-start benchmark for the querier
+
+Runs a fresh interpreter per backend that imports the querier, opens the
+(empty) images and terms stores and answers one query, and reports the
+best time of each step and of the whole process. The cloud backend is
+only opened, with dummy credentials, since a query would need AWS.
+
+The first stem of a cold stemmer builds the Porter stemmer's rule
+tables; with --vocabulary the stemmer is warm-started as by querier
+--vocabulary, and a query of known words does not build them.
+
+To run:
+$ python startup_benchmark.py --repeat 5
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+import loader
+
+STARTUP = '''
+import json, sys, time
+start = time.time()
+import querier
+imported = time.time()
+name, vocabulary, keywords = sys.argv[1], sys.argv[2], sys.argv[3:]
+if vocabulary:
+    querier.shared_stemmer().load_vocabulary(vocabulary)
+kwargs = {}
+if name == 'cloud':
+    kwargs = dict(region_name='us-east-1', aws_access_key_id='x',
+                  aws_secret_access_key='x')
+backend = querier.STORAGE_CHOICES[name]
+images_kvs = backend(querier.IMAGES_KVS_NAME, **kwargs)
+terms_kvs = backend(querier.TERMS_KVS_NAME, **kwargs)
+opened = time.time()
+if name != 'cloud':
+    querier.query(keywords, images_kvs, terms_kvs)
+queried = time.time()
+print(json.dumps({'import': imported - start, 'open': opened - imported,
+                  'query': queried - opened}))
+'''
+STEPS = ('import', 'open', 'query', 'process')
+
+
+def parse_args(prog='startup_benchmark', description='Startup benchmark.'):
+    parser = ArgumentParser(prog=prog, description=description)
+    parser.add_argument(
+        '--repeat', type=int, default=5, help="best of REPEAT runs")
+    parser.add_argument(
+        '--vocabulary', default='',
+        help="warm-start the stemmer from VOCABULARY")
+    parser.add_argument(
+        'keywords', nargs='*', default=['american'],
+        help="query KEYWORDS after opening the stores")
+    return parser.parse_args()
+
+
+def run(name, vocabulary, keywords, cwd):
+    """Return the seconds of each step of a cold start with backend name."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [
+        os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH')]))
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-c', STARTUP, name, vocabulary] + keywords,
+        cwd=cwd, env=env)
+    seconds = json.loads(output.splitlines()[-1])
+    seconds['process'] = time.time() - start
+    return seconds
+
+
+def main():
+    args = parse_args()
+    vocabulary = args.vocabulary and os.path.abspath(args.vocabulary)
+    print('{:<8}'.format('backend') + ''.join(
+        '{:>10}'.format(step) for step in STEPS))
+    for name in sorted(loader.STORAGE_CHOICES):
+        cwd = tempfile.mkdtemp()
+        try:
+            runs = [
+                run(name, vocabulary, args.keywords, cwd)
+                for _ in range(args.repeat)]
+        finally:
+            shutil.rmtree(cwd)
+        print('{:<8}'.format(name) + ''.join(
+            '{:>9.3f}s'.format(min(seconds[step] for seconds in runs))
+            for step in STEPS))
+
+if __name__ == '__main__':
+    main()
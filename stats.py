@@ -0,0 +1,337 @@
+# Copyright 2016 Shakir James. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Instrumentation of loads and queries
+
+A Recorder counts, for each component (a parser iterator, the stemmer, or
+a store on a backend) and each of its operations, the calls, the items
+they handled, the seconds they took, and a histogram of their latencies.
+The loader and the querier wrap their components with --stats only, so
+that without it nothing is timed.
+
+The seconds of an operation are its own: the time a store's put_many
+spends pulling items from its iterator, which may be parsing or stemming
+them, is left to the stages that produce the items.
+"""
+import json
+import threading
+import time
+
+from collections import OrderedDict
+from kvs import _KVS
+
+# Latency histogram buckets: bucket 0 counts latencies under 1us, and
+# bucket i latencies in [2^(i-1), 2^i) us; the last one counts the rest.
+LATENCY_BUCKETS = 32
+# Latency percentiles of the summary.
+PERCENTILES = (50, 90, 99)
+
+
+class Op(object):
+    """Counters and latency histogram of one operation of a component."""
+    def __init__(self, lock):
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.buckets = [0] * LATENCY_BUCKETS
+        self._lock = lock
+
+    def record(self, seconds, items=1):
+        """Count a call that handled items in seconds."""
+        seconds = max(seconds, 0.0)
+        bucket = min(int(seconds * 1e6).bit_length(), LATENCY_BUCKETS - 1)
+        with self._lock:
+            self.calls += 1
+            self.items += items
+            self.seconds += seconds
+            self.buckets[bucket] += 1
+            if seconds > self.max:
+                self.max = seconds
+
+    @property
+    def rate(self):
+        """Items per second, or None before any time was recorded."""
+        return self.items / self.seconds if self.seconds else None
+
+    def percentile(self, percent):
+        """Return an upper bound of the percent latency percentile."""
+        rank = self.calls * percent / 100.0
+        count = 0
+        for bucket, calls in enumerate(self.buckets):
+            count += calls
+            if calls and count >= rank:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def as_dict(self):
+        latency = OrderedDict(
+            ('p{}'.format(percent), self.percentile(percent))
+            for percent in PERCENTILES)
+        latency['max'] = self.max
+        return OrderedDict([
+            ('calls', self.calls),
+            ('items', self.items),
+            ('seconds', self.seconds),
+            ('rate', self.rate),
+            ('latency', latency),
+            # Upper bound in microseconds => calls.
+            ('histogram', OrderedDict(
+                (str(2 ** bucket), calls)
+                for bucket, calls in enumerate(self.buckets) if calls)),
+        ])
+
+
+class Recorder(object):
+    """Collect the Ops of the instrumented components.
+
+    Components are wrapped with iterator, stemmer and kvs, and can be used
+    from several threads.
+    """
+    def __init__(self):
+        self.ops = OrderedDict()  # (component, operation) => Op
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def op(self, component, name):
+        """Return the Op name of component, added if new."""
+        key = (component, name)
+        op = self.ops.get(key)
+        if op is None:
+            with self._lock:
+                op = self.ops.setdefault(key, Op(self._lock))
+        return op
+
+    def iterator(self, iterable, component, name='next'):
+        """Yield the items of iterable, timing each as an Op of component.
+        """
+        op = self.op(component, name)
+        iterator = iter(iterable)
+        clock = time.time
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            op.record(clock() - start)
+            yield item
+
+    def stemmer(self, stemmer, component='stemmer'):
+        """Wrap stemmer to time its stem and stem_many."""
+        return InstrumentedStemmer(stemmer, self, component)
+
+    def kvs(self, kvs, name, backend):
+        """Wrap kvs, the store name on backend, to time its operations."""
+        return InstrumentedKVS(kvs, self, 'kvs.{}.{}'.format(name, backend))
+
+    def as_dict(self):
+        return OrderedDict([
+            ('seconds', time.time() - self.start),
+            ('ops', [
+                OrderedDict(
+                    [('component', component), ('op', name)] +
+                    op.as_dict().items())
+                for (component, name), op in self.ops.iteritems()
+                if op.calls]),
+        ])
+
+    def dump(self, path):
+        """Write the Ops as JSON to path."""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def summary(self):
+        """Return a table of the Ops that were called, one per line."""
+        header = '{:<22}{:<13}{:>9}{:>11}{:>10}{:>12}'.format(
+            'component', 'op', 'calls', 'items', 'seconds', 'items/sec')
+        lines = [header + ''.join(
+            '{:>10}'.format('p{}'.format(percent))
+            for percent in PERCENTILES) + '{:>10}'.format('max')]
+        for (component, name), op in self.ops.iteritems():
+            if not op.calls:
+                continue
+            lines.append(
+                '{:<22}{:<13}{:>9}{:>11}{:>9.3f}s{:>12,.0f}'.format(
+                    component, name, op.calls, op.items, op.seconds,
+                    op.rate or 0) +
+                ''.join(
+                    _latency(op.percentile(percent))
+                    for percent in PERCENTILES) +
+                _latency(op.max))
+        lines.append('{:.3f}s elapsed'.format(time.time() - self.start))
+        return '\n'.join(lines)
+
+
+def _latency(seconds):
+    """Format seconds in the unit that suits them."""
+    if seconds < 1e-3:
+        return '{:>8.1f}us'.format(seconds * 1e6)
+    if seconds < 1:
+        return '{:>8.1f}ms'.format(seconds * 1e3)
+    return '{:>9.2f}s'.format(seconds)
+
+
+class InstrumentedStemmer(object):
+    """Stemmer wrapper that records the stem and stem_many calls.
+
+    Other attributes, such as the cache hits and misses, are the stemmer's.
+
+    Args:
+        stemmer: object, Stemmer to wrap
+        recorder: object, Recorder of the Ops
+        component: string, component name of the Ops
+    """
+    def __init__(self, stemmer, recorder, component='stemmer'):
+        self.stemmer = stemmer
+        self._stem = recorder.op(component, 'stem')
+        self._stem_many = recorder.op(component, 'stem_many')
+
+    def stem(self, word):
+        start = time.time()
+        stemmed = self.stemmer.stem(word)
+        self._stem.record(time.time() - start)
+        return stemmed
+
+    def stem_many(self, words, processes=None, pool=None):
+        words = list(words)
+        start = time.time()
+        stems = self.stemmer.stem_many(words, processes=processes, pool=pool)
+        self._stem_many.record(time.time() - start, len(words))
+        return stems
+
+    def __getattr__(self, name):
+        return getattr(self.stemmer, name)
+
+
+class InstrumentedKVS(_KVS):
+    """Key-value store wrapper that records the time of each operation.
+
+    The items of put_many and remove_many are counted, and the time spent
+    pulling them from their iterator is not. Attributes that are not part
+    of the KVS interface are the store's.
+
+    Args:
+        kvs: object, key-value store to wrap
+        recorder: object, Recorder of the Ops
+        component: string, component name of the Ops
+    """
+    def __init__(self, kvs, recorder, component):
+        self.kvs = kvs
+        self.recorder = recorder
+        self.component = component
+
+    def _record(self, name, start, items=1, pulling=0.0):
+        self.recorder.op(self.component, name).record(
+            time.time() - start - pulling, items)
+
+    def __contains__(self, key):
+        start = time.time()
+        try:
+            return key in self.kvs
+        finally:
+            self._record('contains', start)
+
+    def get(self, key):
+        start = time.time()
+        try:
+            return self.kvs.get(key)
+        finally:
+            self._record('get', start)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        start = time.time()
+        try:
+            return self.kvs.get_many(keys)
+        finally:
+            self._record('get_many', start, len(keys))
+
+    def put(self, key, value):
+        start = time.time()
+        try:
+            self.kvs.put(key, value)
+        finally:
+            self._record('put', start)
+
+    def put_many(self, items):
+        pulled = [0, 0.0]  # items, seconds
+        start = time.time()
+        try:
+            self.kvs.put_many(_pull(items, pulled))
+        finally:
+            self._record('put_many', start, *pulled)
+
+    def delete(self, key):
+        start = time.time()
+        try:
+            self.kvs.delete(key)
+        finally:
+            self._record('delete', start)
+
+    def remove_many(self, items):
+        pulled = [0, 0.0]
+        start = time.time()
+        try:
+            self.kvs.remove_many(_pull(items, pulled))
+        finally:
+            self._record('remove_many', start, *pulled)
+
+    def keys(self):
+        start = time.time()
+        keys = self.kvs.keys()
+        self._record('keys', start, len(keys))
+        return keys
+
+    def flush(self):
+        start = time.time()
+        try:
+            self.kvs.flush()
+        finally:
+            self._record('flush', start)
+
+    def refresh(self):
+        start = time.time()
+        try:
+            self.kvs.refresh()
+        finally:
+            self._record('refresh', start)
+
+    def close(self):
+        start = time.time()
+        try:
+            self.kvs.close()
+        finally:
+            self._record('close', start)
+
+    def __getattr__(self, name):
+        return getattr(self.kvs, name)
+
+
+def _pull(items, pulled):
+    """Yield items, adding their number and the seconds spent pulling them
+    to pulled."""
+    iterator = iter(items)
+    clock = time.time
+    while True:
+        start = clock()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            pulled[1] += clock() - start
+            return
+        pulled[1] += clock() - start
+        pulled[0] += 1
+        yield item
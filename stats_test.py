@@ -0,0 +1,141 @@
+import json
+import os
+import tempfile
+import time
+import test
+import kvs
+import stats
+
+
+class OpTestCase(test.TestCase):
+    def setUp(self):
+        self.recorder = stats.Recorder()
+        self.op = self.recorder.op('kvs.images.mem', 'get')
+
+    def test_record(self):
+        self.op.record(0.002, items=10)
+        self.op.record(0.004, items=10)
+        self.assertEqual((self.op.calls, self.op.items), (2, 20))
+        self.assertAlmostEqual(self.op.seconds, 0.006)
+        self.assertAlmostEqual(self.op.rate, 20 / 0.006)
+        self.assertEqual(self.op.max, 0.004)
+
+    def test_percentile(self):
+        for _ in range(99):
+            self.op.record(0.000003)
+        self.op.record(0.5)
+        self.assertEqual(self.op.percentile(50), 0.000004)
+        self.assertEqual(self.op.percentile(99), 0.000004)
+        self.assertEqual(self.op.percentile(100), 0.5)
+
+    def test_histogram(self):
+        self.op.record(0.0000005)
+        self.op.record(0.000003)
+        self.op.record(1e6)
+        self.assertEqual(
+            self.op.as_dict()['histogram'],
+            {'1': 1, '4': 1, str(2 ** (stats.LATENCY_BUCKETS - 1)): 1})
+
+    def test_no_calls(self):
+        self.assertIsNone(self.op.rate)
+        self.assertEqual(self.op.percentile(50), 0.0)
+
+
+class RecorderTestCase(test.TestCase):
+    def setUp(self):
+        self.recorder = stats.Recorder()
+
+    def test_op(self):
+        op = self.recorder.op('stemmer', 'stem')
+        self.assertIs(self.recorder.op('stemmer', 'stem'), op)
+        self.assertEqual(self.recorder.ops.keys(), [('stemmer', 'stem')])
+
+    def test_iterator(self):
+        items = list(self.recorder.iterator(range(5), 'parser.images'))
+        self.assertEqual(items, range(5))
+        op = self.recorder.ops[('parser.images', 'next')]
+        self.assertEqual((op.calls, op.items), (5, 5))
+
+    def test_stemmer(self):
+        stemmer = test.mock.Mock(hits=3)
+        stemmer.stem_many.return_value = ['a', 'b']
+        stemmer.stem.return_value = 'c'
+        instrumented = self.recorder.stemmer(stemmer)
+        self.assertEqual(
+            instrumented.stem_many(iter(['as', 'bs'])), ['a', 'b'])
+        self.assertEqual(instrumented.stem('cs'), 'c')
+        self.assertEqual(instrumented.hits, 3)
+        stemmer.stem_many.assert_called_once_with(
+            ['as', 'bs'], processes=None, pool=None)
+        op = self.recorder.ops[('stemmer', 'stem_many')]
+        self.assertEqual((op.calls, op.items), (1, 2))
+        self.assertEqual(self.recorder.ops[('stemmer', 'stem')].calls, 1)
+
+    def test_summary(self):
+        self.recorder.op('kvs.terms.disk', 'put_many').record(0.1, 1000)
+        summary = self.recorder.summary()
+        self.assertIn('kvs.terms.disk', summary)
+        self.assertIn('put_many', summary)
+
+    def test_dump(self):
+        self.recorder.op('kvs.terms.disk', 'put_many').record(0.1, 1000)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.recorder.dump(path)
+            with open(path) as f:
+                dumped = json.load(f)
+        finally:
+            os.unlink(path)
+        op, = dumped['ops']
+        self.assertEqual(
+            (op['component'], op['op'], op['calls'], op['items']),
+            ('kvs.terms.disk', 'put_many', 1, 1000))
+
+
+class InstrumentedKVSTestCase(test.TestCase):
+    def setUp(self):
+        self.recorder = stats.Recorder()
+        self.kvs = self.recorder.kvs(kvs.Dict(), 'images', 'mem')
+
+    def op(self, name):
+        return self.recorder.ops[('kvs.images.mem', name)]
+
+    def test_operations(self):
+        self.kvs.put('a', 1)
+        self.assertEqual(self.kvs.get('a'), set([1]))
+        self.assertIn('a', self.kvs)
+        self.assertEqual(self.kvs.get_many(['a', 'b']), {'a': set([1])})
+        with self.assertRaises(KeyError):
+            self.kvs.get('b')
+        self.kvs.delete('a')
+        self.kvs.flush()
+        self.kvs.refresh()
+        self.kvs.close()
+        for name in ('put', 'contains', 'delete', 'flush', 'refresh',
+                     'close'):
+            self.assertEqual(self.op(name).calls, 1)
+        self.assertEqual(self.op('get').calls, 2)
+        self.assertEqual(self.op('get_many').items, 2)
+
+    def test_put_many(self):
+        def items():
+            for i in range(3):
+                time.sleep(0.02)
+                yield i, i
+        self.kvs.put_many(items())
+        self.kvs.remove_many([(0, 0)])
+        self.assertEqual(self.kvs.keys(), [1, 2])
+        op = self.op('put_many')
+        self.assertEqual((op.calls, op.items), (1, 3))
+        self.assertLess(op.seconds, 0.02)
+        self.assertEqual(self.op('remove_many').items, 1)
+        self.assertEqual(self.op('keys').items, 2)
+
+    def test_attributes(self):
+        store = self.recorder.kvs(
+            test.mock.Mock(path='images.prefixes'), 'images', 'mem')
+        self.assertEqual(store.path, 'images.prefixes')
+
+if __name__ == '__main__':
+    test.main()
@@ -40,6 +40,8 @@ __docformat__ = 'plaintext'
 
 import re
 
+from multiprocessing import Pool
+
 #from nltk.stem.api import StemmerI
 #from nltk.compat import python_2_unicode_compatible
 
@@ -229,6 +231,7 @@ class PorterStemmer():
         Returns True if word ends with a double consonant
         """
         return (
+            len(word) >= 2 and
             word[-1] == word[-2] and
             self._is_consonant(word, len(word)-1)
         )
@@ -690,9 +693,316 @@ class PorterStemmer():
 
         return stem
 
+    def stem_many(self, words, processes=None, pool=None):
+        """Returns the stems of words, in the same order
+
+        Each distinct word is stemmed once. If processes is more than 1,
+        the distinct words are split across a pool of that many
+        processes, which only pays off for large batches. The pool is
+        reused if given, else started for the call.
+        """
+        words = list(words)
+        distinct = list(set(words))
+        if processes and processes > 1 and distinct:
+            chunks = [distinct[i::processes] for i in range(processes)]
+            tasks = [(self, chunk) for chunk in chunks]
+            if pool is not None:
+                results = pool.map(_stem_words, tasks)
+            else:
+                pool = Pool(processes)
+                try:
+                    results = pool.map(_stem_words, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+            distinct = [word for chunk in chunks for word in chunk]
+            stems = [stem for result in results for stem in result]
+        else:
+            stems = [self.stem(word) for word in distinct]
+        lookup = dict(zip(distinct, stems))
+        return [lookup[word] for word in words]
+
     def __repr__(self):
         return '<PorterStemmer>'
 
+
+def _stem_words(task):
+    """Stems a list of words in a pool process"""
+    stemmer, words = task
+    return [stemmer.stem(word) for word in words]
+
+
+class FastPorterStemmer(PorterStemmer):
+    """
+    A Porter stemmer that gives the same results as PorterStemmer, in
+    the same three modes, with less work per word.
+
+    PorterStemmer rebuilds the consonant/vowel sequence of a stem every
+    time a rule checks its measure, and builds its rule lists on every
+    call. This class computes the sequence (the cv profile, one 'c' or
+    'v' per letter) once per word and keeps it in step with the word as
+    suffixes are replaced, so that measures and vowel checks become
+    str.count and str.find calls on the profile. The rule lists of each
+    step are built once, at construction time, into tables that map the
+    last letter of a word to the rules whose suffix ends with it.
+    """
+
+    # Rule conditions, in terms of the stem left once the suffix is removed
+    _M_GT_0 = 1     # (m>0)
+    _M_GT_1 = 2     # (m>1)
+    _ION = 3        # (m>1 and (*S or *T))
+    _LOGI = 4       # (m>0) on the stem plus the 'l' of 'logi' (NLTK)
+    _LL = 5         # (m>1) on the stem plus one 'l' (step 5b)
+
+    def __init__(self, mode=PorterStemmer.NLTK_EXTENSIONS):
+        PorterStemmer.__init__(self, mode)
+
+        step2_rules = [
+            ('ational', 'ate', self._M_GT_0),
+            ('tional', 'tion', self._M_GT_0),
+            ('enci', 'ence', self._M_GT_0),
+            ('anci', 'ance', self._M_GT_0),
+            ('izer', 'ize', self._M_GT_0),
+            ('abli', 'able', self._M_GT_0)
+            if self.mode == self.ORIGINAL_ALGORITHM else
+            ('bli', 'ble', self._M_GT_0),
+            ('alli', 'al', self._M_GT_0),
+            ('entli', 'ent', self._M_GT_0),
+            ('eli', 'e', self._M_GT_0),
+            ('ousli', 'ous', self._M_GT_0),
+            ('ization', 'ize', self._M_GT_0),
+            ('ation', 'ate', self._M_GT_0),
+            ('ator', 'ate', self._M_GT_0),
+            ('alism', 'al', self._M_GT_0),
+            ('iveness', 'ive', self._M_GT_0),
+            ('fulness', 'ful', self._M_GT_0),
+            ('ousness', 'ous', self._M_GT_0),
+            ('aliti', 'al', self._M_GT_0),
+            ('iviti', 'ive', self._M_GT_0),
+            ('biliti', 'ble', self._M_GT_0),
+        ]
+        if self.mode == self.NLTK_EXTENSIONS:
+            step2_rules.append(('fulli', 'ful', self._M_GT_0))
+            step2_rules.append(('logi', 'log', self._LOGI))
+        if self.mode == self.MARTIN_EXTENSIONS:
+            step2_rules.append(('logi', 'log', self._M_GT_0))
+
+        self._step1a_table = self._dispatch_table([
+            ('sses', 'ss', None),
+            ('ies', 'i', None),
+            ('ss', 'ss', None),
+            ('s', '', None),
+        ])
+        self._step2_table = self._dispatch_table(step2_rules)
+        self._step3_table = self._dispatch_table([
+            ('icate', 'ic', self._M_GT_0),
+            ('ative', '', self._M_GT_0),
+            ('alize', 'al', self._M_GT_0),
+            ('iciti', 'ic', self._M_GT_0),
+            ('ical', 'ic', self._M_GT_0),
+            ('ful', '', self._M_GT_0),
+            ('ness', '', self._M_GT_0),
+        ])
+        self._step4_table = self._dispatch_table([
+            ('al', '', self._M_GT_1),
+            ('ance', '', self._M_GT_1),
+            ('ence', '', self._M_GT_1),
+            ('er', '', self._M_GT_1),
+            ('ic', '', self._M_GT_1),
+            ('able', '', self._M_GT_1),
+            ('ible', '', self._M_GT_1),
+            ('ant', '', self._M_GT_1),
+            ('ement', '', self._M_GT_1),
+            ('ment', '', self._M_GT_1),
+            ('ent', '', self._M_GT_1),
+            ('ion', '', self._ION),
+            ('ou', '', self._M_GT_1),
+            ('ism', '', self._M_GT_1),
+            ('ate', '', self._M_GT_1),
+            ('iti', '', self._M_GT_1),
+            ('ous', '', self._M_GT_1),
+            ('ive', '', self._M_GT_1),
+            ('ize', '', self._M_GT_1),
+        ])
+        self._step5b_table = self._dispatch_table([('ll', 'l', self._LL)])
+
+    def _dispatch_table(self, rules):
+        """Group (suffix, replacement, condition) rules by last letter
+
+        Rules keep their relative order, and each carries the cv profile
+        of its replacement (which never contains a 'y', so the profile
+        doesn't depend on the letter before it).
+        """
+        table = {}
+        for suffix, replacement, condition in rules:
+            table.setdefault(suffix[-1], []).append(
+                (suffix, replacement, self._profile(replacement), condition)
+            )
+        return table
+
+    def _profile(self, word, previous=''):
+        """Returns the cv profile of word
+
+        `previous` is the profile of the letter before word, if any; a
+        'y' is a vowel only when it follows a consonant.
+        """
+        vowels = self.vowels
+        if 'y' not in word:
+            return ''.join(['v' if ch in vowels else 'c' for ch in word])
+        profile = []
+        for ch in word:
+            if ch in vowels or (ch == 'y' and previous == 'c'):
+                previous = 'v'
+            else:
+                previous = 'c'
+            profile.append(previous)
+        return ''.join(profile)
+
+    def _condition(self, condition, word, cv, n):
+        """Checks a rule condition on the stem word[:n]"""
+        if condition is None:
+            return True
+        if condition == self._M_GT_0:
+            return cv.find('vc', 0, n) >= 0
+        if condition == self._M_GT_1:
+            return cv.count('vc', 0, n) > 1
+        if condition == self._ION:
+            return cv.count('vc', 0, n) > 1 and word[n - 1] in ('s', 't')
+        if condition == self._LOGI:
+            return cv.find('vc', 0, n + 1) >= 0
+        return cv.count('vc', 0, n + 1) > 1  # _LL
+
+    def _apply_table(self, word, cv, table):
+        """Applies the first applicable rule of a dispatch table"""
+        for suffix, replacement, replacement_cv, condition in table.get(
+                word[-1:], ()):
+            if word.endswith(suffix):
+                n = len(word) - len(suffix)
+                if self._condition(condition, word, cv, n):
+                    return word[:n] + replacement, cv[:n] + replacement_cv
+                # Don't try any further rules
+                return word, cv
+        return word, cv
+
+    def _ends_cvc_profile(self, word, cv):
+        """Implements condition *o on a word and its profile"""
+        n = len(word)
+        return (
+            n >= 3 and
+            cv[n - 3:] == 'cvc' and
+            word[-1] not in ('w', 'x', 'y')
+        ) or (
+            self.mode == self.NLTK_EXTENSIONS and
+            cv == 'vc'
+        )
+
+    def _cv_step1a(self, word, cv):
+        if self.mode == self.NLTK_EXTENSIONS:
+            if word.endswith('ies') and len(word) == 4:
+                return word[:-3] + 'ie', cv[:-3] + 'vv'
+        return self._apply_table(word, cv, self._step1a_table)
+
+    def _cv_step1b(self, word, cv):
+        if self.mode == self.NLTK_EXTENSIONS:
+            if word.endswith('ied'):
+                if len(word) == 4:
+                    return word[:-3] + 'ie', cv[:-3] + 'vv'
+                else:
+                    return word[:-3] + 'i', cv[:-3] + 'v'
+
+        # (m>0) EED -> EE
+        if word.endswith('eed'):
+            if cv.find('vc', 0, len(word) - 3) >= 0:
+                return word[:-1], cv[:-1]
+            else:
+                return word, cv
+
+        # (*v*) ED -> , (*v*) ING ->
+        for suffix in ('ed', 'ing'):
+            if word.endswith(suffix):
+                n = len(word) - len(suffix)
+                if cv.find('v', 0, n) >= 0:
+                    break
+        else:
+            return word, cv
+        word, cv = word[:n], cv[:n]
+
+        # AT -> ATE, BL -> BLE, IZ -> IZE
+        if word.endswith(('at', 'bl', 'iz')):
+            return word + 'e', cv + 'v'
+        # (*d and not (*L or *S or *Z)) -> single letter. Like
+        # PorterStemmer, also take a literal '*d' suffix for the rule.
+        if (
+            (len(word) >= 2 and word[-1] == word[-2] and cv[-1] == 'c') or
+            word.endswith('*d')
+        ):
+            if word[-1] not in ('l', 's', 'z'):
+                return (
+                    word[:-2] + word[-1],
+                    cv[:-2] + self._profile(word[-1], cv[-3:-2])
+                )
+            return word, cv
+        # (m=1 and *o) -> E
+        if cv.count('vc') == 1 and self._ends_cvc_profile(word, cv):
+            return word + 'e', cv + 'v'
+        return word, cv
+
+    def _cv_step1c(self, word, cv):
+        if word.endswith('y'):
+            n = len(word) - 1
+            if self.mode == self.NLTK_EXTENSIONS:
+                applies = n > 1 and cv[n - 1] == 'c'
+            else:
+                applies = cv.find('v', 0, n) >= 0
+            if applies:
+                return word[:n] + 'i', cv[:n] + 'v'
+        return word, cv
+
+    def _cv_step2(self, word, cv):
+        if self.mode == self.NLTK_EXTENSIONS:
+            # Apply ALLI -> AL first and run the result through step2
+            # again, as PorterStemmer._step2 does.
+            if word.endswith('alli') and cv.find('vc', 0, len(word) - 4) >= 0:
+                return self._cv_step2(word[:-2], cv[:-2])
+        return self._apply_table(word, cv, self._step2_table)
+
+    def _cv_step5a(self, word, cv):
+        if word.endswith('e'):
+            n = len(word) - 1
+            measure = cv.count('vc', 0, n)
+            if measure > 1:
+                return word[:n], cv[:n]
+            if measure == 1 and not self._ends_cvc_profile(word[:n], cv[:n]):
+                return word[:n], cv[:n]
+        return word, cv
+
+    def stem(self, word):
+        stem = word.lower()
+
+        if self.mode == self.NLTK_EXTENSIONS and word in self.pool:
+            return self.pool[word]
+
+        if self.mode != self.ORIGINAL_ALGORITHM and len(word) <= 2:
+            # With this line, strings of length 1 or 2 don't go through
+            # the stemming process, although no mention is made of this
+            # in the published algorithm.
+            return word
+
+        cv = self._profile(stem)
+        stem, cv = self._cv_step1a(stem, cv)
+        stem, cv = self._cv_step1b(stem, cv)
+        stem, cv = self._cv_step1c(stem, cv)
+        stem, cv = self._cv_step2(stem, cv)
+        stem, cv = self._apply_table(stem, cv, self._step3_table)
+        stem, cv = self._apply_table(stem, cv, self._step4_table)
+        stem, cv = self._cv_step5a(stem, cv)
+        stem, cv = self._apply_table(stem, cv, self._step5b_table)
+
+        return stem
+
+    def __repr__(self):
+        return '<FastPorterStemmer>'
+
 # def demo():
 #     """
 #     A demonstration of the porter stemmer on a sample from
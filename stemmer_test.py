@@ -0,0 +1,92 @@
+import itertools
+import random
+import test
+
+from stemmer import FastPorterStemmer, PorterStemmer
+
+MODES = [
+    PorterStemmer.NLTK_EXTENSIONS,
+    PorterStemmer.MARTIN_EXTENSIONS,
+    PorterStemmer.ORIGINAL_ALGORITHM,
+]
+
+STEMS = [
+    '', 'a', 'y', 'by', 'sky', 'tr', 'tree', 'hop', 'fil', 'fail', 'controll',
+    'agr', 'plaster', 'motor', 'conflat', 'troubl', 'siz', 'hopp', 'tann',
+    'fall', 'hiss', 'fizz', 'happ', 'enjo', 'relat', 'condit', 'valen',
+    'hesit', 'digit', 'conform', 'radic', 'differ', 'vil', 'analog', 'vietnam',
+    'predic', 'oper', 'feud', 'decis', 'hope', 'call', 'form', 'sensi',
+    'electr', 'good', 'reviv', 'allow', 'infer', 'airlin', 'gyroscop', 'adjust',
+    'defens', 'irrit', 'replac', 'depend', 'adopt', 'homolog', 'commun',
+    'activ', 'angular', 'effect', 'bowdler', 'probat', 'rat', 'ceas', 'geo',
+    'archaeo', 'syzyg', 'toy', 'ivy', 'orrer', 'oat', 'yell', 'spi', 'di',
+]
+
+SUFFIXES = [
+    '', 's', 'es', 'sses', 'ies', 'ss', 'ed', 'eed', 'ied', 'ing', 'ings',
+    'y', 'ly', 'li', 'ational', 'tional', 'enci', 'anci', 'izer', 'abli',
+    'bli', 'alli', 'entli', 'eli', 'ousli', 'ization', 'ation', 'ator',
+    'alism', 'iveness', 'fulness', 'ousness', 'aliti', 'iviti', 'biliti',
+    'fulli', 'logi', 'icate', 'ative', 'alize', 'iciti', 'ical', 'ful', 'ness',
+    'al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment',
+    'ent', 'sion', 'tion', 'ion', 'ou', 'ism', 'ate', 'iti', 'ous', 'ive',
+    'ize', 'e', 'll', 'atedly', 'fullies', 'ationalism', 'yed', 'ying',
+]
+
+
+def words():
+    """Yield a large list of words that exercise every rule."""
+    for stem, suffix in itertools.product(STEMS, SUFFIXES):
+        yield stem + suffix
+    rand = random.Random(0)
+    letters = 'aeiouyybcdlmnrstwxz'
+    for _ in range(20000):
+        stem = ''.join(
+            rand.choice(letters) for _ in range(rand.randint(1, 8)))
+        yield stem + rand.choice(SUFFIXES)
+    for word in ['Caresses', 'PONIES', 'dying', 'skies', 'a*ded', 'x*ding']:
+        yield word
+
+
+def outcome(stemmer, word):
+    try:
+        return stemmer.stem(word)
+    except IndexError:
+        return IndexError
+
+
+class FastPorterStemmerTestCase(test.TestCase):
+    def test_equivalence(self):
+        word_list = list(words())
+        self.assertGreater(len(word_list), 25000)
+        for mode in MODES:
+            stemmer = PorterStemmer(mode)
+            fast_stemmer = FastPorterStemmer(mode)
+            for word in word_list:
+                self.assertEqual(
+                    outcome(fast_stemmer, word), outcome(stemmer, word),
+                    '{} ({})'.format(word, mode))
+
+    def test_single_letter_stem(self):
+        for mode in MODES:
+            for stemmer in (PorterStemmer(mode), FastPorterStemmer(mode)):
+                self.assertEqual(
+                    [stemmer.stem(word) for word in ('aed', 'oings')],
+                    ['a', 'o'])
+
+    def test_stem_many(self):
+        stemmer = FastPorterStemmer()
+        word_list = STEMS[:20] + SUFFIXES[:20] + STEMS[:20]
+        expected = [stemmer.stem(word) for word in word_list]
+        self.assertEqual(stemmer.stem_many(word_list), expected)
+        self.assertEqual(stemmer.stem_many(word_list, processes=2), expected)
+        self.assertEqual(
+            PorterStemmer().stem_many(word_list, processes=2), expected)
+
+    def test_mode(self):
+        with self.assertRaises(ValueError):
+            FastPorterStemmer('mode')
+
+
+if __name__ == '__main__':
+    test.main()
@@ -17,10 +17,17 @@ except ImportError:
 TEST_DYNAMODB_LOCAL = False
 
 _TEST_MODULES = [
+    'bloom_test',
+    'datagen_test',
+    'delta_test',
     'kvs_test',
     'loader_test',
     'parser_test',
+    'postings_test',
     'querier_test',
+    'server_test',
+    'stats_test',
+    'stemmer_test',
 ]
 
 